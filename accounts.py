@@ -0,0 +1,255 @@
+"""
+Account Manager
+Serves many accounts from one process:
+- Hash index from account ID to compact per-account state
+- One lock per account, so operations on different accounts never contend
+- Balance checks and updates happen under the lock, so racing
+  withdrawals can never take a balance below zero
+- Transfers lock every account involved in ID order, so concurrent
+  transfers cannot deadlock, and commit all legs or none
+- Reset and restore retire an account's state under its lock, so an
+  operation racing them never writes the old state back
+- An optional scorer (fraud.py) sees every event as it is logged
+- Every balance change is an event applied with events.transition(),
+  timestamped by an injectable clock, so a recorded log replays to the
+  same state (see replay.py)
+"""
+
+import threading
+import time
+
+from errors import InvalidTransfer, PinAlreadySet, PinNotSet, UnknownAccount
+from events import transition
+from ledger import PIN_CREATED, PIN_CHANGED, DEPOSIT, WITHDRAW, BALANCE_CHECK, TRANSFER_OUT, TRANSFER_IN
+from storage import MemoryStorage
+
+
+class Account:
+    """State for a single account"""
+
+    __slots__ = ("account_id", "pin", "balance", "ledger", "lock", "dead")
+
+    def __init__(self, account_id, pin, balance, ledger):
+        self.account_id = account_id
+        self.pin = pin
+        self.balance = balance
+        self.ledger = ledger
+        self.lock = threading.Lock()
+        self.dead = False   # set under the lock once reset or restored away
+
+
+class AccountManager:
+    """Hash-indexed collection of accounts with per-account locking.
+
+    With `history=False` accounts are loaded without a ledger (their
+    `ledger` is None) and events only go to storage, for bulk tools that
+    never read history back.
+    """
+
+    def __init__(self, storage=None, scorer=None, clock=time.time, history=True):
+        self.storage = storage if storage is not None else MemoryStorage()
+        self.scorer = scorer
+        self.clock = clock
+        self.history = history
+        self._accounts = {}
+        self._registry_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def __contains__(self, account_id):
+        return account_id in self._accounts or self.storage.get_account(account_id) is not None
+
+    def get(self, account_id):
+        """Return the account, loading it from storage on first use"""
+        account = self._accounts.get(account_id)
+        if account is not None:
+            return account
+        with self._registry_lock:
+            account = self._accounts.get(account_id)
+            if account is None:
+                pin, balance = self.storage.get_account(account_id) or ("", 0)
+                ledger = self.storage.load_ledger(account_id) if self.history else None
+                account = Account(account_id, pin, balance, ledger)
+                self._accounts[account_id] = account
+        return account
+
+    def find(self, account_id):
+        """Return the account if it exists, or None; unknown IDs are not
+        loaded into memory, so lookups by untrusted clients stay cheap"""
+        account = self._accounts.get(account_id)
+        if account is None and self.storage.get_account(account_id) is not None:
+            account = self.get(account_id)
+        return account
+
+    def _lock(self, account_id):
+        """Return the account with its lock held.
+
+        A thread may fetch an account just before another resets or
+        restores it; writing through that stale object would bring the old
+        state back. Such accounts are marked dead under their lock, so the
+        current one is fetched again instead."""
+        while True:
+            account = self.get(account_id)
+            account.lock.acquire()
+            if not account.dead:
+                return account
+            account.lock.release()
+
+    def _drop(self, account):
+        """Unregister an account; caller holds its lock"""
+        account.dead = True
+        with self._registry_lock:
+            if self._accounts.get(account.account_id) is account:
+                del self._accounts[account.account_id]
+
+    def _record(self, account, kind, amount=0):
+        """Append to the account's ledger and persist; caller holds the lock"""
+        timestamp = self.clock()
+        if account.ledger is not None:
+            account.ledger.append(kind, amount, account.balance, timestamp)
+        self.storage.record(account.account_id, account.pin, account.balance, kind, amount, timestamp)
+        if self.scorer is not None:
+            self.scorer.observe(account.account_id, kind, amount, account.balance, timestamp)
+
+    def create_pin(self, account_id, pin):
+        """Set the PIN of an account that does not have one yet"""
+        account = self._lock(account_id)
+        try:
+            if account.pin:
+                raise PinAlreadySet()
+            account.pin = pin
+            self._record(account, PIN_CREATED)
+        finally:
+            account.lock.release()
+
+    def change_pin(self, account_id, pin):
+        """Replace an existing PIN"""
+        account = self._lock(account_id)
+        try:
+            if not account.pin:
+                raise PinNotSet()
+            account.pin = pin
+            self._record(account, PIN_CHANGED)
+        finally:
+            account.lock.release()
+
+    def apply(self, account_id, kind, amount=0):
+        """Apply one balance event to an account, log it and return the new balance"""
+        account = self._lock(account_id)
+        try:
+            account.balance = transition(kind, amount, account.balance)
+            self._record(account, kind, amount)
+            return account.balance
+        finally:
+            account.lock.release()
+
+    def deposit(self, account_id, amount, kind=DEPOSIT):
+        """Add funds and return the new balance"""
+        return self.apply(account_id, kind, amount)
+
+    def withdraw(self, account_id, amount, kind=WITHDRAW):
+        """Remove funds and return the new balance; refuses to overdraw"""
+        return self.apply(account_id, kind, amount)
+
+    def transfer(self, from_account, to_account, amount):
+        """Move funds between two accounts and return the payer's new balance"""
+        return self.transfer_many([(from_account, to_account, amount)])[from_account]
+
+    def transfer_many(self, legs):
+        """Apply (from, to, amount) legs all or nothing.
+
+        Every account involved is locked in ID order, all legs are checked
+        against running balances before anything changes, and the events
+        are persisted as one group with a shared timestamp. Returns the new
+        balance of every account involved.
+        """
+        for leg in legs:
+            for account_id in leg[:2]:
+                if self.find(account_id) is None:
+                    raise UnknownAccount(account_id)
+        while True:
+            accounts = {account_id: self.get(account_id) for leg in legs for account_id in leg[:2]}
+            ordered = [accounts[account_id] for account_id in sorted(accounts)]
+            for account in ordered:
+                account.lock.acquire()
+            if not any(account.dead for account in ordered):
+                break
+            # One of them was reset meanwhile (see _lock): fetch them again
+            for account in reversed(ordered):
+                account.lock.release()
+        try:
+            balances = {account_id: account.balance for account_id, account in accounts.items()}
+            for from_account, to_account, amount in legs:
+                if from_account == to_account:
+                    raise InvalidTransfer()
+                for account_id in (from_account, to_account):
+                    if not accounts[account_id].pin:
+                        raise UnknownAccount(account_id)
+                balances[from_account] = transition(TRANSFER_OUT, amount, balances[from_account])
+                balances[to_account] = transition(TRANSFER_IN, amount, balances[to_account])
+
+            timestamp = self.clock()
+            events = []
+            for from_account, to_account, amount in legs:
+                for account, kind in ((accounts[from_account], TRANSFER_OUT), (accounts[to_account], TRANSFER_IN)):
+                    account.balance = transition(kind, amount, account.balance)
+                    if account.ledger is not None:
+                        account.ledger.append(kind, amount, account.balance, timestamp)
+                    events.append((account.account_id, account.pin, account.balance, kind, amount, timestamp))
+            self.storage.record_group(events)
+            if self.scorer is not None:
+                for account_id, _, balance, kind, amount, _ in events:
+                    self.scorer.observe(account_id, kind, amount, balance, timestamp)
+            return balances
+        finally:
+            for account in reversed(ordered):
+                account.lock.release()
+
+    def check_balance(self, account_id):
+        """Return the balance and log the balance check"""
+        return self.apply(account_id, BALANCE_CHECK)
+
+    def reset(self, account_id):
+        """Forget an account entirely"""
+        account = self._lock(account_id)
+        try:
+            self.storage.delete_account(account_id)
+            self._drop(account)
+        finally:
+            account.lock.release()
+
+    def undo_reset(self, account_id):
+        """Bring back an account reset since the latest snapshot"""
+        account = self._lock(account_id)
+        try:
+            self.storage.undo_reset(account_id)
+            self._drop(account)
+        finally:
+            account.lock.release()
+
+    def restore(self, account_id=None):
+        """Undo an account's reset, or roll one account (or every account)
+        back to the latest snapshot"""
+        if account_id is not None:
+            account = self._lock(account_id)
+            try:
+                self.storage.restore(account_id)
+                self._drop(account)
+            finally:
+                account.lock.release()
+            return
+        # Account locks before the registry lock, as in reset()
+        with self._registry_lock:
+            accounts = sorted(self._accounts.items())
+        for _, account in accounts:
+            account.lock.acquire()
+        try:
+            with self._registry_lock:
+                self.storage.restore()
+                for account in self._accounts.values():
+                    account.dead = True
+                self._accounts.clear()
+        finally:
+            for _, account in accounts:
+                account.lock.release()
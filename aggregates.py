@@ -0,0 +1,108 @@
+"""
+Account Aggregates
+Running totals kept up to date on every ledger append so dashboard
+metrics read in constant time regardless of history length.
+"""
+
+from events import PIN_CREATED, PIN_CHANGED, DEPOSIT, WITHDRAW, BALANCE_CHECK, TRANSFER_OUT, TRANSFER_IN
+
+
+class AccountAggregates:
+    """Incrementally maintained counts, totals and extremes for one account"""
+
+    __slots__ = (
+        "transactions",
+        "deposit_count", "deposit_total", "deposit_min", "deposit_max",
+        "withdraw_count", "withdraw_total", "withdraw_min", "withdraw_max",
+        "balance_checks", "pin_events",
+        "min_balance", "max_balance",
+        "first_activity", "last_activity",
+        # Appended last so older snapshots still line up
+        "transfer_in_count", "transfer_in_total", "transfer_out_count", "transfer_out_total",
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Clear every aggregate back to its empty state"""
+        self.transactions = 0
+        self.deposit_count = 0
+        self.deposit_total = 0
+        self.deposit_min = None
+        self.deposit_max = None
+        self.withdraw_count = 0
+        self.withdraw_total = 0
+        self.withdraw_min = None
+        self.withdraw_max = None
+        self.balance_checks = 0
+        self.pin_events = 0
+        self.min_balance = None
+        self.max_balance = None
+        self.first_activity = None
+        self.last_activity = None
+        self.transfer_in_count = 0
+        self.transfer_in_total = 0
+        self.transfer_out_count = 0
+        self.transfer_out_total = 0
+
+    def update(self, timestamp, kind, amount, balance):
+        """Fold a single event into the aggregates"""
+        self.transactions += 1
+        if kind == DEPOSIT:
+            self.deposit_count += 1
+            self.deposit_total += amount
+            if self.deposit_min is None or amount < self.deposit_min:
+                self.deposit_min = amount
+            if self.deposit_max is None or amount > self.deposit_max:
+                self.deposit_max = amount
+        elif kind == WITHDRAW:
+            self.withdraw_count += 1
+            self.withdraw_total += amount
+            if self.withdraw_min is None or amount < self.withdraw_min:
+                self.withdraw_min = amount
+            if self.withdraw_max is None or amount > self.withdraw_max:
+                self.withdraw_max = amount
+        elif kind == BALANCE_CHECK:
+            self.balance_checks += 1
+        elif kind == PIN_CREATED or kind == PIN_CHANGED:
+            self.pin_events += 1
+        elif kind == TRANSFER_OUT:
+            self.transfer_out_count += 1
+            self.transfer_out_total += amount
+        elif kind == TRANSFER_IN:
+            self.transfer_in_count += 1
+            self.transfer_in_total += amount
+
+        if self.min_balance is None or balance < self.min_balance:
+            self.min_balance = balance
+        if self.max_balance is None or balance > self.max_balance:
+            self.max_balance = balance
+        if self.first_activity is None:
+            self.first_activity = timestamp
+        self.last_activity = timestamp
+
+    def rebuild(self, ledger):
+        """Recompute everything from a ledger in a single pass, archived
+        records included"""
+        self.reset()
+        update = self.update
+        for chunk in ledger.columns(None, 0, len(ledger), ledger.segment_size):
+            for row in zip(*chunk):
+                update(*row)
+        return self
+
+    def state(self):
+        """Every aggregate as a plain list, for snapshots"""
+        return [getattr(self, name) for name in self.__slots__]
+
+    def load(self, state):
+        """Restore aggregates saved by state()"""
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+        return self
+
+    @classmethod
+    def from_ledger(cls, ledger):
+        """Build aggregates for an existing ledger"""
+        return cls().rebuild(ledger)
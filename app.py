@@ -1,14 +1,43 @@
 # app.py
 import streamlit as st
-from datetime import datetime
+import tempfile
+import uuid
+from datetime import datetime, time, timedelta
+
+import metrics
+from accounts import AccountManager
+from cassettes import Cassettes
+from core import ATMCore
+from fraud import AnomalyScorer
+from limits import WithdrawalLimits
+from errors import ATMError, InvalidPin
+from ledger import (
+    PIN_CREATED, PIN_CHANGED, DEPOSIT, WITHDRAW, TRANSFER_OUT, TRANSFER_IN,
+    CATEGORY_DEPOSIT, CATEGORY_WITHDRAW, CATEGORY_BALANCE_CHECK, CATEGORY_PIN, CATEGORY_TRANSFER,
+)
+from rollups import DAY, WEEK, MONTH
+from storage import DEFAULT_ACCOUNT, open_storage
 
 # ---------------------------
 # App Config
 # ---------------------------
 st.set_page_config(page_title="ATM Simulator", page_icon="💳", layout="centered")
 
+# Optional per-rerun profiling (hook chosen in the debug panel)
+PROFILE_HOOKS = {"Off": None, "cProfile": "cprofile", "Sampling": "sampling"}
+metrics.inc("atm_app_reruns_total")
+leftover = st.session_state.pop("profiler", None)
+if leftover is not None:
+    # The previous rerun ended early (st.stop/st.rerun) before stopping it
+    st.session_state.profile_report = leftover.stop("app_rerun")
+hook = PROFILE_HOOKS.get(st.session_state.get("profile_hook"))
+if hook:
+    st.session_state.profiler = metrics.PROFILERS[hook]()
+    st.session_state.profiler.start("app_rerun")
+
 # Custom CSS for better styling
-st.markdown("""
+with metrics.timer("atm_render", part="css"):
+    st.markdown("""
 <style>
     /* Main container styling */
     .main {
@@ -86,39 +115,131 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ---------------------------
+# ATM Core (shared by every session in this process)
+# ---------------------------
+@st.cache_resource
+def get_core():
+    storage = open_storage()
+    return ATMCore(AccountManager(storage, scorer=AnomalyScorer()), cassettes=Cassettes(),
+                   limits=WithdrawalLimits(storage))
+
+core = get_core()
+
 # ---------------------------
 # Session State Initialization
 # ---------------------------
-if "pin" not in st.session_state:
-    st.session_state.pin = ""           
-if "balance" not in st.session_state:
-    st.session_state.balance = 0
+if "account_id" not in st.session_state:
+    st.session_state.account_id = DEFAULT_ACCOUNT
 if "is_authenticated" not in st.session_state:
     st.session_state.is_authenticated = False
-if "history" not in st.session_state:
-    st.session_state.history = []   # transaction history
+if "authenticated_account" not in st.session_state:
+    st.session_state.authenticated_account = None
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
 
 # ---------------------------
 # Helpers
 # ---------------------------
-def log_action(action: str):
-    """Add action to history with timestamp and balance."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    st.session_state.history.append(f"[{timestamp}] {action} | Balance: {st.session_state.balance}")
+
+HISTORY_FILTERS = {
+    "All": None,
+    "Deposits Only": CATEGORY_DEPOSIT,
+    "Withdrawals Only": CATEGORY_WITHDRAW,
+    "Transfers": CATEGORY_TRANSFER,
+    "Balance Checks": CATEGORY_BALANCE_CHECK,
+    "PIN Changes": CATEGORY_PIN,
+}
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+def day_start(day) -> float:
+    """Epoch timestamp of local midnight for a date."""
+    return datetime.combine(day, time.min).timestamp()
 
 def require_pin_set() -> bool:
-    if not st.session_state.pin:
+    if not core.has_pin(account_id):
         st.warning("Please create a PIN first (Sidebar → Create PIN).")
         return False
     return True
 
-def authenticate(pin_input: str) -> bool:
-    ok = (pin_input == st.session_state.pin)
-    st.session_state.is_authenticated = ok
-    return ok
+def is_authenticated() -> bool:
+    """Whether this session has entered the current account's PIN.
+
+    The core is shared by every session, so an account's balance and
+    history are only shown to sessions that proved they know its PIN.
+    """
+    return st.session_state.is_authenticated and st.session_state.authenticated_account == account_id
+
+def mark_authenticated():
+    st.session_state.is_authenticated = True
+    st.session_state.authenticated_account = account_id
+
+def check_pin(pin_input: str) -> bool:
+    """Verify a PIN for the current account, showing any error."""
+    try:
+        core.verify_pin(account_id, pin_input)
+    except ATMError as exc:
+        reset_auth()
+        error(f"❌ {exc}")
+        return False
+    mark_authenticated()
+    return True
+
+def unlock(form: str) -> bool:
+    """Ask for the PIN before showing account details; True once entered."""
+    if is_authenticated():
+        return True
+    st.info("🔒 Enter your PIN to view this account.")
+    with st.form(form, clear_on_submit=True):
+        pin_input = st.text_input("🔐 Enter your PIN", type="password", placeholder="Enter 4-6 digit PIN")
+        if st.form_submit_button("🔓 Unlock", use_container_width=True) and check_pin(pin_input):
+            st.rerun()
+    return False
+
+def perform(operation, *args, **kwargs):
+    """Run a core operation for the current account; shows errors and returns the Result or None."""
+    try:
+        result = operation(account_id, *args, **kwargs)
+    except InvalidPin:
+        reset_auth()
+        error("❌ Invalid PIN.")
+        return None
+    except ATMError as exc:
+        error(f"❌ {exc}")
+        return None
+    mark_authenticated()
+    return result
+
+def request_key(form: str, submitted: bool) -> str:
+    """Idempotency key for the form currently on screen.
+
+    Every run that renders the form without submitting it issues a new
+    key, and the run that submits it reuses that key. A double-submit
+    (a second click interrupting the first run) therefore replays the
+    first result instead of moving the money twice.
+
+    Limits: a click after the result was shown is a new request, and
+    keys live in the browser session, so a reload or a second tab
+    submitting the same form is not recognised as a retry.
+    """
+    name = f"{form}_request_key"
+    if not submitted or name not in st.session_state:
+        st.session_state[name] = uuid.uuid4().hex
+    return st.session_state[name]
+
+def next_request_key(form: str):
+    """Issue a new key once a submission has been handled, whatever its
+    outcome, since the form is cleared for the next one."""
+    st.session_state[f"{form}_request_key"] = uuid.uuid4().hex
 
 def reset_auth():
     st.session_state.is_authenticated = False
+    st.session_state.authenticated_account = None
+
+def switch_account():
+    reset_auth()
+    st.session_state.history_page = 0
 
 def success(msg: str):
     st.success(msg)
@@ -126,15 +247,221 @@ def success(msg: str):
 def error(msg: str):
     st.error(msg)
 
+# ---------------------------
+# Cached Renderers
+# Keyed on the ledger version, so they are recomputed only after the
+# ledger changes. Leading-underscore arguments are not hashed.
+# ---------------------------
+CARD_STYLES = {
+    DEPOSIT: ("📥", "#d4edda"),
+    WITHDRAW: ("📤", "#f8d7da"),
+    TRANSFER_OUT: ("🔁", "#fff3cd"),
+    TRANSFER_IN: ("🔁", "#fff3cd"),
+    PIN_CREATED: ("🔐", "#d1ecf1"),
+    PIN_CHANGED: ("🔐", "#d1ecf1"),
+}
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def history_page_html(_view, version: int, filter_key: tuple, page: int, page_size: int) -> str:
+    """One HTML block holding every card on a history page."""
+    cards = []
+    for i, record in enumerate(_view.page(page, page_size), page * page_size + 1):
+        icon, color = CARD_STYLES.get(record.kind, ("ℹ️", "#e2e3e5"))
+        cards.append(f"""
+        <div style="background-color: {color}; padding: 15px; border-radius: 10px; margin: 10px 0; border-left: 5px solid #667eea;">
+            <strong>{icon} {i}.</strong> {record.format()}
+        </div>""")
+    return "".join(cards)
+
+ACTIVITY_PERIODS = {
+    "Daily": (DAY, 30),
+    "Weekly": (WEEK, 26),
+    "Monthly": (MONTH, 12),
+}
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def activity_chart_data(_ledger, version: int, period: str, count: int) -> dict:
+    """Per-period totals and closing balances from the ledger's rollups"""
+    rollup = _ledger.rollups[period]
+    buckets = rollup.last(count)
+    return {
+        "Period": [rollup.label(bucket) for bucket in buckets],
+        "Deposits": [bucket.deposit_total for bucket in buckets],
+        "Withdrawals": [bucket.withdraw_total for bucket in buckets],
+        "Closing Balance": [bucket.closing_balance for bucket in buckets],
+    }
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def recent_html(_ledger, version: int, count: int = 5) -> str:
+    """The dashboard's recent transactions as one HTML block."""
+    return "".join(f"""
+        <div class="transaction-card">
+            <strong>{i}.</strong> {record.format()}
+        </div>""" for i, record in enumerate(_ledger.tail(count), 1))
+
+# ---------------------------
+# Fragments
+# Re-render on their own without rerunning the whole script.
+# ---------------------------
+@st.fragment(run_every="15s")
+def account_overview(account_id: str):
+    """Balance cards and recent transactions, refreshed in place."""
+    ledger = core.ledger(account_id)
+    alerts = core.accounts.scorer.alerts.recent(account_id, 5)
+
+    # Account overview cards
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric(
+            label="💰 Current Balance",
+            value=f"${core.balance(account_id)}",
+            delta=None
+        )
+    
+    with col2:
+        st.metric(
+            label="📝 Total Transactions",
+            value=ledger.stats.transactions
+        )
+    
+    with col3:
+        st.metric(
+            label="🔐 Account Status",
+            value="Flagged" if alerts else "Active"
+        )
+    
+    stats = ledger.stats
+    if stats.last_activity is not None:
+        last_seen = datetime.fromtimestamp(stats.last_activity).strftime("%Y-%m-%d %H:%M:%S")
+        st.caption(f"🕒 Last activity: {last_seen}")
+    
+    st.markdown("---")
+    
+    # Unusual activity flagged by the fraud scorer
+    if alerts:
+        st.subheader("🚨 Alerts")
+        for alert in alerts:
+            st.warning(f"🚨 {alert.describe()}")
+        st.markdown("---")
+    
+    # Activity charts (served from the rollups, not the raw history)
+    if ledger.stats.deposit_count or ledger.stats.withdraw_count:
+        st.subheader("📈 Activity")
+        period_label = st.radio("Period:", list(ACTIVITY_PERIODS), horizontal=True, key="activity_period")
+        period, count = ACTIVITY_PERIODS[period_label]
+        with metrics.timer("atm_render", part="charts"):
+            data = activity_chart_data(ledger, ledger.version, period, count)
+            st.bar_chart(data, x="Period", y=["Deposits", "Withdrawals"])
+            st.line_chart(data, x="Period", y="Closing Balance")
+        st.markdown("---")
+    
+    # Recent transactions
+    st.subheader("📋 Recent Transactions")
+    if ledger:
+        with metrics.timer("atm_render", part="recent"):
+            st.markdown(recent_html(ledger, ledger.version), unsafe_allow_html=True)
+        
+        if len(ledger) > 5:
+            st.info(f"📊 Showing 5 of {len(ledger)} transactions. View all in Transaction History.")
+    else:
+        st.info("ℹ️ No transactions yet. Start by making a deposit!")
+
+@st.fragment
+def history_panel(account_id: str):
+    """Filters, pagination, cards and export for the history page."""
+    ledger = core.ledger(account_id)
+
+    # Filter options
+    col1, col2 = st.columns(2)
+    with col1:
+        filter_option = st.selectbox(
+            "🔍 Filter transactions:",
+            list(HISTORY_FILTERS)
+        )
+    with col2:
+        date_range = st.date_input("📅 Date range:", value=(), format="YYYY-MM-DD")
+    
+    # Filter transactions (index lookup + bisect, no rescan)
+    start_time = day_start(date_range[0]) if len(date_range) > 0 else None
+    end_time = day_start(date_range[-1] + timedelta(days=1)) if len(date_range) > 0 else None
+    filtered_history = ledger.view(HISTORY_FILTERS[filter_option], start_time, end_time)
+    
+    st.write(f"**Showing {len(filtered_history)} transaction(s)**")
+    
+    # Pagination: only the visible page is read from the ledger
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("📄 Per page:", PAGE_SIZES, key="history_page_size")
+    with col2:
+        jump_date = st.date_input("⏩ Jump to date:", value=None, format="YYYY-MM-DD")
+    
+    page_count = filtered_history.page_count(page_size)
+    if jump_date is not None and jump_date != st.session_state.get("history_jump_date"):
+        # Newest record on or before the end of the chosen day
+        newest = filtered_history.find(day_start(jump_date + timedelta(days=1))) - 1
+        st.session_state.history_page = (len(filtered_history) - 1 - max(newest, 0)) // page_size
+    st.session_state.history_jump_date = jump_date
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", use_container_width=True):
+            st.session_state.history_page -= 1
+    with col3:
+        if st.button("Older ➡️", use_container_width=True):
+            st.session_state.history_page += 1
+    page = min(max(st.session_state.get("history_page", 0), 0), page_count - 1)
+    st.session_state.history_page = page
+    with col2:
+        st.caption(f"Page {page + 1} of {page_count}")
+    st.divider()
+    
+    # Display transactions in cards
+    with metrics.timer("atm_render", part="history"):
+        filter_key = (account_id, filter_option, start_time, end_time)
+        st.markdown(history_page_html(filtered_history, ledger.version, filter_key, page, page_size),
+                    unsafe_allow_html=True)
+    
+    st.markdown("---")
+    
+    # Export option (generated only on demand, streamed in chunks)
+    from export import FORMATS as EXPORT_FORMATS, write_export
+    export_format = st.selectbox("📦 Export format:", list(EXPORT_FORMATS))
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("📦 Prepare Export", use_container_width=True):
+            mime, extension = EXPORT_FORMATS[export_format]
+            export_file = tempfile.TemporaryFile()
+            try:
+                write_export(filtered_history, export_file, export_format)
+            except ImportError as exc:
+                error(f"❌ {exc}")
+            else:
+                export_file.seek(0)
+                st.download_button(
+                    label="📥 Download History",
+                    data=export_file,
+                    file_name=f"atm_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                    mime=mime,
+                    use_container_width=True
+                )
+    with col2:
+        if st.button("🔄 Refresh", use_container_width=True):
+            st.rerun()
+
 # ---------------------------
 # Sidebar Navigation
 # ---------------------------
 st.sidebar.title("🏦 ATM Menu")
+st.sidebar.text_input("👤 Account ID", key="account_id", on_change=switch_account)
+account_id = st.session_state.account_id.strip() or DEFAULT_ACCOUNT
 st.sidebar.markdown("---")
 
-# Show current balance in sidebar if PIN is set
-if st.session_state.pin:
-    st.sidebar.success(f"💰 Balance: ${st.session_state.balance}")
+# Show current balance in sidebar once the PIN was entered. Accounts
+# (and ledgers) are only loaded after that: has_pin() does not cache
+# unknown IDs typed into the sidebar
+if core.has_pin(account_id) and is_authenticated():
+    st.sidebar.success(f"💰 Balance: ${core.balance(account_id)}")
     st.sidebar.markdown("---")
 
 menu = st.sidebar.radio(
@@ -145,6 +472,7 @@ menu = st.sidebar.radio(
         "🔄 Change PIN",
         "💵 Deposit",
         "💸 Withdraw",
+        "🔁 Transfer",
         "💰 Check Balance",
         "📜 Transaction History",
         "🗑️ Reset Data"
@@ -154,6 +482,14 @@ menu = st.sidebar.radio(
 st.sidebar.markdown("---")
 st.sidebar.caption("🔒 Secure ATM Simulator v2.0")
 
+# Debug panel (only when ATM_METRICS=1)
+if metrics.registry.enabled:
+    with st.sidebar.expander("🛠️ Debug Metrics"):
+        st.selectbox("Profile reruns", list(PROFILE_HOOKS), key="profile_hook")
+        if st.session_state.get("profile_report"):
+            st.code(st.session_state.profile_report, language="text")
+        st.code(metrics.registry.render(), language="text")
+
 # Main title with welcome message
 st.title("🏦 Welcome to ATM Simulator")
 st.markdown("### Your secure banking experience")
@@ -165,49 +501,11 @@ st.markdown("### Your secure banking experience")
 if menu == "🏠 Dashboard":
     st.header("📊 Account Dashboard")
     
-    if not st.session_state.pin:
+    if not core.has_pin(account_id):
         st.warning("⚠️ Please create a PIN to get started!")
         st.info("👉 Go to **Create PIN** in the sidebar to set up your account.")
-    else:
-        # Account overview cards
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            st.metric(
-                label="💰 Current Balance",
-                value=f"${st.session_state.balance}",
-                delta=None
-            )
-        
-        with col2:
-            st.metric(
-                label="📝 Total Transactions",
-                value=len(st.session_state.history)
-            )
-        
-        with col3:
-            st.metric(
-                label="🔐 Account Status",
-                value="Active"
-            )
-        
-        st.markdown("---")
-        
-        # Recent transactions
-        st.subheader("📋 Recent Transactions")
-        if st.session_state.history:
-            recent = list(reversed(st.session_state.history))[:5]
-            for i, record in enumerate(recent, 1):
-                st.markdown(f"""
-                <div class="transaction-card">
-                    <strong>{i}.</strong> {record}
-                </div>
-                """, unsafe_allow_html=True)
-            
-            if len(st.session_state.history) > 5:
-                st.info(f"📊 Showing 5 of {len(st.session_state.history)} transactions. View all in Transaction History.")
-        else:
-            st.info("ℹ️ No transactions yet. Start by making a deposit!")
+    elif unlock("dashboard_unlock_form"):
+        account_overview(account_id)
         
         # Quick actions
         st.markdown("---")
@@ -229,7 +527,7 @@ if menu == "🏠 Dashboard":
 elif menu == "🔐 Create PIN":
     st.header("🔐 Create PIN")
     
-    if st.session_state.pin:
+    if core.has_pin(account_id):
         st.info("ℹ️ You already have a PIN. Use 'Change PIN' to update it.")
     else:
         with st.form("create_pin_form", clear_on_submit=True):
@@ -241,15 +539,9 @@ elif menu == "🔐 Create PIN":
                     error("PIN cannot be empty.")
                 elif new_pin != new_pin2:
                     error("PIN and confirmation do not match.")
-                elif not new_pin.isdigit():
-                    error("PIN must be numeric.")
-                elif len(new_pin) < 4:
-                    error("PIN must be at least 4 digits long.")
-                else:
-                    st.session_state.pin = new_pin
+                elif perform(core.create_pin, new_pin):
                     reset_auth()
                     success("✅ Your PIN has been created successfully!")
-                    log_action("New PIN created")
 
 elif menu == "🔄 Change PIN":
     st.header("🔄 Change PIN")
@@ -262,31 +554,24 @@ elif menu == "🔄 Change PIN":
         new_pin2 = st.text_input("Confirm new PIN", type="password", max_chars=6)
         submitted = st.form_submit_button("Change PIN")
         if submitted:
-            if not authenticate(old_pin):
-                error("❌ Invalid old PIN.")
-            elif new_pin != new_pin2:
+            if new_pin != new_pin2:
                 error("❌ New PIN and confirmation do not match.")
-            elif not new_pin.isdigit():
-                error("❌ PIN must be numeric.")
-            elif len(new_pin) < 4:
-                error("❌ PIN must be at least 4 digits long.")
-            else:
-                st.session_state.pin = new_pin
+            elif perform(core.change_pin, old_pin, new_pin):
                 reset_auth()
                 success("✅ Your PIN has been changed successfully!")
-                log_action("PIN changed")
 
 elif menu == "💵 Deposit":
     st.header("💵 Deposit Money")
-    if not require_pin_set():
+    if not require_pin_set() or not unlock("deposit_unlock_form"):
         st.stop()
+    ledger = core.ledger(account_id)
     
     # Show current balance
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Current Balance", f"${st.session_state.balance}")
+        st.metric("Current Balance", f"${core.balance(account_id)}")
     with col2:
-        st.metric("Total Deposits", len([h for h in st.session_state.history if "Deposited" in h]))
+        st.metric("Total Deposits", ledger.stats.deposit_count)
 
     st.markdown("---")
     
@@ -301,43 +586,47 @@ elif menu == "💵 Deposit":
         amount = st.number_input("💵 Enter amount to deposit", min_value=0, step=100, help="Enter the amount you want to deposit")
         
         submitted = st.form_submit_button("💰 Deposit Now", type="primary", use_container_width=True)
+        key = request_key("deposit", submitted)
         if submitted:
-            if not authenticate(pin_input):
-                error("❌ Invalid PIN.")
-            elif amount <= 0:
-                error("❌ Please enter an amount greater than 0.")
-            else:
-                st.session_state.balance += int(amount)
-                success(f"✅ Amount ${int(amount)} deposited successfully!")
-                log_action(f"Deposited ${int(amount)}")
+            result = perform(core.deposit, pin_input, int(amount), idempotency_key=key)
+            next_request_key("deposit")
+            if result:
+                success(f"✅ Amount ${result.amount} deposited successfully!")
                 st.balloons()
 
 elif menu == "💸 Withdraw":
     st.header("💸 Withdraw Money")
-    if not require_pin_set():
+    if not require_pin_set() or not unlock("withdraw_unlock_form"):
         st.stop()
+    ledger = core.ledger(account_id)
 
     # Show current balance with warning if low
-    col1, col2 = st.columns(2)
+    limit_left = core.limits.remaining(account_id)
+    col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Available Balance", f"${st.session_state.balance}")
+        st.metric("Available Balance", f"${core.balance(account_id)}")
     with col2:
-        st.metric("Total Withdrawals", len([h for h in st.session_state.history if "Withdrew" in h]))
+        st.metric("Total Withdrawals", ledger.stats.withdraw_count)
+    with col3:
+        st.metric("Limit Remaining", "No limit" if limit_left is None else f"${limit_left}")
     
-    if st.session_state.balance < 100:
+    if core.balance(account_id) < 100:
         st.warning("⚠️ Low balance! Consider making a deposit.")
+    if limit_left == 0:
+        st.warning("⚠️ Withdrawal limit reached. Please try again later.")
+    st.caption(f"🏧 Cash in this ATM: ${core.cassettes.total}")
     
     st.markdown("---")
     
     with st.form("withdraw_form", clear_on_submit=True):
         pin_input = st.text_input("🔐 Enter your PIN", type="password", placeholder="Enter 4-6 digit PIN")
         
-        # Show suggested amounts based on balance
-        if st.session_state.balance > 0:
+        # Show suggested amounts the machine can pay out of the balance, within the limits
+        max_amount = core.balance(account_id) if limit_left is None else min(core.balance(account_id), limit_left)
+        max_amount = core.cassettes.floor(max_amount)
+        suggested = sorted({core.cassettes.floor(min(amt, max_amount)) for amt in (100, 500, 1000)} - {0})
+        if suggested:
             st.write("💡 Suggested amounts:")
-            suggested = [min(100, st.session_state.balance), 
-                        min(500, st.session_state.balance), 
-                        min(1000, st.session_state.balance)]
             cols = st.columns(len(suggested))
             for i, amt in enumerate(suggested):
                 with cols[i]:
@@ -345,22 +634,50 @@ elif menu == "💸 Withdraw":
         
         amount = st.number_input("💸 Enter amount to withdraw", 
                                 min_value=0, 
-                                max_value=st.session_state.balance,
+                                max_value=max_amount,
                                 step=100,
-                                help=f"Maximum: ${st.session_state.balance}")
+                                help=f"Maximum: ${max_amount} (notes of ${core.cassettes.unit} and up)")
         
         submitted = st.form_submit_button("💵 Withdraw Now", type="primary", use_container_width=True)
+        key = request_key("withdraw", submitted)
         if submitted:
-            if not authenticate(pin_input):
-                error("❌ Invalid PIN.")
-            elif amount <= 0:
-                error("❌ Please enter an amount greater than 0.")
-            elif int(amount) > st.session_state.balance:
-                error(f"❌ Insufficient funds. Available: ${st.session_state.balance}")
-            else:
-                st.session_state.balance -= int(amount)
-                success(f"✅ Amount ${int(amount)} withdrawn successfully!")
-                log_action(f"Withdrew ${int(amount)}")
+            result = perform(core.withdraw, pin_input, int(amount), idempotency_key=key)
+            next_request_key("withdraw")
+            if result:
+                success(f"✅ Amount ${result.amount} withdrawn successfully!")
+                if result.notes:
+                    st.info("💵 Take your cash: " + ", ".join(f"{count} × ${note}" for note, count in result.notes.items()))
+
+elif menu == "🔁 Transfer":
+    st.header("🔁 Transfer Money")
+    if not require_pin_set() or not unlock("transfer_unlock_form"):
+        st.stop()
+    ledger = core.ledger(account_id)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Available Balance", f"${core.balance(account_id)}")
+    with col2:
+        st.metric("Total Transfers Out", ledger.stats.transfer_out_count)
+
+    st.markdown("---")
+
+    with st.form("transfer_form", clear_on_submit=True):
+        to_account = st.text_input("👤 Recipient account", placeholder="Account ID")
+        amount = st.number_input("🔁 Enter amount to transfer",
+                                min_value=0,
+                                max_value=core.balance(account_id),
+                                step=100,
+                                help=f"Maximum: ${core.balance(account_id)}")
+        pin_input = st.text_input("🔐 Enter your PIN", type="password", placeholder="Enter 4-6 digit PIN")
+
+        submitted = st.form_submit_button("🔁 Transfer Now", type="primary", use_container_width=True)
+        key = request_key("transfer", submitted)
+        if submitted:
+            result = perform(core.transfer, pin_input, to_account.strip(), int(amount), idempotency_key=key)
+            next_request_key("transfer")
+            if result:
+                success(f"✅ Amount ${result.amount} transferred to {to_account.strip()}!")
 
 elif menu == "💰 Check Balance":
     st.header("💰 Check Balance")
@@ -371,128 +688,98 @@ elif menu == "💰 Check Balance":
         pin_input = st.text_input("🔐 Enter your PIN", type="password", placeholder="Enter 4-6 digit PIN")
         submitted = st.form_submit_button("🔍 Show Balance", type="primary", use_container_width=True)
         if submitted:
-            if not authenticate(pin_input):
-                error("❌ Invalid PIN.")
-            else:
+            result = perform(core.check_balance, pin_input)
+            if result:
                 st.success("✅ Balance retrieved successfully!")
+                ledger = core.ledger(account_id)
                 
                 # Display balance in a nice card
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric(label="💵 Available Balance", value=f"${st.session_state.balance}")
+                    st.metric(label="💵 Available Balance", value=f"${result.balance}")
                 with col2:
-                    total_deposits = sum([int(h.split("$")[1].split()[0]) for h in st.session_state.history if "Deposited" in h]) if any("Deposited" in h for h in st.session_state.history) else 0
+                    total_deposits = ledger.stats.deposit_total
                     st.metric(label="📥 Total Deposits", value=f"${total_deposits}")
                 with col3:
-                    total_withdrawals = sum([int(h.split("$")[1].split()[0]) for h in st.session_state.history if "Withdrew" in h]) if any("Withdrew" in h for h in st.session_state.history) else 0
+                    total_withdrawals = ledger.stats.withdraw_total
                     st.metric(label="📤 Total Withdrawals", value=f"${total_withdrawals}")
-                
-                log_action("Checked Balance")
 
 elif menu == "📜 Transaction History":
     st.header("📜 Transaction History")
+    if not require_pin_set() or not unlock("history_unlock_form"):
+        st.stop()
+    ledger = core.ledger(account_id)
     
-    if not st.session_state.history:
+    if not ledger.stats.transactions:
         st.info("ℹ️ No transactions yet. Start by making a deposit!")
     else:
         # Summary cards
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("📊 Total Transactions", len(st.session_state.history))
+            st.metric("📊 Total Transactions", ledger.stats.transactions)
         with col2:
-            deposits = len([h for h in st.session_state.history if "Deposited" in h])
+            deposits = ledger.stats.deposit_count
             st.metric("📥 Deposits", deposits)
         with col3:
-            withdrawals = len([h for h in st.session_state.history if "Withdrew" in h])
+            withdrawals = ledger.stats.withdraw_count
             st.metric("📤 Withdrawals", withdrawals)
         
         st.markdown("---")
         
-        # Filter options
-        filter_option = st.selectbox(
-            "🔍 Filter transactions:",
-            ["All", "Deposits Only", "Withdrawals Only", "Balance Checks", "PIN Changes"]
-        )
-        
-        # Filter transactions
-        filtered_history = st.session_state.history
-        if filter_option == "Deposits Only":
-            filtered_history = [h for h in st.session_state.history if "Deposited" in h]
-        elif filter_option == "Withdrawals Only":
-            filtered_history = [h for h in st.session_state.history if "Withdrew" in h]
-        elif filter_option == "Balance Checks":
-            filtered_history = [h for h in st.session_state.history if "Checked Balance" in h]
-        elif filter_option == "PIN Changes":
-            filtered_history = [h for h in st.session_state.history if "PIN" in h]
-        
-        st.write(f"**Showing {len(filtered_history)} transaction(s)**")
-        st.divider()
-        
-        # Display transactions in cards
-        for i, record in enumerate(reversed(filtered_history), 1):
-            # Determine transaction type for icon
-            if "Deposited" in record:
-                icon = "📥"
-                color = "#d4edda"
-            elif "Withdrew" in record:
-                icon = "📤"
-                color = "#f8d7da"
-            elif "PIN" in record:
-                icon = "🔐"
-                color = "#d1ecf1"
-            else:
-                icon = "ℹ️"
-                color = "#e2e3e5"
-            
-            st.markdown(f"""
-            <div style="background-color: {color}; padding: 15px; border-radius: 10px; margin: 10px 0; border-left: 5px solid #667eea;">
-                <strong>{icon} {i}.</strong> {record}
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("---")
-        
-        # Export option
-        col1, col2 = st.columns(2)
-        with col1:
-            history_text = "\n".join(reversed(st.session_state.history))
-            st.download_button(
-                label="📥 Download Full History",
-                data=history_text,
-                file_name=f"atm_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                use_container_width=True
-            )
-        with col2:
-            if st.button("🔄 Refresh", use_container_width=True):
-                st.rerun()
+        history_panel(account_id)
 
 elif menu == "🗑️ Reset Data":
     st.header("�️R Reset Account Data")
+    has_pin = core.has_pin(account_id)
+    if has_pin and not unlock("reset_unlock_form"):
+        st.stop()
     
+    balance = transactions = 0
+    if has_pin:
+        balance, transactions = core.balance(account_id), core.ledger(account_id).stats.transactions
     st.error("⚠️ **WARNING:** This action cannot be undone!")
     st.warning("This will permanently clear:")
     st.markdown("""
     - 🔐 Your PIN
     - 💰 Your balance (${})
     - 📜 All transaction history ({} transactions)
-    """.format(st.session_state.balance, len(st.session_state.history)))
+    """.format(balance, transactions))
     
     st.markdown("---")
     
     # Confirmation checkbox
     confirm = st.checkbox("✅ I understand this action is permanent")
     
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("🗑️ Reset All Data", type="primary", disabled=not confirm, use_container_width=True):
-            st.session_state.pin = ""
-            st.session_state.balance = 0
-            st.session_state.history = []
+    # Both actions need the PIN again: the account's current one to reset
+    # it, or the one it had before to undo a reset
+    with st.form("reset_form", clear_on_submit=True):
+        pin_input = st.text_input("🔐 Confirm with your PIN", type="password", placeholder="Enter 4-6 digit PIN")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            reset_clicked = st.form_submit_button("🗑️ Reset All Data", type="primary",
+                                                  disabled=not (confirm and has_pin), use_container_width=True)
+        with col2:
+            restore_clicked = st.form_submit_button("♻️ Undo Reset", disabled=has_pin, use_container_width=True)
+        with col3:
+            cancel_clicked = st.form_submit_button("❌ Cancel", use_container_width=True)
+    if reset_clicked and check_pin(pin_input):
+        core.reset(account_id)
+        reset_auth()
+        success("✅ All session data has been cleared.")
+        st.balloons()
+    if restore_clicked:
+        try:
+            core.verify_restore_pin(account_id, pin_input)
+            core.restore(account_id)
+        except ATMError as exc:
+            error(f"❌ {exc}")
+        else:
             reset_auth()
-            success("✅ All session data has been cleared.")
-            st.balloons()
-    with col2:
-        if st.button("❌ Cancel", use_container_width=True):
-            st.info("Reset cancelled.")
+            success("✅ Account restored.")
+    if cancel_clicked:
+        st.info("Reset cancelled.")
+
+profiler = st.session_state.pop("profiler", None)
+if profiler is not None:
+    st.session_state.profile_report = profiler.stop("app_rerun")
 # streamlit run app.py
\ No newline at end of file
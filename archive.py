@@ -0,0 +1,178 @@
+"""
+History Archive
+Cold tier for ledgers with a retention limit. Older records are spilled
+from memory into zlib-compressed, column-oriented segment files; only a
+little metadata per segment stays in memory, and recently read segments
+are kept decompressed in a small cache.
+
+Set ATM_ARCHIVE_DIR to choose where segments are written (default: a
+temporary directory per ledger, removed when the ledger is dropped).
+"""
+
+import os
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from events import KIND_CATEGORY
+
+ARCHIVE_DIR = os.environ.get("ATM_ARCHIVE_DIR") or None
+CATEGORIES = tuple(dict.fromkeys(KIND_CATEGORY.values()))
+
+
+class Segment:
+    """Metadata for one archived run of consecutive records"""
+
+    __slots__ = ("path", "start", "count", "first_timestamp", "last_timestamp")
+
+    def __init__(self, path, start, count, first_timestamp, last_timestamp):
+        self.path = path
+        self.start = start
+        self.count = count
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = last_timestamp
+
+
+class Archive:
+    """Compressed on-disk segments holding a ledger's oldest records"""
+
+    def __init__(self, directory=ARCHIVE_DIR, cached_segments=4, level=6):
+        self.level = level
+        self.cached_segments = cached_segments
+        self.segments = []
+        self.starts = array("q")             # first position of each segment
+        self.last_timestamps = array("d")    # newest timestamp in each segment
+        # category -> ordinal of the segment's first record in that category
+        self.category_starts = {category: array("q") for category in CATEGORIES}
+        self.category_counts = dict.fromkeys(CATEGORIES, 0)
+        import tempfile   # only needed once a ledger outgrows memory
+        self._tempdir = tempfile.TemporaryDirectory(prefix="atm-archive-", dir=directory)
+        self._cache = OrderedDict()          # segment index -> (columns, category positions)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.starts[-1] + self.segments[-1].count if self.segments else 0
+
+    @property
+    def last_timestamp(self):
+        return self.last_timestamps[-1] if self.segments else None
+
+    def write(self, start, timestamps, kinds, amounts, balances):
+        """Archive consecutive records starting at ledger position `start`"""
+        path = os.path.join(self._tempdir.name, f"{start:012d}.seg")
+        data = b"".join(column.tobytes() for column in (timestamps, kinds, amounts, balances))
+        with open(path, "wb") as f:
+            f.write(zlib.compress(data, self.level))
+
+        for category in CATEGORIES:
+            self.category_starts[category].append(self.category_counts[category])
+        for kind in set(kinds):
+            self.category_counts[KIND_CATEGORY[kind]] += kinds.count(kind)
+        self.segments.append(Segment(path, start, len(kinds), timestamps[0], timestamps[-1]))
+        self.starts.append(start)
+        self.last_timestamps.append(timestamps[-1])
+
+    def _load(self, s):
+        """Decompressed columns and per-category positions of segment s"""
+        with self._lock:
+            entry = self._cache.get(s)
+            if entry is not None:
+                self._cache.move_to_end(s)
+                return entry
+        segment = self.segments[s]
+        with open(segment.path, "rb") as f:
+            data = zlib.decompress(f.read())
+        n = segment.count
+        columns = []
+        offset = 0
+        for typecode in "dBqq":
+            column = array(typecode)
+            size = n * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            offset += size
+            columns.append(column)
+        positions = {category: array("q") for category in CATEGORIES}
+        for i, kind in enumerate(columns[1], segment.start):
+            positions[KIND_CATEGORY[kind]].append(i)
+        entry = (columns, positions)
+        with self._lock:
+            self._cache[s] = entry
+            if len(self._cache) > self.cached_segments:
+                self._cache.popitem(last=False)
+        return entry
+
+    def _segment_of(self, position):
+        return bisect_right(self.starts, position) - 1
+
+    def row(self, position):
+        """(timestamp, kind, amount, balance) of an archived position"""
+        s = self._segment_of(position)
+        columns, _ = self._load(s)
+        i = position - self.starts[s]
+        return tuple(column[i] for column in columns)
+
+    def timestamp(self, position):
+        s = self._segment_of(position)
+        return self._load(s)[0][0][position - self.starts[s]]
+
+    def position(self, category, ordinal):
+        """Ledger position of the ordinal-th archived record in a category"""
+        starts = self.category_starts[category]
+        s = bisect_right(starts, ordinal) - 1
+        return self._load(s)[1][category][ordinal - starts[s]]
+
+    def bisect(self, category, timestamp):
+        """First ordinal (or position, for category None) at or after `timestamp`"""
+        s = bisect_left(self.last_timestamps, timestamp)
+        if s == len(self.segments):
+            return len(self) if category is None else self.category_counts[category]
+        columns, positions = self._load(s)
+        timestamps = columns[0]
+        start = self.starts[s]
+        if category is None:
+            return start + bisect_left(timestamps, timestamp)
+        key = lambda p: timestamps[p - start]
+        return self.category_starts[category][s] + bisect_left(positions[category], timestamp, key=key)
+
+    def columns(self, category, lo, hi):
+        """Yield (timestamps, kinds, amounts, balances) lists for ordinals lo..hi"""
+        if category is None:
+            s = self._segment_of(lo)
+            while lo < hi:
+                columns, _ = self._load(s)
+                a, b = lo - self.starts[s], min(hi - self.starts[s], self.segments[s].count)
+                yield tuple(column[a:b].tolist() for column in columns)
+                lo += b - a
+                s += 1
+            return
+        starts = self.category_starts[category]
+        s = bisect_right(starts, lo) - 1
+        while lo < hi:
+            columns, positions = self._load(s)
+            segment_positions = positions[category]
+            a = lo - starts[s]
+            b = min(hi - starts[s], len(segment_positions))
+            if b > a:
+                base = self.starts[s]
+                rows = [p - base for p in segment_positions[a:b]]
+                yield tuple([column[i] for i in rows] for column in columns)
+                lo += b - a
+            s += 1
+
+    def clear(self):
+        """Delete every segment file"""
+        with self._lock:
+            self._cache.clear()
+        for segment in self.segments:
+            try:
+                os.remove(segment.path)
+            except OSError:
+                pass
+        self.segments.clear()
+        del self.starts[:]
+        del self.last_timestamps[:]
+        for category in CATEGORIES:
+            del self.category_starts[category][:]
+            self.category_counts[category] = 0
@@ -5,12 +5,29 @@ Features:
 - Looping menu
 - Better error handling
 - Cleaner messages
+- Transaction ledger
+- Persistent storage (set ATM_STORAGE=sqlite:atm.db)
+
+The console is a thin adapter over the headless ATMCore API (core.py).
 """
 
+from accounts import AccountManager
+from cassettes import Cassettes
+from core import ATMCore
+from fraud import AnomalyScorer
+from limits import WithdrawalLimits
+from errors import ATMError, InvalidPinFormat
+from storage import DEFAULT_ACCOUNT, open_storage
+
+
 class ATM:
-    def __init__(self):
-        self.pin = ""
-        self.balance = 0
+    def __init__(self, core=None, account_id=DEFAULT_ACCOUNT):
+        if core is None:
+            storage = open_storage()
+            core = ATMCore(AccountManager(storage, scorer=AnomalyScorer()), cassettes=Cassettes(),
+                           limits=WithdrawalLimits(storage))
+        self.core = core
+        self.account_id = account_id
         self.menu()
     
     def menu(self):
@@ -25,10 +42,11 @@ class ATM:
     3 - Deposit
     4 - Withdraw
     5 - Check Balance
-    6 - Exit
+    6 - Transfer
+    7 - Exit
     
 Enter your choice: """)
-            
+
             if choice == "1":
                 self.create_pin()
             elif choice == "2":
@@ -40,122 +58,160 @@ Enter your choice: """)
             elif choice == "5":
                 self.check_balance()
             elif choice == "6":
+                self.transfer()
+            elif choice == "7":
                 if self.exit():
+                    self.core.close()
                     break
             else:
                 print("❌ Invalid option! Please try again.")
-                
+    
+    def require_pin(self):
+        """Warn and return False if no PIN has been created yet"""
+        if not self.core.has_pin(self.account_id):
+            print("⚠️  No PIN set. Please create a PIN first.")
+            return False
+        return True
+    
+    def ask_pin(self, prompt="Enter your PIN: "):
+        """Prompt for the PIN and verify it; returns the PIN or None"""
+        pin = input(prompt)
+        try:
+            self.core.verify_pin(self.account_id, pin)
+        except ATMError as exc:
+            print(f"❌ {exc}")
+            return None
+        return pin
+    
+    def ask_amount(self, prompt):
+        """Prompt for an integer amount; returns None on invalid input"""
+        try:
+            return int(input(prompt))
+        except ValueError:
+            print("❌ Invalid amount. Please enter a number.")
+            return None
+    
     def create_pin(self):
         """Create a new PIN with validation"""
-        if self.pin:
+        if self.core.has_pin(self.account_id):
             print("⚠️  PIN already exists. Use 'Change PIN' option instead.")
             return
         
         while True:
             new_pin = input("Enter your new PIN (4-6 digits): ")
-            if not new_pin.isdigit():
-                print("❌ PIN must contain only numbers.")
-            elif len(new_pin) < 4 or len(new_pin) > 6:
-                print("❌ PIN must be 4-6 digits long.")
+            try:
+                self.core.create_pin(self.account_id, new_pin)
+            except InvalidPinFormat as exc:
+                print(f"❌ {exc}")
             else:
-                self.pin = new_pin
                 print("✅ Your PIN has been created successfully!")
                 break
     
     def change_pin(self):
         """Change existing PIN"""
-        if not self.pin:
-            print("⚠️  No PIN set. Please create a PIN first.")
+        if not self.require_pin():
             return
         
-        old_pin = input("Enter your old PIN: ")
-        if old_pin != self.pin:
-            print("❌ Invalid old PIN.")
+        old_pin = self.ask_pin("Enter your old PIN: ")
+        if old_pin is None:
             return
         
         while True:
             new_pin = input("Enter your new PIN (4-6 digits): ")
-            if not new_pin.isdigit():
-                print("❌ PIN must contain only numbers.")
-            elif len(new_pin) < 4 or len(new_pin) > 6:
-                print("❌ PIN must be 4-6 digits long.")
+            try:
+                self.core.change_pin(self.account_id, old_pin, new_pin)
+            except InvalidPinFormat as exc:
+                print(f"❌ {exc}")
             else:
-                self.pin = new_pin
                 print("✅ Your PIN has been changed successfully!")
                 break
-        
+    
     def deposit(self):
         """Deposit money with validation"""
-        if not self.pin:
-            print("⚠️  No PIN set. Please create a PIN first.")
+        if not self.require_pin():
             return
         
-        temp = input("Enter your PIN: ")
-        if temp != self.pin:
-            print("❌ Invalid PIN.")
+        pin = self.ask_pin()
+        if pin is None:
             return
         
+        amount = self.ask_amount("Enter amount to deposit: ")
+        if amount is None:
+            return
         try:
-            amount = int(input("Enter amount to deposit: "))
-            if amount <= 0:
-                print("❌ Amount must be greater than 0.")
-                return
-            self.balance += amount
-            print(f"✅ Amount {amount} deposited successfully!")
-            print(f"💰 Current balance: {self.balance}")
-        except ValueError:
-            print("❌ Invalid amount. Please enter a number.")
-               
+            result = self.core.deposit(self.account_id, pin, amount)
+        except ATMError as exc:
+            print(f"❌ {exc}")
+            return
+        print(f"✅ Amount {result.amount} deposited successfully!")
+        print(f"💰 Current balance: {result.balance}")
+    
     def withdraw(self):
         """Withdraw money with validation"""
-        if not self.pin:
-            print("⚠️  No PIN set. Please create a PIN first.")
+        if not self.require_pin():
             return
         
-        temp = input("Enter your PIN: ")
-        if temp != self.pin:
-            print("❌ Invalid PIN.")
+        pin = self.ask_pin()
+        if pin is None:
             return
         
+        amount = self.ask_amount("Enter amount to withdraw: ")
+        if amount is None:
+            return
         try:
-            amount = int(input("Enter amount to withdraw: "))
-            if amount <= 0:
-                print("❌ Amount must be greater than 0.")
-                return
-            if amount > self.balance:
-                print(f"❌ Insufficient funds. Available balance: {self.balance}")
-                return
-            self.balance -= amount
-            print(f"✅ Amount {amount} withdrawn successfully!")
-            print(f"💰 Current balance: {self.balance}")
-        except ValueError:
-            print("❌ Invalid amount. Please enter a number.")
+            result = self.core.withdraw(self.account_id, pin, amount)
+        except ATMError as exc:
+            print(f"❌ {exc}")
+            return
+        print(f"✅ Amount {result.amount} withdrawn successfully!")
+        if result.notes:
+            print("💵 Take your cash: " + ", ".join(f"{count} x {note}" for note, count in result.notes.items()))
+        print(f"💰 Current balance: {result.balance}")
+    
+    def transfer(self):
+        """Transfer money to another account"""
+        if not self.require_pin():
+            return
+        
+        pin = self.ask_pin()
+        if pin is None:
+            return
+        
+        to_account = input("Enter the recipient account: ").strip()
+        amount = self.ask_amount("Enter amount to transfer: ")
+        if amount is None:
+            return
+        try:
+            result = self.core.transfer(self.account_id, pin, to_account, amount)
+        except ATMError as exc:
+            print(f"❌ {exc}")
+            return
+        print(f"✅ Amount {result.amount} transferred to {to_account} successfully!")
+        print(f"💰 Current balance: {result.balance}")
     
     def check_balance(self):
         """Check current balance"""
-        if not self.pin:
-            print("⚠️  No PIN set. Please create a PIN first.")
+        if not self.require_pin():
             return
         
-        temp = input("Enter your PIN: ")
-        if temp == self.pin:
-            print(f"💰 Your available balance is: {self.balance}")
-        else:
-            print("❌ Invalid PIN.")
+        pin = input("Enter your PIN: ")
+        try:
+            result = self.core.check_balance(self.account_id, pin)
+        except ATMError as exc:
+            print(f"❌ {exc}")
+            return
+        print(f"💰 Your available balance is: {result.balance}")
     
     def exit(self):
         """Exit the ATM"""
-        if not self.pin:
+        if not self.core.has_pin(self.account_id):
             print("👋 Goodbye!")
             return True
         
-        temp = input("Enter your PIN to exit: ")
-        if temp == self.pin:
+        if self.ask_pin("Enter your PIN to exit: ") is not None:
             print("👋 Thank you for using our ATM. Goodbye!")
             return True
-        else:
-            print("❌ Invalid PIN.")
-            return False
+        return False
 
 
 if __name__ == "__main__":
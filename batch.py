@@ -0,0 +1,166 @@
+"""
+Batch Transaction Processor
+Applies end-of-day settlement files of deposits and withdrawals.
+
+The input is streamed (CSV with an account,operation,amount header, or
+JSON Lines with the same keys) and handled in fixed-size chunks: each
+chunk is validated in one pass, then applied through the AccountManager
+with the same amount and insufficient-funds rules as the ATM. Every
+row is written to a results file; rejected rows, including any that
+fail unexpectedly, also go to a rejects file. The manager keeps no history in memory and unknown
+accounts are not cached, so memory grows with the chunk size and the
+number of distinct accounts (a small entry each), not with the rows.
+
+Run: python batch.py settlement.csv [--storage sqlite:atm.db]
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from accounts import AccountManager
+from core import validate_amount
+from errors import ATMError, UnknownAccount
+from storage import open_storage
+
+CHUNK_SIZE = 10_000
+OPERATIONS = ("deposit", "withdraw")
+RESULT_COLUMNS = ["line", "account", "operation", "amount", "status", "balance", "error"]
+
+
+class BatchReport:
+    """Summary of a batch run"""
+
+    __slots__ = ("total", "applied", "rejected", "seconds")
+
+    def __init__(self):
+        self.total = 0
+        self.applied = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        """Rows processed per second"""
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.total} rows: {self.applied} applied, {self.rejected} rejected "
+                f"in {self.seconds:.2f}s ({self.rate:,.0f} rows/s)")
+
+
+def read_operations(path):
+    """Yield (line number, account, operation, amount) from a CSV or JSONL file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = {}
+                if not isinstance(row, dict):
+                    row = {}
+                yield line_no, row.get("account"), row.get("operation"), row.get("amount")
+        else:
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                yield line_no, row.get("account"), row.get("operation"), row.get("amount")
+
+
+def validate_chunk(chunk):
+    """Validate a chunk of rows; returns (valid rows, rejected rows)"""
+    valid, rejected = [], []
+    for line_no, account_id, operation, amount in chunk:
+        # JSON Lines can hold any type where CSV only has strings
+        operation = operation.strip().lower() if isinstance(operation, str) else ""
+        if not account_id:
+            rejected.append((line_no, account_id, operation, amount, "Missing account."))
+        elif not isinstance(account_id, str):
+            rejected.append((line_no, account_id, operation, amount, "Account must be a string."))
+        elif operation not in OPERATIONS:
+            rejected.append((line_no, account_id, operation, amount, f"Unknown operation: {operation}"))
+        else:
+            try:
+                valid.append((line_no, account_id, operation, validate_amount(amount)))
+            except ATMError as exc:
+                rejected.append((line_no, account_id, operation, amount, str(exc)))
+    return valid, rejected
+
+
+def process(manager, path, results_path, rejects_path, chunk_size=CHUNK_SIZE):
+    """Apply every operation in `path` and return a BatchReport"""
+    report = BatchReport()
+    started = time.perf_counter()
+    rows = read_operations(path)
+    with open(results_path, "w", newline="", encoding="utf-8") as results_file, \
+            open(rejects_path, "w", newline="", encoding="utf-8") as rejects_file:
+        results = csv.writer(results_file)
+        rejects = csv.writer(rejects_file)
+        results.writerow(RESULT_COLUMNS)
+        rejects.writerow(RESULT_COLUMNS)
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            valid, rejected = validate_chunk(chunk)
+            out = [(line_no, account_id, operation, amount, "rejected", "", reason)
+                   for line_no, account_id, operation, amount, reason in rejected]
+
+            for line_no, account_id, operation, amount in valid:
+                try:
+                    account = manager.find(account_id)
+                    if account is None or not account.pin:
+                        raise UnknownAccount(account_id)
+                    if operation == "deposit":
+                        balance = manager.deposit(account_id, amount)
+                    else:
+                        balance = manager.withdraw(account_id, amount)
+                except ATMError as exc:
+                    out.append((line_no, account_id, operation, amount, "rejected", "", str(exc)))
+                except Exception as exc:
+                    # One bad row must not abort the rest of the batch
+                    out.append((line_no, account_id, operation, amount, "rejected", "",
+                                f"{type(exc).__name__}: {exc}"))
+                else:
+                    out.append((line_no, account_id, operation, amount, "applied", balance, ""))
+
+            out.sort()
+            results.writerows(out)
+            rejects.writerows(row for row in out if row[4] == "rejected")
+            report.total += len(chunk)
+            report.rejected += sum(1 for row in out if row[4] == "rejected")
+            report.applied = report.total - report.rejected
+
+    manager.storage.flush()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a settlement file of deposits and withdrawals")
+    parser.add_argument("input", help="CSV or JSONL file with account, operation, amount")
+    parser.add_argument("--results", help="results file (default: <input>.results.csv)")
+    parser.add_argument("--rejects", help="rejects file (default: <input>.rejects.csv)")
+    parser.add_argument("--storage", help="storage backend, e.g. sqlite:atm.db (default: $ATM_STORAGE)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    base = os.path.splitext(args.input)[0]
+    manager = AccountManager(open_storage(args.storage), history=False)
+    try:
+        report = process(manager, args.input,
+                         args.results or f"{base}.results.csv",
+                         args.rejects or f"{base}.rejects.csv",
+                         args.chunk_size)
+    finally:
+        manager.storage.close()
+    print(f"✅ {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+ATM Benchmarks
+Deterministic, seeded load generator for the headless core and the
+history/metrics code used by app.py. Reports throughput and p50/p99
+latency per operation and writes the results as JSON so runs can be
+compared across commits.
+
+It also times a cold start of the console and batch entry points, which
+must import only the standard library, and exits non-zero when either
+goes over its start-up budget (ATM_STARTUP_BUDGET_MS over a bare
+interpreter).
+
+Run: python bench.py --accounts 1000 --ops 100000 --history-sizes 10,1000,100000 [--shards 1,2,4]
+     python bench.py --startup-only
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from accounts import AccountManager
+from cassettes import Cassettes
+from core import ATMCore
+from errors import ATMError
+from events import CATEGORY_DEPOSIT
+from ledger import Ledger, DEPOSIT, WITHDRAW, BALANCE_CHECK
+from sharding import ShardedCore
+
+PIN = "1234"
+STARTUP_BUDGET_MS = float(os.environ.get("ATM_STARTUP_BUDGET_MS", "90"))
+STARTUP_ENTRY_POINTS = ("atm_improved", "batch")
+
+
+def percentile(samples, q):
+    """q-th percentile (0-100) of an already sorted list"""
+    if not samples:
+        return 0.0
+    index = min(int(round(q / 100 * (len(samples) - 1))), len(samples) - 1)
+    return samples[index]
+
+
+def summarize(name, latencies_ns, seconds, **extra):
+    """Turn raw per-call latencies into a result row"""
+    latencies_ns.sort()
+    ops = len(latencies_ns)
+    return dict(
+        name=name,
+        ops=ops,
+        seconds=round(seconds, 6),
+        ops_per_sec=round(ops / seconds, 1) if seconds else 0.0,
+        p50_us=round(percentile(latencies_ns, 50) / 1000, 3),
+        p99_us=round(percentile(latencies_ns, 99) / 1000, 3),
+        **extra,
+    )
+
+
+def timed(name, calls, **extra):
+    """Run (fn, args) pairs, timing each call"""
+    clock = time.perf_counter_ns
+    latencies = []
+    record = latencies.append
+    started = time.perf_counter()
+    for fn, args in calls:
+        t0 = clock()
+        try:
+            fn(*args)
+        except ATMError:
+            pass
+        record(clock() - t0)
+    return summarize(name, latencies, time.perf_counter() - started, **extra)
+
+
+def zipf_weights(n, skew):
+    """Cumulative weights for picking account i with probability ~ 1/(i+1)^skew"""
+    return list(itertools.accumulate(1.0 / (i + 1) ** skew for i in range(n)))
+
+
+def bench_operations(accounts=1000, ops=100_000, read_ratio=0.5, skew=1.1, seed=42, pin_iterations=1000):
+    """Mixed deposit/withdraw/balance workload over many accounts"""
+    rng = random.Random(seed)
+    core = ATMCore(AccountManager(), pin_iterations=pin_iterations)
+    ids = [f"acct{i:07d}" for i in range(accounts)]
+    for account_id in ids:
+        core.create_pin(account_id, PIN)
+        core.deposit(account_id, PIN, 1_000)
+
+    cum_weights = zipf_weights(accounts, skew) if skew > 0 else None
+    targets = rng.choices(ids, cum_weights=cum_weights, k=ops)
+    workload = []
+    for account_id in targets:
+        r = rng.random()
+        if r < read_ratio:
+            workload.append((core.check_balance, (account_id, PIN)))
+        elif r < read_ratio + (1 - read_ratio) / 2:
+            workload.append((core.deposit, (account_id, PIN, rng.randint(1, 500))))
+        else:
+            workload.append((core.withdraw, (account_id, PIN, rng.randint(1, 500))))
+
+    results = [timed("mixed", workload, accounts=accounts, read_ratio=read_ratio, skew=skew)]
+    for label, fn in (("deposit", core.deposit), ("withdraw", core.withdraw)):
+        calls = [(fn, (account_id, PIN, 1)) for account_id in targets[:ops // 4]]
+        results.append(timed(label, calls, accounts=accounts, skew=skew))
+    calls = [(core.check_balance, (account_id, PIN)) for account_id in targets[:ops // 4]]
+    results.append(timed("check_balance", calls, accounts=accounts, skew=skew))
+    payees = rng.choices(ids, k=ops // 4)
+    calls = [(core.transfer, (account_id, PIN, payee, 1))
+             for account_id, payee in zip(targets, payees) if account_id != payee]
+    results.append(timed("transfer", calls, accounts=accounts, skew=skew))
+    return results
+
+
+def bench_sharded(shards, accounts=1000, ops=100_000, read_ratio=0.5, skew=1.1, seed=42, pin_iterations=1000):
+    """The mixed workload through the shard router, with every request in flight at once"""
+    rng = random.Random(seed)
+    core = ShardedCore(shards, storage="memory", pin_iterations=pin_iterations, limits=False)
+    try:
+        ids = [f"acct{i:07d}" for i in range(accounts)]
+        for future in [core.submit("create_pin", account_id, PIN) for account_id in ids]:
+            future.result()
+        for future in [core.submit("deposit", account_id, PIN, 1_000) for account_id in ids]:
+            future.result()
+
+        cum_weights = zipf_weights(accounts, skew) if skew > 0 else None
+        workload = []
+        for account_id in rng.choices(ids, cum_weights=cum_weights, k=ops):
+            r = rng.random()
+            if r < read_ratio:
+                workload.append(("check_balance", account_id, PIN))
+            elif r < read_ratio + (1 - read_ratio) / 2:
+                workload.append(("deposit", account_id, PIN, rng.randint(1, 500)))
+            else:
+                workload.append(("withdraw", account_id, PIN, rng.randint(1, 500)))
+
+        started = time.perf_counter()
+        futures = [core.submit(*request) for request in workload]
+        for future in futures:
+            future.exception()
+        elapsed = time.perf_counter() - started
+    finally:
+        core.close()
+    return dict(name="sharded_mixed", ops=ops, seconds=round(elapsed, 6),
+                ops_per_sec=round(ops / elapsed, 1) if elapsed else 0.0,
+                shards=shards, accounts=accounts, read_ratio=read_ratio, skew=skew)
+
+
+def bench_dispense(ops=100_000, seed=42):
+    """Note planning and dispensing against the default cassette inventory"""
+    rng = random.Random(seed)
+    cassettes = Cassettes()
+    amounts = [rng.randrange(10, 2_000, 10) for _ in range(ops)]
+
+    def dispense(amount):
+        cassettes.put_back(cassettes.take(amount))
+
+    return [
+        timed("dispense_plan", [(cassettes.plan, (amount,)) for amount in amounts]),
+        timed("dispense", [(dispense, (amount,)) for amount in amounts[:ops // 4]]),
+    ]
+
+
+def cold_start_ms(code, runs):
+    """Fastest of `runs` fresh interpreters running `code`, in milliseconds"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def non_stdlib_imports(module):
+    """Top-level modules importing `module` loads from outside the stdlib and this repo"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    probe = (f"import sys; before = set(sys.modules); import {module}; "
+             f"print(' '.join(set(sys.modules) - before))")
+    loaded = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                            check=True, cwd=root).stdout.split()
+    return sorted({name.partition(".")[0] for name in loaded}
+                  - set(sys.stdlib_module_names)
+                  - {name for name in loaded if os.path.exists(os.path.join(root, f"{name}.py"))})
+
+
+def bench_startup(runs=10, budget_ms=STARTUP_BUDGET_MS):
+    """Import cost of each entry point over a bare interpreter, checked against the budget"""
+    baseline = cold_start_ms("pass", runs)
+    results = []
+    for module in STARTUP_ENTRY_POINTS:
+        cost = cold_start_ms(f"import {module}", runs) - baseline
+        extra = non_stdlib_imports(module)
+        results.append(dict(name=f"startup_{module}", ms=round(cost, 1), baseline_ms=round(baseline, 1),
+                            budget_ms=budget_ms, non_stdlib=extra, ok=cost <= budget_ms and not extra))
+    return results
+
+
+def print_startup(startup):
+    for row in startup:
+        mark = "✅" if row["ok"] else "❌"
+        extra = f"  non-stdlib imports: {', '.join(row['non_stdlib'])}" if row["non_stdlib"] else ""
+        print(f"{mark} {row['name']:<20}{row['ms']:>8.1f} ms over a bare interpreter "
+              f"(budget {row['budget_ms']:g} ms){extra}")
+
+
+def build_history(size, seed=42):
+    """A ledger with `size` deterministic events, one per second"""
+    rng = random.Random(seed)
+    ledger = Ledger()
+    balance = 0
+    start = 1_700_000_000.0
+    for i in range(size):
+        r = rng.random()
+        if r < 0.4:
+            amount = rng.randint(1, 500)
+            balance += amount
+            ledger.append(DEPOSIT, amount, balance, start + i)
+        elif r < 0.7 and balance:
+            amount = rng.randint(1, balance)
+            balance -= amount
+            ledger.append(WITHDRAW, amount, balance, start + i)
+        else:
+            ledger.append(BALANCE_CHECK, 0, balance, start + i)
+    return ledger
+
+
+def bench_history(size, queries=1000, seed=42):
+    """History and metric reads as the app performs them on each rerun"""
+    rng = random.Random(seed)
+    ledger = build_history(size, seed)
+    first, last = ledger.stats.first_activity, ledger.stats.last_activity
+    stamps = [rng.uniform(first, last) for _ in range(queries)]
+    deposits = ledger.view(CATEGORY_DEPOSIT)
+
+    def metrics():
+        stats = ledger.stats
+        return len(ledger), stats.deposit_count, stats.deposit_total, stats.withdraw_count, stats.withdraw_total
+
+    results = [
+        timed("dashboard_metrics", [(metrics, ())] * queries),
+        timed("recent_5", [(ledger.tail, (5,))] * queries),
+        timed("filter_deposits_page", [(ledger.view(CATEGORY_DEPOSIT).page, (0, 25))] * queries),
+        timed("time_range_page", [(lambda t: ledger.view(None, t, t + 3600).page(0, 25), (t,)) for t in stamps]),
+        timed("jump_to_date", [(deposits.find, (t,)) for t in stamps]),
+        timed("rollup_30_days", [(ledger.rollups["day"].totals, (t, t + 30 * 86400)) for t in stamps]),
+    ]
+    started = time.perf_counter()
+    build_history(min(size, 100_000), seed)
+    elapsed = time.perf_counter() - started
+    results.append(dict(name="append", ops=min(size, 100_000), seconds=round(elapsed, 6),
+                        ops_per_sec=round(min(size, 100_000) / elapsed, 1) if elapsed else 0.0))
+    for row in results:
+        row["history_size"] = size
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ATM benchmark suite")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--read-ratio", type=float, default=0.5)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for hot accounts (0 = uniform)")
+    parser.add_argument("--history-sizes", default="10,1000,100000",
+                        help="comma-separated history lengths, e.g. 10,1000,10000000")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pin-iterations", type=int, default=1000)
+    parser.add_argument("--shards", default="", help="comma-separated shard counts to run through the router, e.g. 1,2,4")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--startup-runs", type=int, default=10)
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS,
+                        help="allowed start-up cost of each entry point in ms")
+    parser.add_argument("--startup-only", action="store_true", help="only run the start-up budget check")
+    args = parser.parse_args()
+
+    startup = bench_startup(args.startup_runs, args.startup_budget)
+    if args.startup_only:
+        print_startup(startup)
+        raise SystemExit(0 if all(row["ok"] for row in startup) else 1)
+
+    results = bench_operations(args.accounts, args.ops, args.read_ratio, args.skew, args.seed,
+                               args.pin_iterations)
+    results.extend(bench_dispense(args.ops, args.seed))
+    for size in (int(s) for s in args.history_sizes.split(",") if s):
+        results.extend(bench_history(size, args.queries, args.seed))
+    for shards in (int(s) for s in args.shards.split(",") if s):
+        results.append(bench_sharded(shards, args.accounts, args.ops, args.read_ratio, args.skew, args.seed,
+                                     args.pin_iterations))
+
+    report = dict(
+        commit=git_commit(),
+        python=platform.python_version(),
+        created=datetime.now().isoformat(timespec="seconds"),
+        params=vars(args),
+        results=results,
+        startup=startup,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for row in results:
+        size = f" (history {row['history_size']})" if "history_size" in row else ""
+        size = f" ({row['shards']} shards)" if "shards" in row else size
+        latency = f"  p50 {row['p50_us']}µs  p99 {row['p99_us']}µs" if "p50_us" in row else ""
+        print(f"{row['name']:<22}{size:<18}{row['ops_per_sec']:>14,.0f} ops/s{latency}")
+    print_startup(startup)
+    print(f"📄 Results written to {args.output}")
+    if not all(row["ok"] for row in startup):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
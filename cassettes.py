@@ -0,0 +1,137 @@
+"""
+Cash Cassettes
+The note inventory of one terminal and the engine that decides which
+notes to pay a withdrawal with.
+
+Which amounts can be paid is kept as bitsets, one per suffix of the
+denominations (largest first): bit n of reachable[i] is set when n units
+can be made from denominations i and smaller with the notes loaded. A
+plan is then greedy, taking as many large notes as it can, but only
+counts that leave a remainder the smaller notes can still pay, so it
+never dead-ends.
+
+The bitsets stop at the largest amount one withdrawal may pay out, so
+notes beyond what that amount could use do not affect them. After a
+dispense only the bitsets depending on a denomination whose usable count
+changed are rebuilt; with full cassettes that is often none.
+
+Set ATM_CASSETTES to load a different inventory, e.g. "100:500,50:500,20:1000",
+and ATM_MAX_DISPENSE to change the per-withdrawal ceiling.
+"""
+
+import os
+import threading
+from math import gcd
+
+from errors import CannotDispense
+
+DEFAULT_CASSETTES = "100:500,50:500,20:500,10:500"
+MAX_DISPENSE = int(os.environ.get("ATM_MAX_DISPENSE", "10000"))
+
+
+def parse_inventory(spec):
+    """{denomination: count} from a "denomination:count,..." string"""
+    inventory = {}
+    for part in spec.split(","):
+        denomination, _, count = part.strip().partition(":")
+        inventory[int(denomination)] = int(count)
+    return inventory
+
+
+class Cassettes:
+    """Notes loaded in a terminal, by denomination"""
+
+    def __init__(self, inventory=None, max_amount=MAX_DISPENSE):
+        if inventory is None:
+            inventory = parse_inventory(os.environ.get("ATM_CASSETTES", DEFAULT_CASSETTES))
+        self.denominations = sorted(inventory, reverse=True)
+        self.counts = [inventory[denomination] for denomination in self.denominations]
+        self.unit = gcd(*self.denominations)
+        self._sizes = [denomination // self.unit for denomination in self.denominations]
+        self.max_amount = max_amount - max_amount % self.unit
+        self._limit = (2 << (self.max_amount // self.unit)) - 1
+        self._reachable = [0] * len(self.denominations) + [1]
+        self._lock = threading.Lock()
+        self._rebuild(len(self.denominations) - 1)
+
+    def _rebuild(self, last):
+        """Recompute reachable[last] down to reachable[0]"""
+        reachable = self._reachable
+        for i in range(last, -1, -1):
+            mask, size, remaining, step = reachable[i + 1], self._sizes[i], self._usable(i), 1
+            # Bounded subset sum: add the notes in 1, 2, 4, ... sized lots
+            while remaining:
+                lot = min(step, remaining)
+                mask |= (mask << (lot * size)) & self._limit
+                remaining -= lot
+                step <<= 1
+            reachable[i] = mask
+
+    def _usable(self, i):
+        """Notes of denomination i that one withdrawal could use"""
+        return min(self.counts[i], self.max_amount // self.unit // self._sizes[i])
+
+    @property
+    def total(self):
+        return sum(denomination * count for denomination, count in zip(self.denominations, self.counts))
+
+    def inventory(self):
+        return dict(zip(self.denominations, self.counts))
+
+    def can_dispense(self, amount):
+        return (not amount % self.unit and amount <= self.max_amount
+                and self._reachable[0] >> (amount // self.unit) & 1 == 1)
+
+    def floor(self, amount):
+        """Largest dispensable amount not above `amount` (0 if there is none)"""
+        if amount <= 0:
+            return 0
+        n = min(amount, self.max_amount) // self.unit
+        return ((self._reachable[0] & ((2 << n) - 1)).bit_length() - 1) * self.unit
+
+    def plan(self, amount):
+        """{denomination: count} paying `amount`, largest notes first, or None"""
+        if not self.can_dispense(amount):
+            return None
+        n = amount // self.unit
+        notes = {}
+        for i, size in enumerate(self._sizes):
+            if not n:
+                break
+            rest = self._reachable[i + 1]
+            take = min(self.counts[i], n // size)
+            while take and not rest >> (n - take * size) & 1:
+                take -= 1
+            if take:
+                notes[self.denominations[i]] = take
+                n -= take * size
+        return notes
+
+    def take(self, amount):
+        """Remove the notes for `amount` and return them; raises CannotDispense"""
+        with self._lock:
+            notes = self.plan(amount)
+            if notes is None:
+                raise CannotDispense(amount, self.floor(amount))
+            self._adjust(notes, -1)
+            return notes
+
+    def put_back(self, notes):
+        """Return notes taken for a withdrawal that did not go through"""
+        with self._lock:
+            self._adjust(notes, 1)
+
+    def refill(self, denomination, count):
+        """Load `count` more notes of an existing denomination"""
+        with self._lock:
+            self._adjust({denomination: count}, 1)
+
+    def _adjust(self, notes, sign):
+        last = -1
+        for denomination, count in notes.items():
+            i = self.denominations.index(denomination)
+            usable = self._usable(i)
+            self.counts[i] += sign * count
+            if self._usable(i) != usable:
+                last = max(last, i)
+        self._rebuild(last)
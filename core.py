@@ -0,0 +1,241 @@
+"""
+ATM Core
+Headless transaction API shared by every front-end. Operations take
+plain arguments, return Result objects and raise typed errors from
+errors.py; nothing here reads input or prints.
+"""
+
+from accounts import AccountManager
+import metrics
+from errors import InvalidAmount, InvalidPin, InvalidPinFormat, NothingToRestore, PinNotSet
+from events import PIN_CREATED, PIN_CHANGED, DEPOSIT, WITHDRAW, BALANCE_CHECK, TRANSFER_OUT, MAX_AMOUNT
+from idempotency import IdempotencyCache
+from security import AttemptLimiter, VerifiedCache, check_pin, hash_pin
+
+PIN_MIN_LENGTH = 4
+PIN_MAX_LENGTH = 6
+
+
+def validate_pin(pin):
+    """Raise InvalidPinFormat unless the PIN is 4-6 digits"""
+    if not pin.isdigit():
+        raise InvalidPinFormat("PIN must contain only numbers.")
+    if len(pin) < PIN_MIN_LENGTH or len(pin) > PIN_MAX_LENGTH:
+        raise InvalidPinFormat(f"PIN must be {PIN_MIN_LENGTH}-{PIN_MAX_LENGTH} digits long.")
+
+
+def validate_amount(amount):
+    """Return the amount as an int, raising InvalidAmount unless it is a
+    positive whole number up to MAX_AMOUNT (booleans and fractions are
+    refused, not truncated)"""
+    if isinstance(amount, bool) or (isinstance(amount, float) and not amount.is_integer()):
+        raise InvalidAmount("Amount must be a whole number.")
+    try:
+        amount = int(amount)
+    except (TypeError, ValueError):
+        raise InvalidAmount("Invalid amount. Please enter a number.") from None
+    if amount <= 0:
+        raise InvalidAmount()
+    if amount > MAX_AMOUNT:
+        raise InvalidAmount("Amount is too large.")
+    return amount
+
+
+class Result:
+    """Outcome of a successful operation; `notes` lists the cash dispensed, if any"""
+
+    __slots__ = ("account_id", "kind", "amount", "balance", "notes")
+
+    def __init__(self, account_id, kind, amount, balance, notes=None):
+        self.account_id = account_id
+        self.kind = kind
+        self.amount = amount
+        self.balance = balance
+        self.notes = notes
+
+    def values(self):
+        return (self.account_id, self.kind, self.amount, self.balance)
+
+    def __repr__(self):
+        return (f"Result(account_id={self.account_id!r}, kind={self.kind!r}, "
+                f"amount={self.amount!r}, balance={self.balance!r})")
+
+
+class ATMCore:
+    """Validated ATM operations over an AccountManager.
+
+    PINs are stored as salted hashes. `source` identifies where a request
+    came from (e.g. a client address) so failed attempts can be limited
+    per source as well as per account. Money-moving operations accept an
+    `idempotency_key`; repeating a key replays the first Result, and
+    reusing it for a different operation, amount or recipient raises
+    IdempotencyConflict.
+
+    With `cassettes`, withdrawals must also be payable with the notes in
+    the terminal, and with `limits` they must fit the account's daily and
+    rolling withdrawal limits; both are checked before the account is
+    debited.
+    """
+
+    # PIN hashing (PBKDF2) and storage flushes block, so event-loop
+    # front-ends should run operations in threads
+    blocking = True
+
+    def __init__(self, accounts=None, pin_iterations=None, limiter=None, verified=None, idempotency=None,
+                 cassettes=None, limits=None):
+        self.accounts = accounts if accounts is not None else AccountManager()
+        self.pin_iterations = pin_iterations
+        self.limiter = limiter if limiter is not None else AttemptLimiter()
+        self.verified = verified if verified is not None else VerifiedCache()
+        self.idempotency = idempotency if idempotency is not None else IdempotencyCache(self.accounts.storage)
+        self.cassettes = cassettes
+        self.limits = limits
+
+    def has_pin(self, account_id):
+        account = self.accounts.find(account_id)
+        return account is not None and bool(account.pin)
+
+    def balance(self, account_id):
+        """Current balance without logging a balance check"""
+        return self.accounts.get(account_id).balance
+
+    def ledger(self, account_id):
+        return self.accounts.get(account_id).ledger
+
+    def close(self):
+        """Flush and close the underlying storage"""
+        self.accounts.storage.close()
+
+    def _once(self, account_id, idempotency_key, request, operation):
+        """Run operation() unless idempotency_key was already used for the
+        account; `request` identifies the operation the key stands for"""
+        if idempotency_key is None:
+            return operation()
+        return Result(*self.idempotency.run(account_id, idempotency_key, lambda: operation().values(), request))
+
+    @metrics.instrumented("atm_pin_check")
+    def verify_pin(self, account_id, pin, source=None):
+        """Raise unless `pin` matches the account's PIN"""
+        account = self.accounts.find(account_id)
+        stored = account.pin if account is not None else ""
+        if not stored:
+            raise PinNotSet()
+        keys = (("account", account_id),) if source is None else (("account", account_id), ("source", source))
+        self.limiter.check(keys)
+        if self.verified.hit(account_id, pin, stored):
+            self.limiter.success(keys[:1])
+            metrics.inc("atm_pin_checks_total", result="cached")
+            return
+        if not check_pin(pin, stored):
+            self.limiter.failure(keys)
+            if self.accounts.scorer is not None:
+                self.accounts.scorer.failed_pin(account_id, self.accounts.clock())
+            metrics.inc("atm_pin_checks_total", result="failed")
+            raise InvalidPin()
+        # Only the account is cleared: a source guessing PINs on other
+        # accounts must not earn its tokens back with one it owns
+        self.limiter.success(keys[:1])
+        self.verified.add(account_id, pin, stored)
+        metrics.inc("atm_pin_checks_total", result="verified")
+
+    def verify_restore_pin(self, account_id, pin, source=None):
+        """Raise unless `pin` matches the PIN the account had before it was
+        reset, i.e. the one restore() would bring back"""
+        saved = self.accounts.storage.restorable(account_id)
+        if saved is None or not saved[0]:
+            raise NothingToRestore()
+        keys = (("account", account_id),) if source is None else (("account", account_id), ("source", source))
+        self.limiter.check(keys)
+        if not check_pin(pin, saved[0]):
+            self.limiter.failure(keys)
+            raise InvalidPin()
+        self.limiter.success(keys[:1])
+
+    @metrics.instrumented("atm_operation", op="create_pin")
+    def create_pin(self, account_id, new_pin):
+        validate_pin(new_pin)
+        self.accounts.create_pin(account_id, hash_pin(new_pin, self.pin_iterations))
+        return Result(account_id, PIN_CREATED, 0, self.balance(account_id))
+
+    @metrics.instrumented("atm_operation", op="change_pin")
+    def change_pin(self, account_id, old_pin, new_pin, source=None):
+        self.verify_pin(account_id, old_pin, source)
+        validate_pin(new_pin)
+        self.accounts.change_pin(account_id, hash_pin(new_pin, self.pin_iterations))
+        self.verified.discard(account_id)
+        return Result(account_id, PIN_CHANGED, 0, self.balance(account_id))
+
+    @metrics.instrumented("atm_operation", op="deposit")
+    def deposit(self, account_id, pin, amount, source=None, idempotency_key=None):
+        self.verify_pin(account_id, pin, source)
+        amount = validate_amount(amount)
+        return self._once(account_id, idempotency_key, ("deposit", amount), lambda: Result(
+            account_id, DEPOSIT, amount, self.accounts.deposit(account_id, amount)))
+
+    @metrics.instrumented("atm_operation", op="withdraw")
+    def withdraw(self, account_id, pin, amount, source=None, idempotency_key=None):
+        self.verify_pin(account_id, pin, source)
+        amount = validate_amount(amount)
+        return self._once(account_id, idempotency_key, ("withdraw", amount),
+                          lambda: self._withdraw(account_id, amount))
+
+    def _withdraw(self, account_id, amount):
+        limits, cassettes = self.limits, self.cassettes
+        if limits is None and cassettes is None:
+            return Result(account_id, WITHDRAW, amount, self.accounts.withdraw(account_id, amount))
+        if limits is not None:
+            reserved = limits.reserve(account_id, amount, self.accounts.clock())
+        notes = None
+        try:
+            if cassettes is not None:
+                notes = cassettes.take(amount)
+            balance = self.accounts.withdraw(account_id, amount)
+        except Exception:
+            if notes is not None:
+                cassettes.put_back(notes)
+            if limits is not None:
+                limits.release(account_id, amount, reserved, self.accounts.clock())
+            raise
+        return Result(account_id, WITHDRAW, amount, balance, notes)
+
+    @metrics.instrumented("atm_operation", op="transfer")
+    def transfer(self, account_id, pin, to_account, amount, source=None, idempotency_key=None):
+        self.verify_pin(account_id, pin, source)
+        amount = validate_amount(amount)
+        return self._once(account_id, idempotency_key, ("transfer", amount, to_account), lambda: Result(
+            account_id, TRANSFER_OUT, amount, self.accounts.transfer(account_id, to_account, amount)))
+
+    @metrics.instrumented("atm_operation", op="transfer_many")
+    def transfer_many(self, account_id, pin, payments, source=None):
+        """Pay several (to_account, amount) pairs from one account, all or nothing"""
+        self.verify_pin(account_id, pin, source)
+        legs = [(account_id, to_account, validate_amount(amount)) for to_account, amount in payments]
+        balances = self.accounts.transfer_many(legs)
+        return Result(account_id, TRANSFER_OUT, sum(leg[2] for leg in legs), balances[account_id])
+
+    @metrics.instrumented("atm_operation", op="check_balance")
+    def check_balance(self, account_id, pin, source=None):
+        self.verify_pin(account_id, pin, source)
+        balance = self.accounts.check_balance(account_id)
+        return Result(account_id, BALANCE_CHECK, 0, balance)
+
+    def reset(self, account_id):
+        """Delete the account, its PIN and its history.
+
+        Storage that keeps snapshots sets the account's rows aside until
+        the next one, so restore() can undo the reset.
+        """
+        self.accounts.reset(account_id)
+        self.verified.discard(account_id)
+        self.idempotency.clear(account_id)
+
+    def restore(self, account_id):
+        """Undo the account's reset.
+
+        Rolling a live account back to a snapshot would bring back money
+        already paid out, so that is left to the operator (snapshot.py
+        restore, with the front-ends stopped).
+        """
+        self.accounts.undo_reset(account_id)
+        self.verified.discard(account_id)
+        self.idempotency.clear(account_id)
@@ -0,0 +1,110 @@
+"""
+ATM Errors
+Typed errors raised by the core API. The message of each error is the
+user-facing text the front-ends display.
+"""
+
+
+class ATMError(Exception):
+    """Base class for every error the core API raises"""
+
+
+class PinNotSet(ATMError):
+    def __init__(self, message="No PIN set. Please create a PIN first."):
+        super().__init__(message)
+
+
+class PinAlreadySet(ATMError):
+    def __init__(self, message="PIN already exists. Use 'Change PIN' option instead."):
+        super().__init__(message)
+
+
+class InvalidPin(ATMError):
+    def __init__(self, message="Invalid PIN."):
+        super().__init__(message)
+
+
+class InvalidPinFormat(ATMError):
+    """The PIN is not 4-6 digits"""
+
+
+class InvalidAmount(ATMError):
+    def __init__(self, message="Amount must be greater than 0."):
+        super().__init__(message)
+
+
+class InsufficientFunds(ATMError):
+    def __init__(self, available):
+        super().__init__(f"Insufficient funds. Available balance: {available}")
+        self.available = available
+
+
+class CannotDispense(ATMError):
+    def __init__(self, amount, nearest=0):
+        message = f"This ATM cannot dispense {amount} with the notes it holds."
+        if nearest:
+            message += f" Nearest available amount: {nearest}"
+        super().__init__(message)
+        self.amount = amount
+        self.nearest = nearest
+
+
+class WithdrawalLimitExceeded(ATMError):
+    def __init__(self, period, available=0, count=None):
+        if count is None:
+            message = f"{period.capitalize()} withdrawal limit reached. Available to withdraw: {max(available, 0)}"
+        else:
+            message = f"{period.capitalize()} limit of {count} withdrawals reached."
+        super().__init__(message)
+        self.period = period
+        self.available = max(available, 0)
+        self.count = count
+
+
+class InvalidTransfer(ATMError):
+    def __init__(self, message="Cannot transfer to the same account."):
+        super().__init__(message)
+
+
+class UnknownAccount(ATMError):
+    def __init__(self, account_id):
+        super().__init__(f"Account {account_id} does not exist.")
+        self.account_id = account_id
+
+
+class StorageLocked(ATMError):
+    def __init__(self, path):
+        super().__init__(f"{path} is already in use by another process.")
+        self.path = path
+
+
+class IdempotencyConflict(ATMError):
+    def __init__(self, message="This request key was already used for a different request."):
+        super().__init__(message)
+
+
+class RequestInProgress(ATMError):
+    def __init__(self, message="This request is still being processed. Please try again shortly."):
+        super().__init__(message)
+
+
+class ShardUnavailable(ATMError):
+    def __init__(self, index):
+        super().__init__(f"Shard {index} is unavailable. Please try again later.")
+        self.index = index
+
+
+class NothingToRestore(ATMError):
+    def __init__(self, message="There is no reset to undo for this account."):
+        super().__init__(message)
+
+
+class NoSnapshot(ATMError):
+    def __init__(self, message="No snapshot available to restore from."):
+        super().__init__(message)
+
+
+class TooManyAttempts(ATMError):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed PIN attempts. Try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
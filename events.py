@@ -0,0 +1,61 @@
+"""
+Event Kinds
+Codes for every action recorded in an account's history, and the state
+transition each one makes to a balance. Live operations and replays
+both go through transition(), so replaying a log reproduces its state.
+"""
+
+from errors import InsufficientFunds, InvalidAmount
+
+# Event kinds (stored as one unsigned byte each)
+PIN_CREATED = 0
+PIN_CHANGED = 1
+DEPOSIT = 2
+WITHDRAW = 3
+BALANCE_CHECK = 4
+TRANSFER_OUT = 5
+TRANSFER_IN = 6
+
+# Largest amount or balance the ledger and the database can hold (int64)
+MAX_AMOUNT = 2 ** 63 - 1
+
+KIND_NAMES = {
+    PIN_CREATED: "pin_created",
+    PIN_CHANGED: "pin_changed",
+    DEPOSIT: "deposit",
+    WITHDRAW: "withdraw",
+    BALANCE_CHECK: "balance_check",
+    TRANSFER_OUT: "transfer_out",
+    TRANSFER_IN: "transfer_in",
+}
+
+# History filter categories and the kinds each one covers
+CATEGORY_DEPOSIT = "deposit"
+CATEGORY_WITHDRAW = "withdraw"
+CATEGORY_BALANCE_CHECK = "balance_check"
+CATEGORY_PIN = "pin"
+CATEGORY_TRANSFER = "transfer"
+
+KIND_CATEGORY = {
+    PIN_CREATED: CATEGORY_PIN,
+    PIN_CHANGED: CATEGORY_PIN,
+    DEPOSIT: CATEGORY_DEPOSIT,
+    WITHDRAW: CATEGORY_WITHDRAW,
+    BALANCE_CHECK: CATEGORY_BALANCE_CHECK,
+    TRANSFER_OUT: CATEGORY_TRANSFER,
+    TRANSFER_IN: CATEGORY_TRANSFER,
+}
+
+
+def transition(kind, amount, balance):
+    """Balance after an event; raises InsufficientFunds instead of
+    overdrawing, and InvalidAmount instead of going past MAX_AMOUNT"""
+    if kind == DEPOSIT or kind == TRANSFER_IN:
+        if amount > MAX_AMOUNT - balance:
+            raise InvalidAmount("Amount is too large for this account.")
+        return balance + amount
+    if kind == WITHDRAW or kind == TRANSFER_OUT:
+        if amount > balance:
+            raise InsufficientFunds(balance)
+        return balance - amount
+    return balance
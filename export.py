@@ -0,0 +1,113 @@
+"""
+History Export
+Streams ledger views to CSV, JSON Lines, plain text or Parquet in
+fixed-size chunks, so memory stays bounded no matter how long the
+history is. Nothing is generated until an export is requested.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import metrics
+from events import KIND_NAMES
+
+CHUNK_SIZE = 10_000
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "txt": ("text/plain", "txt"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+COLUMNS = ["timestamp", "kind", "amount", "balance"]
+
+
+def iter_columns(view, chunk_size=CHUNK_SIZE):
+    """Yield (timestamps, kinds, amounts, balances) lists, oldest first"""
+    return view.columns(chunk_size)
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="seconds")
+
+
+def iter_csv(view, chunk_size=CHUNK_SIZE):
+    """Yield CSV text chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(COLUMNS)
+    for ts, kinds, amounts, balances in iter_columns(view, chunk_size):
+        writer.writerows(zip(map(_iso, ts), map(KIND_NAMES.get, kinds), amounts, balances))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_jsonl(view, chunk_size=CHUNK_SIZE):
+    """Yield JSON Lines text chunks"""
+    for ts, kinds, amounts, balances in iter_columns(view, chunk_size):
+        yield "".join(
+            json.dumps({"timestamp": _iso(t), "kind": KIND_NAMES.get(k), "amount": a, "balance": b}) + "\n"
+            for t, k, a, b in zip(ts, kinds, amounts, balances)
+        )
+
+
+def iter_txt(view, chunk_size=CHUNK_SIZE):
+    """Yield the history page's text format, one record per line"""
+    for lo in range(0, len(view), chunk_size):
+        yield "".join(view[i].format() + "\n" for i in range(lo, min(lo + chunk_size, len(view))))
+
+
+def write_parquet(view, fileobj, chunk_size=CHUNK_SIZE):
+    """Write Parquet with one row group per chunk (requires pyarrow)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow).") from exc
+
+    schema = pa.schema([
+        ("timestamp", pa.timestamp("us")),
+        ("kind", pa.string()),
+        ("amount", pa.int64()),
+        ("balance", pa.int64()),
+    ])
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for ts, kinds, amounts, balances in iter_columns(view, chunk_size):
+            writer.write_table(pa.table({
+                "timestamp": pa.array([int(t * 1_000_000) for t in ts], pa.timestamp("us")),
+                "kind": [KIND_NAMES.get(k) for k in kinds],
+                "amount": pa.array(amounts, pa.int64()),
+                "balance": pa.array(balances, pa.int64()),
+            }, schema=schema))
+
+
+TEXT_WRITERS = {
+    "csv": iter_csv,
+    "jsonl": iter_jsonl,
+    "txt": iter_txt,
+}
+
+
+def write_export(view, fileobj, fmt="csv", chunk_size=CHUNK_SIZE):
+    """Stream an export of `view` into a binary file object"""
+    if fmt != "parquet" and fmt not in TEXT_WRITERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    metrics.inc("atm_export_rows_total", len(view), format=fmt)
+    with metrics.timer("atm_export", format=fmt):
+        if fmt == "parquet":
+            write_parquet(view, fileobj, chunk_size)
+            return
+        for chunk in TEXT_WRITERS[fmt](view, chunk_size):
+            fileobj.write(chunk.encode("utf-8"))
+
+
+def export_to_path(view, path, fmt="csv", chunk_size=CHUNK_SIZE):
+    """Stream an export of `view` to a file on disk"""
+    with open(path, "wb") as f:
+        write_export(view, f, fmt, chunk_size)
@@ -0,0 +1,191 @@
+"""
+Fraud Scoring
+Streaming checks on every account event, flagging unusual activity:
+- amounts far above the account's usual size (running mean/variance)
+- bursts of failed PIN attempts
+- rapid deposit/withdraw cycling of similar amounts
+
+Each account keeps a fixed handful of numbers, decayed exponentially
+over time, so memory per account is constant and each event costs a
+few arithmetic operations. Flagged events go to an AlertLog; set
+ATM_ALERT_LOG to also append them to a JSON Lines file.
+
+Scorers are pluggable: subclass Scorer and pass it to AccountManager.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from events import DEPOSIT, WITHDRAW, TRANSFER_OUT
+
+ALERT_LOG = os.environ.get("ATM_ALERT_LOG") or None
+
+# Event kinds whose amounts are scored
+MONEY_OUT = (WITHDRAW, TRANSFER_OUT)
+
+
+class Alert:
+    """One flagged event"""
+
+    __slots__ = ("timestamp", "account_id", "rule", "score", "detail")
+
+    def __init__(self, timestamp, account_id, rule, score, detail):
+        self.timestamp = timestamp
+        self.account_id = account_id
+        self.rule = rule
+        self.score = score
+        self.detail = detail
+
+    def describe(self):
+        when = datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        return f"{when} {self.detail}"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in Alert.__slots__}
+
+
+class AlertLog:
+    """The most recent alerts, optionally mirrored to a JSON Lines file"""
+
+    def __init__(self, path=ALERT_LOG, max_alerts=1000):
+        self.path = path
+        self._alerts = deque(maxlen=max_alerts)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def add(self, alert):
+        with self._lock:
+            self._alerts.append(alert)
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(alert.as_dict()) + "\n")
+
+    def recent(self, account_id=None, n=10):
+        """Up to n newest alerts, newest first, optionally for one account"""
+        with self._lock:
+            alerts = list(self._alerts)
+        found = []
+        for alert in reversed(alerts):
+            if account_id is None or alert.account_id == account_id:
+                found.append(alert)
+                if len(found) == n:
+                    break
+        return found
+
+
+class Scorer:
+    """Interface for streaming scorers"""
+
+    def __init__(self, alerts=None):
+        self.alerts = alerts if alerts is not None else AlertLog()
+
+    def observe(self, account_id, kind, amount, balance, timestamp):
+        """Score an event just appended to an account's ledger"""
+
+    def failed_pin(self, account_id, timestamp=None):
+        """Score a failed PIN attempt against an account"""
+
+
+class Profile:
+    """Decayed statistics for one account"""
+
+    __slots__ = ("count", "mean", "variance", "failures", "failed_at",
+                 "cycles", "last_kind", "last_amount", "last_at")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.failures = 0.0
+        self.failed_at = 0.0
+        self.cycles = 0.0
+        self.last_kind = None
+        self.last_amount = 0
+        self.last_at = 0.0
+
+
+class AnomalyScorer(Scorer):
+    """Rule-based scorer over exponentially weighted per-account statistics.
+
+    - spike: an outgoing amount more than `spike_sigmas` deviations above
+      the account's moving mean, once `warmup` amounts have been seen
+    - pin_burst: `burst_failures` failed PINs within about `burst_seconds`
+    - cycling: `cycle_count` deposit/withdraw reversals of amounts within
+      `cycle_tolerance` of each other, each within `cycle_seconds`
+
+    Counts decay continuously, so a rule fires once its decayed count is
+    within one of the target: N events in quick succession, but not N
+    events spread over several time constants.
+    """
+
+    def __init__(self, alerts=None, alpha=0.1, warmup=5, spike_sigmas=4.0, min_spike=100,
+                 burst_failures=3, burst_seconds=60.0,
+                 cycle_count=3, cycle_seconds=600.0, cycle_tolerance=0.1):
+        super().__init__(alerts)
+        self.alpha = alpha
+        self.warmup = warmup
+        self.spike_sigmas = spike_sigmas
+        self.min_spike = min_spike
+        self.burst_failures = burst_failures
+        self.burst_seconds = burst_seconds
+        self.cycle_count = cycle_count
+        self.cycle_seconds = cycle_seconds
+        self.cycle_tolerance = cycle_tolerance
+        self.profiles = {}
+
+    def _profile(self, account_id):
+        profile = self.profiles.get(account_id)
+        if profile is None:
+            profile = self.profiles.setdefault(account_id, Profile())
+        return profile
+
+    def _flag(self, timestamp, account_id, rule, score, detail):
+        self.alerts.add(Alert(timestamp, account_id, rule, round(score, 2), detail))
+
+    def observe(self, account_id, kind, amount, balance, timestamp):
+        if kind != DEPOSIT and kind not in MONEY_OUT:
+            return
+        profile = self._profile(account_id)
+
+        if kind in MONEY_OUT:
+            deviation = amount - profile.mean
+            if profile.count >= self.warmup and amount >= self.min_spike and deviation > 0:
+                sigmas = deviation / math.sqrt(profile.variance) if profile.variance else math.inf
+                if sigmas > self.spike_sigmas:
+                    self._flag(timestamp, account_id, "spike", min(sigmas, 1e6),
+                               f"Unusually large amount: {amount} (typical {profile.mean:.0f})")
+            # Exponentially weighted mean and variance
+            increment = self.alpha * deviation
+            profile.mean += increment
+            profile.variance = (1 - self.alpha) * (profile.variance + deviation * increment)
+            profile.count += 1
+
+        previous = profile.last_kind
+        if previous is not None and (previous == DEPOSIT) != (kind == DEPOSIT):
+            elapsed = timestamp - profile.last_at
+            larger = max(amount, profile.last_amount)
+            if elapsed < self.cycle_seconds and abs(amount - profile.last_amount) <= self.cycle_tolerance * larger:
+                profile.cycles = profile.cycles * math.exp(-elapsed / self.cycle_seconds) + 1
+                if profile.cycles > self.cycle_count - 1:
+                    self._flag(timestamp, account_id, "cycling", profile.cycles,
+                               f"Rapid deposit/withdraw cycling of about {amount}")
+                    profile.cycles = 0.0
+        profile.last_kind, profile.last_amount, profile.last_at = kind, amount, timestamp
+
+    def failed_pin(self, account_id, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        profile = self._profile(account_id)
+        elapsed = max(timestamp - profile.failed_at, 0.0)
+        profile.failures = profile.failures * math.exp(-elapsed / self.burst_seconds) + 1
+        profile.failed_at = timestamp
+        if profile.failures > self.burst_failures - 1:
+            self._flag(timestamp, account_id, "pin_burst", profile.failures,
+                       "Several failed PIN attempts in quick succession")
+            profile.failures = 0.0
@@ -0,0 +1,97 @@
+"""
+Idempotent Requests
+Clients that retry after a timeout, or a form submitted twice, send the
+same request again. Operations given an idempotency key run once; a
+replay with the same key returns the original Result instead. The key is
+bound to the request it was first used for (operation, amount and
+recipient): reusing it for a different one raises IdempotencyConflict.
+
+Results are remembered in a bounded LRU with a TTL and written through
+to the storage backend, so a retry is still recognised after a restart.
+Set ATM_IDEMPOTENCY_TTL to change how long keys are kept.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from errors import IdempotencyConflict
+
+IDEMPOTENCY_TTL = float(os.environ.get("ATM_IDEMPOTENCY_TTL", "86400"))
+
+
+class IdempotencyCache:
+    """Results of keyed operations, per account.
+
+    Requests with the same key are serialised on one of a fixed set of
+    striped locks, so a duplicate that arrives while the original is still
+    running waits for it and then replays its result.
+    """
+
+    def __init__(self, storage=None, ttl=IDEMPOTENCY_TTL, max_entries=100_000, stripes=64):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (account_id, key) -> (result values, expires_at, request)
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+
+    def _entry(self, account_id, key):
+        entry = self._entries.get((account_id, key))
+        if entry is None and self.storage is not None:
+            entry = self.storage.load_result(account_id, key)
+            if entry is not None:
+                with self._lock:
+                    self._entries[(account_id, key)] = entry
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry
+
+    def get(self, account_id, key):
+        """Saved result values for a key, or None"""
+        entry = self._entry(account_id, key)
+        return entry[0] if entry is not None else None
+
+    def put(self, account_id, key, values, request=None):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[(account_id, key)] = (values, expires_at, request)
+            self._entries.move_to_end((account_id, key))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.storage is not None:
+            self.storage.save_result(account_id, key, values, expires_at, request)
+
+    def lookup(self, account_id, key, request=None):
+        """Saved result values for a key, or None if it was not used yet.
+        `request` (e.g. ("transfer", amount, to_account)) describes the
+        operation; a key used for a different one raises IdempotencyConflict."""
+        entry = self._entry(account_id, key)
+        if entry is None:
+            return None
+        if request is not None and entry[2] is not None and entry[2] != request:
+            raise IdempotencyConflict()
+        return entry[0]
+
+    def run(self, account_id, key, operation, request=None):
+        """Return operation()'s result values, or the saved ones if `key` was
+        seen before (checked against `request` as in lookup()). Failed
+        operations are not remembered, so a retry runs them again."""
+        values = self.lookup(account_id, key, request)
+        if values is None:
+            with self._stripes[hash((account_id, key)) % len(self._stripes)]:
+                values = self.lookup(account_id, key, request)
+                if values is None:
+                    values = operation()
+                    self.put(account_id, key, values, request)
+        return values
+
+    def clear(self, account_id=None):
+        """Forget saved results locally, for one account or all of them"""
+        with self._lock:
+            if account_id is None:
+                self._entries.clear()
+            else:
+                for entry_key in [k for k in self._entries if k[0] == account_id]:
+                    del self._entries[entry_key]
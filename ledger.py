@@ -0,0 +1,352 @@
+"""
+Transaction Ledger
+Compact storage for ATM account events:
+- Parallel typed arrays for timestamp, kind, amount and balance-after
+- Per-category position indexes kept up to date on append
+- Daily/weekly/monthly rollups kept up to date on append
+- Retention limit: older records spill to compressed on-disk segments
+  (archive.py) while aggregates and rollups stay exact
+- Records are only formatted into text when rendered or exported
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from itertools import chain, count, islice, starmap
+import os
+import time
+
+from aggregates import AccountAggregates
+from archive import Archive
+from events import (
+    PIN_CREATED, PIN_CHANGED, DEPOSIT, WITHDRAW, BALANCE_CHECK, TRANSFER_OUT, TRANSFER_IN, KIND_NAMES,
+    CATEGORY_DEPOSIT, CATEGORY_WITHDRAW, CATEGORY_BALANCE_CHECK, CATEGORY_PIN, CATEGORY_TRANSFER,
+    KIND_CATEGORY,
+)
+from rollups import Rollups
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Records kept in memory per ledger (0 = unlimited); older ones are archived
+HISTORY_LIMIT = int(os.environ.get("ATM_HISTORY_LIMIT", "50000"))
+SEGMENT_SIZE = 4096
+
+# Process-wide version counter, so versions are never reused across ledgers
+_versions = count(1)
+
+
+class Record:
+    """A single ledger entry, materialized on demand"""
+
+    __slots__ = ("timestamp", "kind", "amount", "balance")
+
+    def __init__(self, timestamp, kind, amount, balance):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.amount = amount
+        self.balance = balance
+
+    @property
+    def time(self):
+        """Timestamp as a local datetime"""
+        return datetime.fromtimestamp(self.timestamp)
+
+    def describe(self):
+        """Human readable action text"""
+        if self.kind == DEPOSIT:
+            return f"Deposited ${self.amount}"
+        if self.kind == WITHDRAW:
+            return f"Withdrew ${self.amount}"
+        if self.kind == BALANCE_CHECK:
+            return "Checked Balance"
+        if self.kind == PIN_CREATED:
+            return "New PIN created"
+        if self.kind == PIN_CHANGED:
+            return "PIN changed"
+        if self.kind == TRANSFER_OUT:
+            return f"Transferred ${self.amount} out"
+        if self.kind == TRANSFER_IN:
+            return f"Received ${self.amount} transfer"
+        return "Unknown action"
+
+    def format(self):
+        """Render the record the way the history page shows it"""
+        stamp = self.time.strftime(TIME_FORMAT)
+        return f"[{stamp}] {self.describe()} | Balance: {self.balance}"
+
+    __str__ = format
+
+    def __repr__(self):
+        return (f"Record(timestamp={self.timestamp!r}, kind={KIND_NAMES.get(self.kind, self.kind)!r}, "
+                f"amount={self.amount!r}, balance={self.balance!r})")
+
+
+class LedgerView:
+    """Read-only window over a ledger, optionally restricted to one category.
+
+    Views never copy records: they hold the ledger, a category (None for
+    everything) and a [start, stop) range of ordinals within it, which
+    may span both the in-memory and the archived tier.
+    """
+
+    __slots__ = ("ledger", "category", "start", "stop")
+
+    def __init__(self, ledger, category=None, start=0, stop=None):
+        self.ledger = ledger
+        self.category = category
+        self.start = start
+        self.stop = ledger.count(category) if stop is None else stop
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def position(self, i):
+        """Ledger position of the i-th record in this view"""
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("view index out of range")
+        return self.ledger.position(self.category, i + self.start)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.ledger[self.position(index)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+    def page(self, number, size):
+        """Return page `number` (0 = newest) of `size` records, newest first"""
+        hi = len(self) - number * size
+        lo = max(hi - size, 0)
+        return [self[i] for i in range(hi - 1, lo - 1, -1)]
+
+    def page_count(self, size):
+        """Number of pages of `size` records in this view"""
+        return max((len(self) + size - 1) // size, 1)
+
+    def _bisect(self, timestamp, lo, hi):
+        return min(max(self.ledger.bisect(self.category, timestamp), lo), hi)
+
+    def find(self, timestamp):
+        """Index of the first record in the view at or after `timestamp`"""
+        return self._bisect(timestamp, self.start, max(self.stop, self.start)) - self.start
+
+    def between(self, start_time=None, end_time=None):
+        """Narrow the view to records with start_time <= timestamp < end_time"""
+        lo, hi = self.start, max(self.stop, self.start)
+        if start_time is not None:
+            lo = self._bisect(start_time, lo, hi)
+        if end_time is not None:
+            hi = self._bisect(end_time, lo, hi)
+        return LedgerView(self.ledger, self.category, lo, hi)
+
+    def columns(self, chunk_size):
+        """Yield (timestamps, kinds, amounts, balances) lists, oldest first"""
+        return self.ledger.columns(self.category, self.start, max(self.stop, self.start), chunk_size)
+
+
+class Ledger:
+    """Append-only, column-oriented transaction ledger.
+
+    The columns hold the newest records, starting at position `offset`.
+    With `max_records` set, once the columns reach max_records +
+    segment_size the oldest segment_size records move to the archive;
+    positions never change, and reads go to whichever tier holds them.
+
+    `version` changes on every modification and is unique across all
+    ledgers in the process, so anything derived from a ledger can be
+    cached and keyed on it.
+    """
+
+    def __init__(self, max_records=HISTORY_LIMIT, segment_size=SEGMENT_SIZE):
+        self.timestamps = array("d")
+        self.kinds = array("B")
+        self.amounts = array("q")
+        self.balances = array("q")
+        self.stats = AccountAggregates()
+        self.rollups = Rollups()
+        self.version = next(_versions)
+        self.max_records = max_records
+        self.segment_size = segment_size
+        self.offset = 0
+        self.archive = None
+        # Per category: positions of the in-memory records, and how many
+        # records of the category were archived before them
+        self.index = {category: array("I") for category in (
+            CATEGORY_DEPOSIT, CATEGORY_WITHDRAW, CATEGORY_BALANCE_CHECK, CATEGORY_PIN, CATEGORY_TRANSFER)}
+        self.archived = dict.fromkeys(self.index, 0)
+
+    def append(self, kind, amount=0, balance=0, timestamp=None):
+        """Append an event and return its position; a value the columns
+        cannot hold raises before anything is recorded"""
+        if timestamp is None:
+            timestamp = time.time()
+        columns = (self.timestamps, self.kinds, self.amounts, self.balances)
+        size = len(self.kinds)
+        try:
+            for column, value in zip(columns, (timestamp, kind, amount, balance)):
+                column.append(value)
+        except (OverflowError, TypeError):
+            for column in columns:
+                del column[size:]
+            raise
+        self.stats.update(timestamp, kind, amount, balance)
+        self.rollups.update(timestamp, kind, amount, balance)
+        position = self.offset + len(self.kinds) - 1
+        self.index[KIND_CATEGORY[kind]].append(position)
+        if self.max_records and len(self.kinds) >= self.max_records + self.segment_size:
+            self._spill()
+        self.version = next(_versions)
+        return position
+
+    def extend(self, events, aggregate=True):
+        """Bulk-append time-ordered (timestamp, kind, amount, balance) rows.
+
+        Rows are taken a segment at a time: the columns are extended
+        first, then indexes, aggregates and rollups are backfilled over
+        the new positions in one pass. With `aggregate=False` the rows
+        only become history, for rows the loaded aggregates already count.
+        """
+        events = iter(events)
+        columns = (self.timestamps, self.kinds, self.amounts, self.balances)
+        update = self.stats.update
+        index = self.index
+        while True:
+            chunk = list(islice(events, self.segment_size))
+            if not chunk:
+                break
+            start = len(self.kinds)
+            for column, values in zip(columns, zip(*chunk)):
+                column.extend(values)
+            for i in range(start, len(self.kinds)):
+                kind = self.kinds[i]
+                if aggregate:
+                    update(self.timestamps[i], kind, self.amounts[i], self.balances[i])
+                index[KIND_CATEGORY[kind]].append(self.offset + i)
+            if aggregate:
+                self.rollups.backfill(self, start)
+            while self.max_records and len(self.kinds) >= self.max_records + self.segment_size:
+                self._spill()
+        self.version = next(_versions)
+        return self
+
+    def _spill(self):
+        """Move the oldest segment_size in-memory records to the archive"""
+        if self.archive is None:
+            self.archive = Archive()
+        cut = self.segment_size
+        columns = (self.timestamps, self.kinds, self.amounts, self.balances)
+        self.archive.write(self.offset, *(column[:cut] for column in columns))
+        for column in columns:
+            del column[:cut]
+        self.offset += cut
+        for category, positions in self.index.items():
+            n = bisect_left(positions, self.offset)
+            self.archived[category] += n
+            del positions[:n]
+
+    def __len__(self):
+        return self.offset + len(self.kinds)
+
+    def count(self, category=None):
+        """Number of records in a category (or in total), across tiers"""
+        if category is None:
+            return len(self)
+        return self.archived[category] + len(self.index[category])
+
+    def position(self, category, ordinal):
+        """Ledger position of the ordinal-th record of a category"""
+        if category is None:
+            return ordinal
+        archived = self.archived[category]
+        if ordinal >= archived:
+            return self.index[category][ordinal - archived]
+        return self.archive.position(category, ordinal)
+
+    def timestamp(self, position):
+        """Timestamp of the record at a position"""
+        if position >= self.offset:
+            return self.timestamps[position - self.offset]
+        return self.archive.timestamp(position)
+
+    def bisect(self, category, timestamp):
+        """First ordinal of a category (or position) at or after `timestamp`"""
+        if self.offset and timestamp <= self.archive.last_timestamp:
+            return self.archive.bisect(category, timestamp)
+        if category is None:
+            return self.offset + bisect_left(self.timestamps, timestamp)
+        timestamps, offset = self.timestamps, self.offset
+        key = timestamps.__getitem__ if not offset else (lambda p: timestamps[p - offset])
+        return self.archived[category] + bisect_left(self.index[category], timestamp, key=key)
+
+    def columns(self, category, lo, hi, chunk_size):
+        """Yield column lists for ordinals lo..hi of a category, oldest first"""
+        archived = self.offset if category is None else self.archived[category]
+        if lo < archived:
+            for chunk in self.archive.columns(category, lo, min(hi, archived)):
+                yield chunk
+            lo = archived
+        columns = (self.timestamps, self.kinds, self.amounts, self.balances)
+        for a in range(lo, hi, chunk_size):
+            b = min(a + chunk_size, hi)
+            if category is None:
+                yield tuple(column[a - self.offset:b - self.offset].tolist() for column in columns)
+            else:
+                rows = [p - self.offset for p in self.index[category][a - archived:b - archived]]
+                yield tuple([column[i] for i in rows] for column in columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index >= self.offset:
+            i = index - self.offset
+            return Record(self.timestamps[i], self.kinds[i], self.amounts[i], self.balances[i])
+        if index < 0:
+            raise IndexError("ledger index out of range")
+        return Record(*self.archive.row(index))
+
+    def __iter__(self):
+        archived = (starmap(Record, zip(*chunk)) for chunk in self.columns(None, 0, self.offset, self.segment_size))
+        return chain(chain.from_iterable(archived),
+                     map(Record, self.timestamps, self.kinds, self.amounts, self.balances))
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self[i]
+
+    def tail(self, n):
+        """Return the last n records, newest first"""
+        return [self[i] for i in range(len(self) - 1, max(len(self) - n, 0) - 1, -1)]
+
+    def view(self, category=None, start_time=None, end_time=None):
+        """Return a LedgerView over one category (or everything) in a time range"""
+        view = LedgerView(self, category)
+        if start_time is not None or end_time is not None:
+            view = view.between(start_time, end_time)
+        return view
+
+    def clear(self):
+        """Drop all records"""
+        del self.timestamps[:]
+        del self.kinds[:]
+        del self.amounts[:]
+        del self.balances[:]
+        self.stats.reset()
+        self.rollups.clear()
+        for positions in self.index.values():
+            del positions[:]
+        self.archived = dict.fromkeys(self.index, 0)
+        if self.archive is not None:
+            self.archive.clear()
+        self.offset = 0
+        self.version = next(_versions)
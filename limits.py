@@ -0,0 +1,174 @@
+"""
+Withdrawal Limits
+Per-account caps on how much may be withdrawn, and how often:
+- per calendar day (amount and count)
+- per rolling window, e.g. the last hour (amount and count)
+
+Each account keeps a constant-size counter: day totals that reset at
+local midnight, and a ring of time buckets covering the rolling window
+with running sums, so a check never looks at the history. Counters are
+saved through the storage backend and survive restarts; they belong to
+the account ID, so resetting and restoring an account does not clear
+them.
+
+Configure with ATM_DAILY_LIMIT, ATM_DAILY_COUNT, ATM_WINDOW_LIMIT,
+ATM_WINDOW_COUNT and ATM_WINDOW_SECONDS (0 turns a limit off).
+"""
+
+import os
+import threading
+import time
+
+from errors import WithdrawalLimitExceeded
+from rollups import DAY, period_bounds
+
+DAILY_LIMIT = int(os.environ.get("ATM_DAILY_LIMIT", "5000"))
+DAILY_COUNT = int(os.environ.get("ATM_DAILY_COUNT", "10"))
+WINDOW_LIMIT = int(os.environ.get("ATM_WINDOW_LIMIT", "2000"))
+WINDOW_COUNT = int(os.environ.get("ATM_WINDOW_COUNT", "5"))
+WINDOW_SECONDS = float(os.environ.get("ATM_WINDOW_SECONDS", "3600"))
+
+
+class Counter:
+    """Withdrawals of one account, today and over the rolling window"""
+
+    __slots__ = ("day_end", "day_amount", "day_count",
+                 "newest", "amounts", "counts", "window_amount", "window_count")
+
+    def __init__(self, buckets):
+        self.day_end = 0.0
+        self.day_amount = 0
+        self.day_count = 0
+        self.newest = 0                  # index of the newest bucket since the epoch
+        self.amounts = [0] * buckets
+        self.counts = [0] * buckets
+        self.window_amount = 0
+        self.window_count = 0
+
+    def advance(self, now, bucket_seconds):
+        """Drop everything that fell out of today and out of the window"""
+        if now >= self.day_end:
+            self.day_end = period_bounds(now, DAY)[1]
+            self.day_amount = self.day_count = 0
+        index = int(now // bucket_seconds)
+        if index <= self.newest:
+            return
+        buckets = len(self.amounts)
+        if index - self.newest >= buckets:
+            self.amounts = [0] * buckets
+            self.counts = [0] * buckets
+            self.window_amount = self.window_count = 0
+        else:
+            for expired in range(self.newest + 1, index + 1):
+                slot = expired % buckets
+                self.window_amount -= self.amounts[slot]
+                self.window_count -= self.counts[slot]
+                self.amounts[slot] = self.counts[slot] = 0
+        self.newest = index
+
+    def add(self, amount, count):
+        slot = self.newest % len(self.amounts)
+        self.day_amount += amount
+        self.day_count += count
+        self.amounts[slot] += amount
+        self.counts[slot] += count
+        self.window_amount += amount
+        self.window_count += count
+
+    def remove(self, amount, day_end, bucket):
+        """Take back a withdrawal counted on day `day_end` in bucket
+        `bucket`, as far as it has not already expired"""
+        if self.day_end == day_end and self.day_count:
+            self.day_amount -= amount
+            self.day_count -= 1
+        slot = bucket % len(self.amounts)
+        if self.newest - bucket < len(self.amounts) and self.counts[slot]:
+            self.amounts[slot] -= amount
+            self.counts[slot] -= 1
+            self.window_amount -= amount
+            self.window_count -= 1
+
+    def state(self):
+        return [self.day_end, self.day_amount, self.day_count, self.newest,
+                list(self.amounts), list(self.counts), self.window_amount, self.window_count]
+
+    def load(self, state):
+        for name, value in zip(Counter.__slots__, state):
+            setattr(self, name, value)
+        return self
+
+
+class WithdrawalLimits:
+    """Limit checks for every account, with counters kept in storage"""
+
+    def __init__(self, storage=None, daily_limit=DAILY_LIMIT, daily_count=DAILY_COUNT,
+                 window_limit=WINDOW_LIMIT, window_count=WINDOW_COUNT, window_seconds=WINDOW_SECONDS,
+                 buckets=12):
+        self.storage = storage
+        self.daily_limit = daily_limit
+        self.daily_count = daily_count
+        self.window_limit = window_limit
+        self.window_count = window_count
+        self.buckets = buckets
+        self.bucket_seconds = window_seconds / buckets
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _counter(self, account_id, now):
+        counter = self._counters.get(account_id)
+        if counter is None:
+            counter = Counter(self.buckets)
+            state = self.storage.load_limits(account_id) if self.storage is not None else None
+            if state is not None and len(state[4]) == self.buckets:
+                counter.load(state)
+            self._counters[account_id] = counter
+        counter.advance(now, self.bucket_seconds)
+        return counter
+
+    def _save(self, account_id, counter):
+        if self.storage is not None:
+            self.storage.save_limits(account_id, counter.state())
+
+    def reserve(self, account_id, amount, now=None):
+        """Count a withdrawal against the limits, or raise WithdrawalLimitExceeded.
+
+        Returns the (day_end, bucket) it was counted in, for release().
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            counter = self._counter(account_id, now)
+            if self.daily_limit and counter.day_amount + amount > self.daily_limit:
+                raise WithdrawalLimitExceeded("daily", self.daily_limit - counter.day_amount)
+            if self.daily_count and counter.day_count >= self.daily_count:
+                raise WithdrawalLimitExceeded("daily", count=self.daily_count)
+            if self.window_limit and counter.window_amount + amount > self.window_limit:
+                raise WithdrawalLimitExceeded("rolling", self.window_limit - counter.window_amount)
+            if self.window_count and counter.window_count >= self.window_count:
+                raise WithdrawalLimitExceeded("rolling", count=self.window_count)
+            counter.add(amount, 1)
+            self._save(account_id, counter)
+            return counter.day_end, counter.newest
+
+    def release(self, account_id, amount, reserved, now=None):
+        """Undo a reserve() for a withdrawal that did not go through.
+
+        `reserved` is what reserve() returned: the amount comes off the day
+        and bucket it was counted in, unless those have rolled over since.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            counter = self._counter(account_id, now)
+            counter.remove(amount, *reserved)
+            self._save(account_id, counter)
+
+    def remaining(self, account_id, now=None):
+        """Amount that may still be withdrawn now (None if unlimited)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            counter = self._counter(account_id, now)
+            if ((self.daily_count and counter.day_count >= self.daily_count)
+                    or (self.window_count and counter.window_count >= self.window_count)):
+                return 0
+            left = [limit - used for limit, used in ((self.daily_limit, counter.day_amount),
+                                                     (self.window_limit, counter.window_amount)) if limit]
+            return max(min(left), 0) if left else None
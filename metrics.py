@@ -0,0 +1,330 @@
+"""
+Instrumentation
+Counters and latency histograms for the hot paths, rendered in the
+Prometheus text format.
+
+Metrics are off unless ATM_METRICS=1 (or enable() is called). While
+disabled, timer() hands back a shared no-op object and the decorators
+cost one attribute check per call.
+
+Profiling is pluggable: profile(name) runs a block under a fresh hook
+of the kind chosen with use_profiler() ("cprofile" or "sampling"), and
+keeps the latest report for each name (served at /profile).
+cProfile and the HTTP server are only imported once used, as every
+entry point imports this module.
+"""
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from functools import wraps
+
+# Latency buckets in seconds
+BUCKETS = (0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+           0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        # += is a read-modify-write, so threads updating the same series
+        # would lose counts without the lock
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(BUCKETS, value)] += 1
+            self.total += value
+            self.count += 1
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    """Holds every metric series for the process"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.profiler = None   # ProfileHook class profile() instantiates, if any
+        self.reports = {}      # name -> latest profile report
+        self.counters = {}     # (name, label key) -> Counter
+        self.histograms = {}   # (name, label key) -> Histogram
+        self._lock = threading.Lock()
+
+    def counter(self, name, **labels):
+        key = (name, _label_key(labels))
+        metric = self.counters.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.counters.setdefault(key, Counter())
+        return metric
+
+    def histogram(self, name, **labels):
+        key = (name, _label_key(labels))
+        metric = self.histograms.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.histograms.setdefault(key, Histogram())
+        return metric
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Prometheus text exposition of every series"""
+        lines = []
+        seen = set()
+        for (name, key), metric in sorted(self.counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_format_labels(key)} {metric.value}")
+        for (name, key), metric in sorted(self.histograms.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            with metric.lock:
+                counts, total, count = list(metric.counts), metric.total, metric.count
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def render_reports(self):
+        """The latest profile report for every profiled name"""
+        return "\n\n".join(f"== {name}\n{report}" for name, report in sorted(self.reports.items()))
+
+
+registry = Registry(enabled=os.environ.get("ATM_METRICS") == "1")
+
+
+def enable(on=True):
+    registry.enabled = on
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter (no-op while disabled)"""
+    if registry.enabled:
+        registry.counter(name, **labels).inc(amount)
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+def timer(name, **labels):
+    """Context manager recording the block's duration into `name`_seconds"""
+    if not registry.enabled:
+        return NULL_TIMER
+    return _Timer(registry.histogram(name + "_seconds", **labels))
+
+
+def instrumented(name, **labels):
+    """Decorator counting calls, errors and latency of a function"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as exc:
+                registry.counter(name + "_errors_total", error=type(exc).__name__, **labels).inc()
+                raise
+            finally:
+                registry.histogram(name + "_seconds", **labels).observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+# ---------------------------
+# Profiling hooks
+# ---------------------------
+class ProfileHook:
+    """Interface for pluggable profilers"""
+
+    def start(self, name):
+        raise NotImplementedError
+
+    def stop(self, name):
+        """Stop profiling and return a text report"""
+        raise NotImplementedError
+
+
+class CProfileHook(ProfileHook):
+    """Deterministic profiling with cProfile"""
+
+    def __init__(self, limit=25, sort="cumulative"):
+        self.limit = limit
+        self.sort = sort
+        self._profile = None
+
+    def start(self, name):
+        import cProfile
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, name):
+        import io
+        import pstats
+        self._profile.disable()
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats(self.sort).print_stats(self.limit)
+        return out.getvalue()
+
+
+class SamplingHook(ProfileHook):
+    """Low-overhead statistical profiler sampling the calling thread's stack"""
+
+    def __init__(self, interval=0.001, limit=25):
+        self.interval = interval
+        self.limit = limit
+        self._samples = Tally()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            while frame is not None:
+                code = frame.f_code
+                self._samples[f"{code.co_filename}:{frame.f_lineno} {code.co_name}"] += 1
+                frame = frame.f_back
+
+    def start(self, name):
+        self._samples.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+
+    def stop(self, name):
+        self._stop.set()
+        self._thread.join()
+        lines = [f"{count:8d}  {where}" for where, count in self._samples.most_common(self.limit)]
+        return f"Samples for {name} (every {self.interval * 1000:g} ms):\n" + "\n".join(lines)
+
+
+PROFILERS = {"cprofile": CProfileHook, "sampling": SamplingHook}
+
+
+def use_profiler(kind):
+    """Profile every profile() block with a hook of this kind (None turns it off)"""
+    registry.profiler = PROFILERS[kind] if kind else None
+
+
+class profile:
+    """Run a block under a profiler hook; the report is left in .report.
+
+    Without an explicit hook, each block gets its own hook of the kind
+    chosen with use_profiler() (so concurrent blocks do not share one),
+    and its report is kept in registry.reports.
+    """
+
+    def __init__(self, name, hook=None):
+        self.name = name
+        self.shared = hook is None
+        if hook is None and registry.profiler is not None:
+            hook = registry.profiler()
+        self.hook = hook
+        self.report = None
+
+    def __enter__(self):
+        if self.hook is not None:
+            self.hook.start(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.hook is not None:
+            self.report = self.hook.stop(self.name)
+            if self.shared:
+                registry.reports[self.name] = self.report
+        return False
+
+
+# ---------------------------
+# HTTP exposition
+# ---------------------------
+def serve(port=9100, host="127.0.0.1"):
+    """Expose /metrics (and /profile) over HTTP from a background thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                body = registry.render().encode()
+            elif path == "/profile":
+                body = registry.render_reports().encode()
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="atm-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,226 @@
+"""
+Event Replay
+Re-applies a recorded event log through the account state machine and
+checks that it reproduces the recorded state: every event's balance and
+each account's final balance.
+
+Aggregates and rollups are not recorded apart from the events they are
+computed from, so they are checked through the state fingerprint, a
+hash of every account's balance, aggregates and rollups: --expect
+compares it with one recorded earlier, e.g. by the version that wrote
+the log. A seeded simulation (--simulate) records the fingerprint of
+the live run and checks the replay against it.
+
+Replays run with a clock that returns each event's recorded timestamp,
+so they are deterministic.
+
+Run: python replay.py --storage sqlite:atm.db [--expect FINGERPRINT]
+     python replay.py --simulate 1000000 --accounts 1000 [--seed 42]
+"""
+
+import argparse
+import hashlib
+import random
+import time
+
+from accounts import AccountManager
+from errors import ATMError
+from events import DEPOSIT, WITHDRAW, BALANCE_CHECK
+from storage import MemoryStorage, open_storage
+
+
+class ReplayClock:
+    """Clock that reads whatever time it was last set to"""
+
+    __slots__ = ("now",)
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SteppingClock:
+    """Deterministic clock advancing a fixed step on every reading"""
+
+    __slots__ = ("now", "step")
+
+    def __init__(self, start=1_700_000_000.0, step=1.0):
+        self.now = start - step
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def update_digest(digest, account_id, balance, ledger):
+    """Add one account's state to a fingerprint digest"""
+    digest.update(repr((account_id, balance, ledger.stats.state(), ledger.rollups.state())).encode())
+
+
+class RecordingStorage(MemoryStorage):
+    """MemoryStorage that also keeps every event, for simulations"""
+
+    def __init__(self):
+        super().__init__()
+        self.events = {}
+        self.fingerprint = None     # of the live run, set by simulate()
+
+    def record(self, account_id, pin, balance, kind, amount, timestamp):
+        super().record(account_id, pin, balance, kind, amount, timestamp)
+        self.events.setdefault(account_id, []).append((timestamp, kind, amount, balance))
+
+    def record_group(self, events):
+        for event in events:
+            self.record(*event)
+
+    def iter_events(self, account_id):
+        return iter(self.events.get(account_id, ()))
+
+
+class ReplayReport:
+    """Outcome of a replay"""
+
+    __slots__ = ("accounts", "events", "seconds", "mismatches", "digest")
+
+    def __init__(self):
+        self.accounts = 0
+        self.events = 0
+        self.seconds = 0.0
+        self.mismatches = []
+        self.digest = hashlib.sha256()
+
+    @property
+    def fingerprint(self):
+        """Hash of every replayed account's balance, aggregates and rollups"""
+        return self.digest.hexdigest()[:16]
+
+    @property
+    def rate(self):
+        """Events replayed per second"""
+        return self.events / self.seconds if self.seconds else 0.0
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+    def __str__(self):
+        return (f"{self.events} events over {self.accounts} accounts in {self.seconds:.2f}s "
+                f"({self.rate:,.0f} events/s), {len(self.mismatches)} mismatch(es)")
+
+
+def replay(storage, account_ids=None, expect=None):
+    """Replay every account in `storage` from its snapshot and verify it,
+    and its fingerprint if `expect` is given"""
+    report = ReplayReport()
+    clock = ReplayClock()
+    manager = AccountManager(MemoryStorage(), clock=clock)
+    for account_id in (storage.account_ids() if account_ids is None else account_ids):
+        stored = storage.get_account(account_id)
+        if stored is None:
+            continue
+        account = manager.get(account_id)
+        state = storage.snapshot_state(account_id)
+        if state is not None:
+            account.balance = state[1]
+            account.ledger.stats.load(state[2])
+            account.ledger.rollups.load(state[3])
+
+        events = list(storage.iter_events(account_id))
+        mismatch = None
+        started = time.perf_counter()
+        for seq, (timestamp, kind, amount, balance) in enumerate(events):
+            clock.now = timestamp
+            try:
+                replayed = manager.apply(account_id, kind, amount)
+            except ATMError as exc:
+                mismatch = f"event {seq}: {exc}"
+                break
+            if replayed != balance:
+                mismatch = f"event {seq}: balance {replayed}, recorded {balance}"
+                break
+        report.seconds += time.perf_counter() - started
+        report.events += len(events)
+        report.accounts += 1
+
+        ledger = account.ledger
+        if mismatch is None and account.balance != stored[1]:
+            mismatch = f"final balance {account.balance}, recorded {stored[1]}"
+        if mismatch is not None:
+            report.mismatches.append((account_id, mismatch))
+        update_digest(report.digest, account_id, account.balance, ledger)
+        manager.reset(account_id)
+    if expect is not None and report.fingerprint != expect:
+        report.mismatches.append(("*", f"fingerprint {report.fingerprint}, expected {expect}"))
+    return report
+
+
+def simulate(operations, accounts=1000, seed=42):
+    """Run a seeded workload on a stepping clock and return its RecordingStorage,
+    with the fingerprint of the state the live run ended in"""
+    rng = random.Random(seed)
+    storage = RecordingStorage()
+    manager = AccountManager(storage, clock=SteppingClock())
+    ids = [f"sim{i:07d}" for i in range(accounts)]
+    for account_id in ids:
+        manager.create_pin(account_id, "simulated")
+    for _ in range(max(operations - accounts, 0)):
+        account_id = rng.choice(ids)
+        r = rng.random()
+        try:
+            if r < 0.4:
+                manager.apply(account_id, DEPOSIT, rng.randint(1, 500))
+            elif r < 0.7:
+                manager.apply(account_id, WITHDRAW, rng.randint(1, 500))
+            elif r < 0.8:
+                manager.transfer(account_id, rng.choice(ids), rng.randint(1, 100))
+            else:
+                manager.apply(account_id, BALANCE_CHECK)
+        except ATMError:
+            pass
+    digest = hashlib.sha256()
+    for account_id in ids:
+        account = manager.get(account_id)
+        update_digest(digest, account_id, account.balance, account.ledger)
+    storage.fingerprint = digest.hexdigest()[:16]
+    return storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an event log and verify balances and aggregates")
+    parser.add_argument("--storage", help="storage backend to replay, e.g. sqlite:atm.db (default: $ATM_STORAGE)")
+    parser.add_argument("--account", action="append", help="replay only this account (repeatable)")
+    parser.add_argument("--expect", metavar="FINGERPRINT", help="fail unless the replayed state has this fingerprint")
+    parser.add_argument("--simulate", type=int, metavar="OPS", help="replay a seeded simulation of OPS operations instead")
+    parser.add_argument("--accounts", type=int, default=1000, help="accounts in the simulation")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.simulate:
+        started = time.perf_counter()
+        storage = simulate(args.simulate, args.accounts, args.seed)
+        print(f"🎲 Simulated {sum(map(len, storage.events.values()))} events "
+              f"in {time.perf_counter() - started:.2f}s")
+        expect = args.expect or storage.fingerprint
+    else:
+        storage = open_storage(args.storage)
+        expect = args.expect
+    try:
+        report = replay(storage, args.account, expect)
+    finally:
+        storage.close()
+
+    print(f"⏩ Replayed {report}")
+    print(f"🔑 State fingerprint: {report.fingerprint}")
+    for account_id, mismatch in report.mismatches[:20]:
+        print(f"❌ {account_id}: {mismatch}")
+    if report.ok:
+        print("✅ Balances match the recorded state." if expect is None
+              else "✅ Balances and the state fingerprint match the recorded state.")
+    raise SystemExit(0 if report.ok else 1)
+
+
+if __name__ == "__main__":
+    main()
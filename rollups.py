@@ -0,0 +1,243 @@
+"""
+Time-Bucketed Rollups
+Per-day, per-week and per-month deposit/withdrawal totals, counts and
+opening/closing balances for statements and charts.
+
+Buckets are kept in time order and updated as the ledger appends, so a
+range query touches only the buckets it covers, never the events.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+from itertools import compress
+
+from events import DEPOSIT, WITHDRAW, TRANSFER_OUT, TRANSFER_IN
+
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+PERIODS = (DAY, WEEK, MONTH)
+
+LABEL_FORMATS = {DAY: "%Y-%m-%d", WEEK: "%Y-%m-%d", MONTH: "%Y-%m"}
+
+
+def _midnight(day):
+    return datetime.combine(day, time()).timestamp()
+
+
+def period_bounds(timestamp, period):
+    """Local [start, end) timestamps of the period containing `timestamp`"""
+    day = date.fromtimestamp(timestamp)
+    if period == DAY:
+        start, end = day, day + timedelta(days=1)
+    elif period == WEEK:
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    elif period == MONTH:
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    return _midnight(start), _midnight(end)
+
+
+def _opening(kind, amount, balance):
+    """Balance before an event, given the balance after it"""
+    if kind == DEPOSIT or kind == TRANSFER_IN:
+        return balance - amount
+    if kind == WITHDRAW or kind == TRANSFER_OUT:
+        return balance + amount
+    return balance
+
+
+class Bucket:
+    """Totals for one period"""
+
+    __slots__ = ("start", "end", "transactions",
+                 "deposit_count", "deposit_total", "withdraw_count", "withdraw_total",
+                 "opening_balance", "closing_balance")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.transactions = 0
+        self.deposit_count = 0
+        self.deposit_total = 0
+        self.withdraw_count = 0
+        self.withdraw_total = 0
+        self.opening_balance = None
+        self.closing_balance = None
+
+    @property
+    def net(self):
+        """Deposits minus withdrawals"""
+        return self.deposit_total - self.withdraw_total
+
+    def add(self, kind, amount, balance):
+        """Fold a single event into the bucket"""
+        if not self.transactions:
+            self.opening_balance = _opening(kind, amount, balance)
+        self.transactions += 1
+        if kind == DEPOSIT:
+            self.deposit_count += 1
+            self.deposit_total += amount
+        elif kind == WITHDRAW:
+            self.withdraw_count += 1
+            self.withdraw_total += amount
+        self.closing_balance = balance
+
+    def __repr__(self):
+        return (f"Bucket(start={self.start!r}, transactions={self.transactions}, "
+                f"deposits={self.deposit_total}, withdrawals={self.withdraw_total}, "
+                f"closing_balance={self.closing_balance})")
+
+
+class Rollup:
+    """Time-ordered buckets for one period length"""
+
+    def __init__(self, period):
+        self.period = period
+        self.starts = array("d")
+        self.buckets = []
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def clear(self):
+        del self.starts[:]
+        self.buckets.clear()
+
+    def _bucket(self, timestamp):
+        """The bucket containing `timestamp`, created if needed"""
+        buckets = self.buckets
+        if buckets and buckets[-1].start <= timestamp < buckets[-1].end:
+            return buckets[-1]
+        i = bisect_right(self.starts, timestamp) - 1
+        if i >= 0 and timestamp < buckets[i].end:
+            return buckets[i]
+        bucket = Bucket(*period_bounds(timestamp, self.period))
+        self.starts.insert(i + 1, bucket.start)
+        buckets.insert(i + 1, bucket)
+        return bucket
+
+    def update(self, timestamp, kind, amount, balance):
+        self._bucket(timestamp).add(kind, amount, balance)
+
+    def backfill(self, timestamps, kinds, amounts, balances, lo=0):
+        """Fold events lo.. of time-ordered columns in one pass.
+
+        Each bucket's span is found by bisecting the timestamps, then
+        summed with slice operations instead of event-by-event updates.
+        """
+        n = len(timestamps)
+        while lo < n:
+            bucket = self._bucket(timestamps[lo])
+            hi = bisect_left(timestamps, bucket.end, lo, n)
+            span_kinds, span_amounts = kinds[lo:hi], amounts[lo:hi]
+            if not bucket.transactions:
+                bucket.opening_balance = _opening(kinds[lo], amounts[lo], balances[lo])
+            bucket.transactions += hi - lo
+            bucket.deposit_count += span_kinds.count(DEPOSIT)
+            bucket.deposit_total += sum(compress(span_amounts, map(DEPOSIT.__eq__, span_kinds)))
+            bucket.withdraw_count += span_kinds.count(WITHDRAW)
+            bucket.withdraw_total += sum(compress(span_amounts, map(WITHDRAW.__eq__, span_kinds)))
+            bucket.closing_balance = balances[hi - 1]
+            lo = hi
+
+    def query(self, start_time=None, end_time=None):
+        """Buckets overlapping [start_time, end_time), oldest first"""
+        lo, hi = 0, len(self.buckets)
+        if start_time is not None:
+            lo = max(bisect_right(self.starts, start_time) - 1, 0)
+            if lo < hi and self.buckets[lo].end <= start_time:
+                lo += 1
+        if end_time is not None:
+            hi = bisect_left(self.starts, end_time, lo, hi)
+        return self.buckets[lo:hi]
+
+    def last(self, n):
+        """The n most recent buckets, oldest first"""
+        return self.buckets[-n:] if n else []
+
+    def totals(self, start_time=None, end_time=None):
+        """One bucket summing every bucket in the range"""
+        buckets = self.query(start_time, end_time)
+        if not buckets:
+            return Bucket(start_time, end_time)
+        total = Bucket(buckets[0].start, buckets[-1].end)
+        for bucket in buckets:
+            total.transactions += bucket.transactions
+            total.deposit_count += bucket.deposit_count
+            total.deposit_total += bucket.deposit_total
+            total.withdraw_count += bucket.withdraw_count
+            total.withdraw_total += bucket.withdraw_total
+        total.opening_balance = buckets[0].opening_balance
+        total.closing_balance = buckets[-1].closing_balance
+        return total
+
+    def state(self):
+        """Every bucket as a plain list, for snapshots"""
+        return [[getattr(bucket, name) for name in Bucket.__slots__] for bucket in self.buckets]
+
+    def load(self, state):
+        """Replace the buckets with ones saved by state()"""
+        self.clear()
+        for values in state:
+            bucket = Bucket(values[0], values[1])
+            for name, value in zip(Bucket.__slots__, values):
+                setattr(bucket, name, value)
+            self.starts.append(bucket.start)
+            self.buckets.append(bucket)
+
+    def label(self, bucket):
+        """Short display label for a bucket of this rollup"""
+        return datetime.fromtimestamp(bucket.start).strftime(LABEL_FORMATS[self.period])
+
+
+class Rollups:
+    """Daily, weekly and monthly rollups for one ledger"""
+
+    def __init__(self):
+        self.periods = {period: Rollup(period) for period in PERIODS}
+        self._rollups = tuple(self.periods.values())
+
+    def __getitem__(self, period):
+        return self.periods[period]
+
+    def update(self, timestamp, kind, amount, balance):
+        """Fold a single event into every period"""
+        for rollup in self._rollups:
+            buckets = rollup.buckets
+            # Fast path: the event falls in the newest bucket
+            if buckets and buckets[-1].start <= timestamp < buckets[-1].end:
+                buckets[-1].add(kind, amount, balance)
+            else:
+                rollup._bucket(timestamp).add(kind, amount, balance)
+
+    def backfill(self, ledger, start=0):
+        """Fold the ledger's in-memory records from index `start` on, one pass per period"""
+        for rollup in self.periods.values():
+            rollup.backfill(ledger.timestamps, ledger.kinds, ledger.amounts, ledger.balances, start)
+        return self
+
+    def clear(self):
+        for rollup in self.periods.values():
+            rollup.clear()
+
+    def state(self):
+        return {period: rollup.state() for period, rollup in self.periods.items()}
+
+    def load(self, state):
+        for period, buckets in state.items():
+            self.periods[period].load(buckets)
+        return self
+
+    @classmethod
+    def from_ledger(cls, ledger):
+        """Build rollups for an existing ledger, archived records included"""
+        rollups = cls()
+        for chunk in ledger.columns(None, 0, len(ledger), ledger.segment_size):
+            for rollup in rollups._rollups:
+                rollup.backfill(*chunk)
+        return rollups
@@ -0,0 +1,133 @@
+"""
+PIN Security
+- Salted PBKDF2 PIN hashes with a tunable cost (ATM_PIN_ITERATIONS)
+- Constant-time comparison
+- Token-bucket attempt limiting with lockout, per account and per source
+- A short-lived cache of verified PINs so repeated operations in the same
+  session do not pay the KDF cost every time
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from errors import TooManyAttempts
+
+PIN_ITERATIONS = int(os.environ.get("ATM_PIN_ITERATIONS", "100000"))
+HASH_PREFIX = "pbkdf2_sha256"
+
+
+def hash_pin(pin, iterations=None):
+    """Return a salted hash string for the PIN"""
+    iterations = iterations or PIN_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", pin.encode(), salt, iterations)
+    return f"{HASH_PREFIX}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def check_pin(pin, stored):
+    """Compare a PIN against a stored hash in constant time"""
+    if not stored.startswith(HASH_PREFIX + "$"):
+        # Plaintext PIN written before hashing was introduced
+        return hmac.compare_digest(pin.encode(), stored.encode())
+    _, iterations, salt, expected = stored.split("$")
+    digest = hashlib.pbkdf2_hmac("sha256", pin.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest, bytes.fromhex(expected))
+
+
+class AttemptLimiter:
+    """Token bucket of failed attempts per key, with a lockout once it is empty.
+
+    Each key may fail `capacity` times in a burst; tokens come back at one
+    per `refill_seconds`. When the bucket runs dry the key is locked for
+    `lockout_seconds`. A success forgets the failures of the keys it is
+    given; pass it only the keys a correct PIN vouches for (the account),
+    not the source, whose bucket should refill at its normal rate.
+    """
+
+    def __init__(self, capacity=5, refill_seconds=60.0, lockout_seconds=300.0, max_keys=100_000):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.lockout_seconds = lockout_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [tokens, updated_at, locked_until]
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        tokens, updated_at, locked_until = bucket
+        bucket[0] = min(self.capacity, tokens + (now - updated_at) / self.refill_seconds)
+        bucket[1] = now
+        return bucket
+
+    def check(self, keys):
+        """Raise TooManyAttempts if any key is locked out"""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                bucket = self._bucket(key, now)
+                if bucket is not None and bucket[2] > now:
+                    raise TooManyAttempts(bucket[2] - now)
+
+    def failure(self, keys):
+        """Record a failed attempt against every key"""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                bucket = self._bucket(key, now)
+                if bucket is None:
+                    bucket = self._buckets[key] = [float(self.capacity), now, 0.0]
+                    if len(self._buckets) > self.max_keys:
+                        self._buckets.popitem(last=False)
+                bucket[0] -= 1
+                if bucket[0] < 1:
+                    bucket[2] = now + self.lockout_seconds
+                    bucket[0] = 0.0
+                self._buckets.move_to_end(key)
+
+    def success(self, keys):
+        """Forget failed attempts for every key"""
+        with self._lock:
+            for key in keys:
+                self._buckets.pop(key, None)
+
+
+class VerifiedCache:
+    """Remembers recently verified PINs as keyed HMAC tags.
+
+    A cache hit costs one HMAC-SHA256 instead of a full KDF run. Entries
+    are tied to the stored hash, so changing the PIN invalidates them.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=100_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()   # account_id -> (stored hash, tag, expires_at)
+        self._lock = threading.Lock()
+
+    def _tag(self, account_id, pin):
+        return hmac.new(self._key, f"{account_id}\0{pin}".encode(), hashlib.sha256).digest()
+
+    def hit(self, account_id, pin, stored):
+        entry = self._entries.get(account_id)
+        if entry is None or entry[0] != stored or entry[2] < time.monotonic():
+            return False
+        return hmac.compare_digest(entry[1], self._tag(account_id, pin))
+
+    def add(self, account_id, pin, stored):
+        with self._lock:
+            self._entries[account_id] = (stored, self._tag(account_id, pin), time.monotonic() + self.ttl)
+            self._entries.move_to_end(account_id)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, account_id):
+        with self._lock:
+            self._entries.pop(account_id, None)
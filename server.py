@@ -0,0 +1,227 @@
+"""
+ATM Network Server
+Serves ATM terminals over TCP with asyncio, using a line protocol on
+top of the headless ATMCore API.
+
+Each request is one line; each reply is one line starting with OK or ERR:
+    AUTH <account> <pin>        -> OK <balance>
+    CREATE <account> <pin>      -> OK 0
+    DEPOSIT <amount> [key]      -> OK <balance>
+    WITHDRAW <amount> [key]     -> OK <balance>
+    TRANSFER <account> <amount> [key] -> OK <balance>
+    BALANCE                     -> OK <balance>
+    CHANGEPIN <new pin>         -> OK
+    PING                        -> OK PONG
+    QUIT                        -> OK BYE
+Errors are reported as: ERR <ErrorType> <message>; unexpected failures
+as ERR InternalError, and the session stays open.
+A request sent again with the same [key] after a timeout is not applied
+twice; the reply repeats the balance from the first attempt.
+
+With --profile cprofile|sampling every request runs under its own
+profiler and the latest report per command is served at /profile on
+the metrics port.
+
+Run: python server.py --port 8765 [--shards 4] [--metrics-port 9100 --profile sampling]
+"""
+
+import argparse
+import asyncio
+import traceback
+
+import metrics
+from accounts import AccountManager
+from core import ATMCore
+from errors import ATMError
+from fraud import AnomalyScorer
+from limits import WithdrawalLimits
+from storage import open_storage
+
+MAX_LINE = 256
+COMMANDS = ("AUTH", "CREATE", "DEPOSIT", "WITHDRAW", "TRANSFER", "BALANCE", "CHANGEPIN", "PING", "QUIT")
+
+
+class Session:
+    """Per-connection state"""
+
+    __slots__ = ("account_id", "pin", "source")
+
+    def __init__(self, source=None):
+        self.account_id = None
+        self.pin = None
+        self.source = source
+
+
+def open_core():
+    """ATMCore over the configured storage, with withdrawal limits and fraud scoring"""
+    storage = open_storage()
+    return ATMCore(AccountManager(storage, scorer=AnomalyScorer()), limits=WithdrawalLimits(storage))
+
+
+class ATMServer:
+    """Asyncio TCP front-end for ATMCore"""
+
+    def __init__(self, core=None, host="127.0.0.1", port=8765,
+                 idle_timeout=60.0, max_connections=10_000):
+        self.core = core if core is not None else open_core()
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def handle(self, reader, writer):
+        """Serve one connection until QUIT, EOF or the idle timeout"""
+        if self.connections >= self.max_connections:
+            writer.write(b"ERR Busy Too many connections.\n")
+            await writer.drain()
+            writer.close()
+            return
+
+        self.connections += 1
+        metrics.inc("atm_server_connections_total")
+        peer = writer.get_extra_info("peername")
+        session = Session(peer[0] if peer else None)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    writer.write(b"ERR Timeout Session idle for too long.\n")
+                    break
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b"ERR BadRequest Line too long.\n")
+                    break
+                if not line:
+                    break
+
+                parts = line.decode("utf-8", "replace").split()
+                with metrics.timer("atm_server_request"):
+                    if getattr(self.core, "blocking", False):
+                        reply, done = await asyncio.get_running_loop().run_in_executor(
+                            None, self.run, session, parts)
+                    else:
+                        reply, done = self.run(session, parts)
+                writer.write(reply.encode("utf-8") + b"\n")
+                # Backpressure: stop reading until the client has taken our replies
+                await writer.drain()
+                if done:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def run(self, session, parts):
+        """dispatch(), under a profiler when one was chosen with metrics.use_profiler()"""
+        if metrics.registry.profiler is None:
+            return self.dispatch(session, parts)
+        command = parts[0].upper() if parts else ""
+        with metrics.profile("server_" + (command.lower() if command in COMMANDS else "other")):
+            return self.dispatch(session, parts)
+
+    def dispatch(self, session, parts):
+        """Execute one command and return (reply line, close connection?)"""
+        if not parts:
+            return "ERR BadRequest Empty command.", False
+        command, args = parts[0].upper(), parts[1:]
+        core = self.core
+        try:
+            if command == "QUIT":
+                return "OK BYE", True
+            if command == "PING":
+                return "OK PONG", False
+            if command in ("AUTH", "CREATE"):
+                if len(args) != 2:
+                    return f"ERR BadRequest Usage: {command} <account> <pin>", False
+                account_id, pin = args
+                if command == "CREATE":
+                    result = core.create_pin(account_id, pin)
+                    balance = result.balance
+                else:
+                    core.verify_pin(account_id, pin, session.source)
+                    balance = core.balance(account_id)
+                session.account_id, session.pin = account_id, pin
+                return f"OK {balance}", False
+
+            if session.account_id is None:
+                return "ERR NotAuthenticated Use AUTH <account> <pin> first.", False
+            if command in ("DEPOSIT", "WITHDRAW") and len(args) in (1, 2):
+                operation = core.deposit if command == "DEPOSIT" else core.withdraw
+                result = operation(session.account_id, session.pin, args[0], session.source, *args[1:])
+                return f"OK {result.balance}", False
+            if command == "TRANSFER" and len(args) in (2, 3):
+                result = core.transfer(session.account_id, session.pin, args[0], args[1], session.source, *args[2:])
+                return f"OK {result.balance}", False
+            if command == "BALANCE" and not args:
+                return f"OK {core.check_balance(session.account_id, session.pin, session.source).balance}", False
+            if command == "CHANGEPIN" and len(args) == 1:
+                core.change_pin(session.account_id, session.pin, args[0], session.source)
+                session.pin = args[0]
+                return "OK", False
+        except ATMError as exc:
+            return f"ERR {type(exc).__name__} {exc}", False
+        except Exception:
+            # A bug must not take the connection down: report it, answer, carry on
+            traceback.print_exc()
+            return "ERR InternalError The request could not be completed.", False
+        return f"ERR BadRequest Unknown command: {' '.join(parts)}", False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ATM network server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--idle-timeout", type=float, default=60.0)
+    parser.add_argument("--max-connections", type=int, default=10_000)
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--shards", type=int, default=0, help="worker processes to spread accounts over")
+    parser.add_argument("--profile", choices=sorted(metrics.PROFILERS),
+                        help="profile every request; reports are served at /profile on the metrics port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.enable()
+        metrics.serve(args.metrics_port, args.host)
+    metrics.use_profiler(args.profile)
+
+    if args.shards:
+        from sharding import ShardedCore
+        core = ShardedCore(args.shards)
+    else:
+        core = open_core()
+    server = ATMServer(core, host=args.host, port=args.port, idle_timeout=args.idle_timeout,
+                       max_connections=args.max_connections)
+    print(f"🏦 ATM server listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("👋 Server stopped.")
+    finally:
+        server.core.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Account Sharding
+Spreads accounts over a pool of worker processes so the ATM can use
+every core of the machine:
+- Each account belongs to one shard, chosen by a stable hash of its ID
+- Each shard process owns its accounts, its ATMCore and its own log
+  (sqlite:atm.db becomes atm.shard0.db, atm.shard1.db, ...)
+- ShardedCore routes requests to the owning shard over pipes; requests
+  queued while a batch is in flight are sent together as one message
+- Transfers between accounts on the same shard run there directly;
+  across shards they use two-phase commit: both shards prepare (the
+  debit is held against the balance), then both abort, or the debit
+  commits and only then the credit (refunded if it can no longer land)
+
+Prepared transfers live in shard memory; if a shard dies before commit
+nothing has been applied, but the coordinator's decision is not logged.
+Idempotency keys of cross-shard transfers are kept by the payer's shard
+and saved with the debit, so a retry is recognised after a restart.
+A shard whose process dies is not restarted: its pending and future
+requests fail at once with ShardUnavailable instead of waiting forever.
+"""
+
+import itertools
+import multiprocessing
+import os
+import threading
+import uuid
+import zlib
+from concurrent.futures import Future
+
+import errors
+from accounts import AccountManager
+from core import ATMCore, Result, validate_amount
+from errors import ATMError, InsufficientFunds, RequestInProgress, ShardUnavailable, UnknownAccount
+from events import TRANSFER_OUT, TRANSFER_IN
+from fraud import AnomalyScorer
+from limits import WithdrawalLimits
+from storage import open_storage
+
+# ATMCore methods a shard serves directly
+CORE_OPERATIONS = frozenset((
+    "has_pin", "balance", "verify_pin", "create_pin", "change_pin",
+    "deposit", "withdraw", "check_balance", "reset", "restore", "transfer",
+))
+
+
+def shard_of(account_id, shards):
+    """Index of the shard owning an account (stable across processes)"""
+    return zlib.crc32(account_id.encode("utf-8")) % shards
+
+
+def shard_storage(spec, index):
+    """Storage spec for one shard, derived from the spec for the whole ATM"""
+    if spec is None:
+        spec = os.environ.get("ATM_STORAGE", "memory")
+    if spec.startswith("sqlite:"):
+        base, ext = os.path.splitext(spec[len("sqlite:"):] or "atm.db")
+        return f"sqlite:{base}.shard{index}{ext}"
+    return spec
+
+
+class Shard:
+    """Request handler inside a worker process.
+
+    Requests are handled one at a time, so holds placed by prepared
+    transfers can be checked without further locking.
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self.held = {}       # account_id -> amount reserved by prepared debits
+        self.prepared = {}   # transfer leg id -> (account_id, signed amount)
+        self.keyed = {}      # debit leg id -> (account_id, idempotency key, request)
+
+    def handle(self, operation, args):
+        # Debits must leave held funds alone. The PIN is checked first, so
+        # the available balance is only ever reported to the account owner
+        # (the operation's own check is then a cache hit)
+        if operation == "withdraw" and args[0] in self.held:
+            self.core.verify_pin(args[0], args[1], args[3])
+            self._reserve_check(args[0], validate_amount(args[2]))
+        elif operation == "transfer" and args[0] in self.held:
+            self.core.verify_pin(args[0], args[1], args[4])
+            self._reserve_check(args[0], validate_amount(args[3]))
+        if operation in CORE_OPERATIONS:
+            return getattr(self.core, operation)(*args)
+        return getattr(self, operation)(*args)
+
+    def _reserve_check(self, account_id, amount):
+        available = self.core.balance(account_id) - self.held.get(account_id, 0)
+        if amount > available:
+            raise InsufficientFunds(available)
+
+    def prepare_debit(self, txid, account_id, pin, amount, source=None, key=None, to_account=None):
+        """Phase one for the paying side: verify and hold the funds.
+
+        With an idempotency `key` already used for this transfer, nothing
+        is held and the saved result values are returned instead.
+        """
+        self.core.verify_pin(account_id, pin, source)
+        amount = validate_amount(amount)
+        if key is not None:
+            request = ("transfer", amount, to_account)
+            values = self.core.idempotency.lookup(account_id, key, request)
+            if values is not None:
+                return values
+            if any(keyed[:2] == (account_id, key) for keyed in self.keyed.values()):
+                raise RequestInProgress()
+        self._reserve_check(account_id, amount)
+        self.held[account_id] = self.held.get(account_id, 0) + amount
+        self.prepared[txid] = (account_id, -amount)
+        if key is not None:
+            self.keyed[txid] = (account_id, key, request)
+        return None
+
+    def prepare_credit(self, txid, account_id, amount):
+        """Phase one for the receiving side: the account must exist"""
+        amount = validate_amount(amount)
+        if not self.core.has_pin(account_id):
+            raise UnknownAccount(account_id)
+        self.prepared[txid] = (account_id, amount)
+
+    def _release(self, txid):
+        account_id, amount = self.prepared.pop(txid)
+        if amount < 0:
+            remaining = self.held[account_id] + amount
+            if remaining:
+                self.held[account_id] = remaining
+            else:
+                del self.held[account_id]
+        return account_id, amount
+
+    def commit(self, txid):
+        """Phase two: apply a prepared leg and return the new balance"""
+        keyed = self.keyed.pop(txid, None)
+        account_id, amount = self._release(txid)
+        if amount < 0:
+            balance = self.core.accounts.withdraw(account_id, -amount, TRANSFER_OUT)
+            if keyed is not None:
+                # Queued for the same storage flush as the debit's event
+                self.core.idempotency.put(account_id, keyed[1], (account_id, TRANSFER_OUT, -amount, balance),
+                                          keyed[2])
+            return balance
+        # The payee may have been reset since it was prepared
+        if not self.core.has_pin(account_id):
+            raise UnknownAccount(account_id)
+        return self.core.accounts.deposit(account_id, amount, TRANSFER_IN)
+
+    def refund(self, account_id, amount):
+        """Give back a committed debit whose credit could not be committed"""
+        return self.core.accounts.deposit(account_id, amount, TRANSFER_IN)
+
+    def abort(self, txid):
+        """Phase two: drop a prepared leg (no-op if it was never prepared)"""
+        self.keyed.pop(txid, None)
+        if txid in self.prepared:
+            self._release(txid)
+
+
+def _serve(conn, storage_spec, pin_iterations, limits):
+    """Worker process main loop: handle batches until told to stop"""
+    storage = open_storage(storage_spec)
+    shard = Shard(ATMCore(AccountManager(storage, scorer=AnomalyScorer()), pin_iterations=pin_iterations,
+                          limits=WithdrawalLimits(storage) if limits else None))
+    try:
+        while True:
+            batch = conn.recv()
+            if batch is None:
+                break
+            replies = []
+            for request_id, operation, args in batch:
+                try:
+                    replies.append((request_id, True, shard.handle(operation, args)))
+                except Exception as exc:
+                    replies.append((request_id, False, (type(exc).__name__, str(exc), vars(exc))))
+            conn.send(replies)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shard.core.close()
+
+
+def _rebuild_error(name, message, attributes):
+    """Recreate an error raised in a shard, keeping its type and message"""
+    cls = getattr(errors, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, ATMError)):
+        return RuntimeError(f"{name}: {message}")
+    exc = cls.__new__(cls)
+    Exception.__init__(exc, message)
+    exc.__dict__.update(attributes)
+    return exc
+
+
+class _ShardClient:
+    """Router-side end of one shard's pipe"""
+
+    def __init__(self, index, storage_spec, pin_iterations, limits, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, storage_spec, pin_iterations, limits),
+                                       name=f"atm-shard-{index}", daemon=True)
+        self.process.start()
+        child.close()
+        self.index = index
+        self.waiting = {}                  # request id -> Future
+        self.outbox = []
+        self.ready = threading.Condition()
+        self.closed = False
+        self.dead = False                  # the pipe broke: the process is gone
+        threading.Thread(target=self._send_loop, name=f"atm-shard-{index}-send", daemon=True).start()
+        threading.Thread(target=self._receive_loop, name=f"atm-shard-{index}-recv", daemon=True).start()
+
+    def submit(self, request_id, operation, args):
+        future = Future()
+        with self.ready:
+            if self.dead:
+                future.set_exception(ShardUnavailable(self.index))
+                return future
+            self.waiting[request_id] = future
+            self.outbox.append((request_id, operation, args))
+            if len(self.outbox) == 1:
+                self.ready.notify()
+        return future
+
+    def _send_loop(self):
+        while True:
+            with self.ready:
+                while not self.outbox and not self.closed and not self.dead:
+                    self.ready.wait()
+                if self.dead:
+                    return
+                if not self.outbox:
+                    break
+                batch, self.outbox = self.outbox, []
+            try:
+                self.conn.send(batch)
+            except (OSError, ValueError):
+                self._fail()
+                return
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            self._fail()
+
+    def _receive_loop(self):
+        while True:
+            try:
+                replies = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.ready:
+                futures = [self.waiting.pop(request_id, None) for request_id, _, _ in replies]
+            for future, (_, ok, payload) in zip(futures, replies):
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(_rebuild_error(*payload))
+        self._fail()
+
+    def _fail(self):
+        """Mark the shard dead and fail everything still waiting on it"""
+        with self.ready:
+            self.dead = True
+            waiting, self.waiting = self.waiting, {}
+            self.outbox = []
+            self.ready.notify()
+        for future in waiting.values():
+            future.set_exception(ShardUnavailable(self.index))
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+
+class ShardedCore:
+    """ATMCore-compatible front for a pool of shard processes.
+
+    Calls block until the owning shard replies; use submit() to keep
+    many requests in flight and let the router batch them. Each shard
+    enforces withdrawal limits for its accounts unless `limits` is false.
+    """
+
+    # Calls wait on IPC, so event-loop front-ends should run them in threads
+    blocking = True
+
+    def __init__(self, shards=None, storage=None, pin_iterations=None, limits=True):
+        self.shards = shards or os.cpu_count() or 1
+        context = multiprocessing.get_context()
+        self._clients = [_ShardClient(i, shard_storage(storage, i), pin_iterations, limits, context)
+                         for i in range(self.shards)]
+        self._request_ids = itertools.count()
+
+    def _client(self, account_id):
+        return self._clients[shard_of(account_id, self.shards)]
+
+    def submit(self, operation, account_id, *args):
+        """Send an operation to the account's shard and return a Future"""
+        return self._client(account_id).submit(next(self._request_ids), operation, (account_id, *args))
+
+    def _call(self, operation, account_id, *args):
+        return self.submit(operation, account_id, *args).result()
+
+    def has_pin(self, account_id):
+        return self._call("has_pin", account_id)
+
+    def balance(self, account_id):
+        return self._call("balance", account_id)
+
+    def verify_pin(self, account_id, pin, source=None):
+        return self._call("verify_pin", account_id, pin, source)
+
+    def create_pin(self, account_id, new_pin):
+        return self._call("create_pin", account_id, new_pin)
+
+    def change_pin(self, account_id, old_pin, new_pin, source=None):
+        return self._call("change_pin", account_id, old_pin, new_pin, source)
+
+    def deposit(self, account_id, pin, amount, source=None, idempotency_key=None):
+        return self._call("deposit", account_id, pin, amount, source, idempotency_key)
+
+    def withdraw(self, account_id, pin, amount, source=None, idempotency_key=None):
+        return self._call("withdraw", account_id, pin, amount, source, idempotency_key)
+
+    def check_balance(self, account_id, pin, source=None):
+        return self._call("check_balance", account_id, pin, source)
+
+    def reset(self, account_id):
+        return self._call("reset", account_id)
+
+    def restore(self, account_id):
+        return self._call("restore", account_id)
+
+    def transfer(self, from_account, pin, to_account, amount, source=None, idempotency_key=None):
+        """Move funds between accounts on any shards"""
+        if shard_of(from_account, self.shards) == shard_of(to_account, self.shards):
+            return self._call("transfer", from_account, pin, to_account, amount, source, idempotency_key)
+        return self._transfer(from_account, pin, to_account, amount, source, idempotency_key)
+
+    def _transfer(self, from_account, pin, to_account, amount, source, idempotency_key):
+        """Two-phase commit of a transfer between accounts on different shards"""
+        txid = uuid.uuid4().hex
+        legs = (
+            (self._client(from_account), f"{txid}:debit", "prepare_debit",
+             (from_account, pin, amount, source, idempotency_key, to_account)),
+            (self._client(to_account), f"{txid}:credit", "prepare_credit", (to_account, amount)),
+        )
+        prepared = [client.submit(next(self._request_ids), operation, (leg, *args))
+                    for client, leg, operation, args in legs]
+        failures = [exc for exc in map(Future.exception, prepared) if exc is not None]
+        replayed = None if failures else prepared[0].result()
+        (debit_client, debit, _, _), (credit_client, credit, _, _) = legs
+        if failures or replayed is not None:
+            aborts = [client.submit(next(self._request_ids), "abort", (leg,)) for client, leg, _, _ in legs]
+            for future in aborts:
+                future.exception()
+            if failures:
+                raise failures[0]
+            return Result(*replayed)
+        # The credit is only committed once the debit is, so a debit that
+        # fails at commit (e.g. the payer was reset) creates no money
+        try:
+            balance = debit_client.submit(next(self._request_ids), "commit", (debit,)).result()
+        except Exception:
+            credit_client.submit(next(self._request_ids), "abort", (credit,)).result()
+            raise
+        try:
+            credit_client.submit(next(self._request_ids), "commit", (credit,)).result()
+        except Exception:
+            debit_client.submit(next(self._request_ids), "refund", (from_account, validate_amount(amount))).result()
+            raise
+        return Result(from_account, TRANSFER_OUT, validate_amount(amount), balance)
+
+    def close(self):
+        """Stop every shard process after its queued requests are done"""
+        for client in self._clients:
+            client.close()
+        for client in self._clients:
+            client.process.join()
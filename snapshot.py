@@ -0,0 +1,156 @@
+"""
+Account Snapshots
+Compact point-in-time copies of every account's PIN hash, balance,
+aggregates and rollups, so a restart replays only the events logged
+after the latest snapshot instead of the whole history (the older
+events are still read back, as history, but not aggregated again).
+
+File layout (little endian):
+    header   magic, generation, watermark (last event seq), created,
+             account count, index offset
+    records  u16 ID length, ID, u32 payload length, JSON payload
+    index    u64 record offsets, sorted by account ID
+
+The file is memory-mapped and records are decoded only when an account
+is first loaded, so opening a snapshot costs the same for any size.
+
+Run: python snapshot.py checkpoint|restore|info [--account ID] [--storage sqlite:atm.db]
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+MAGIC = b"ATMSNAP1"
+HEADER = struct.Struct("<8sqqdqq")
+OFFSET = struct.Struct("<Q")
+ID_LENGTH = struct.Struct("<H")
+PAYLOAD_LENGTH = struct.Struct("<I")
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.generation, self.watermark, self.created,
+         self.count, self._index) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not an ATM snapshot")
+
+    @classmethod
+    def open(cls, path):
+        """Open the snapshot at `path`, or return None if there is none"""
+        return cls(path) if os.path.exists(path) else None
+
+    def _offset(self, i):
+        return OFFSET.unpack_from(self._map, self._index + i * OFFSET.size)[0]
+
+    def _account_id(self, offset):
+        (length,) = ID_LENGTH.unpack_from(self._map, offset)
+        start = offset + ID_LENGTH.size
+        return self._map[start:start + length].decode("utf-8"), start + length
+
+    def _payload(self, offset):
+        (length,) = PAYLOAD_LENGTH.unpack_from(self._map, offset)
+        start = offset + PAYLOAD_LENGTH.size
+        return json.loads(self._map[start:start + length])
+
+    def get(self, account_id):
+        """(pin, balance, aggregates, rollups) for an account, or None"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, end = self._account_id(self._offset(mid))
+            if found == account_id:
+                return tuple(self._payload(end))
+            if found < account_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def __iter__(self):
+        """Yield (account_id, pin, balance, aggregates, rollups) in ID order"""
+        for i in range(self.count):
+            account_id, end = self._account_id(self._offset(i))
+            yield (account_id, *self._payload(end))
+
+    def close(self):
+        self._map.close()
+
+
+def write_snapshot(path, generation, watermark, accounts):
+    """Atomically write a snapshot.
+
+    `accounts` yields (account_id, pin, balance, ledger) sorted by ID and
+    is consumed once; the file only replaces `path` once it is complete
+    and synced.
+    """
+    tmp_path = path + ".tmp"
+    offsets = []
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, generation, watermark, 0.0, 0, 0))
+        for account_id, pin, balance, ledger in accounts:
+            key = account_id.encode("utf-8")
+            payload = json.dumps([pin, balance, ledger.stats.state(), ledger.rollups.state()],
+                                 separators=(",", ":")).encode("utf-8")
+            offsets.append(f.tell())
+            f.write(ID_LENGTH.pack(len(key)) + key + PAYLOAD_LENGTH.pack(len(payload)) + payload)
+        index_offset = f.tell()
+        f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, generation, watermark, time.time(), len(offsets), index_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main():
+    import argparse   # only the CLI needs it
+    parser = argparse.ArgumentParser(description="Write, inspect or restore account snapshots")
+    parser.add_argument("command", choices=("checkpoint", "restore", "info"))
+    parser.add_argument("--account", help="restore only this account (default: every account)")
+    parser.add_argument("--storage", help="storage backend, e.g. sqlite:atm.db (default: $ATM_STORAGE)")
+    args = parser.parse_args()
+
+    # Imported here: storage imports this module
+    from errors import NoSnapshot
+    from storage import open_storage
+
+    storage = open_storage(args.storage)
+    try:
+        if args.command == "checkpoint":
+            snapshot = storage.checkpoint()
+            if snapshot is None:
+                print("ℹ️ This storage backend does not keep snapshots.")
+            else:
+                print(f"✅ Snapshot {snapshot.generation} written for {snapshot.count} account(s); "
+                      f"covering events up to {snapshot.watermark}.")
+        elif args.command == "restore":
+            try:
+                storage.restore(args.account)
+            except NoSnapshot as exc:
+                print(f"❌ {exc}")
+            else:
+                print(f"✅ Restored {args.account or 'every account'} from the latest snapshot.")
+        else:
+            snapshot = storage.snapshot
+            if snapshot is None:
+                print("ℹ️ No snapshot yet.")
+            else:
+                created = datetime.fromtimestamp(snapshot.created).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"📸 Snapshot {snapshot.generation} from {created}: {snapshot.count} account(s), "
+                      f"covers events up to {snapshot.watermark}.")
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
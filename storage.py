@@ -0,0 +1,572 @@
+"""
+Account Storage
+Pluggable persistence for ATM accounts and their event log:
+- MemoryStorage keeps everything in process (the default)
+- SQLiteStorage writes to a WAL-mode database with grouped commits,
+  and periodically snapshots account state so the log stays short
+
+Select a backend with the ATM_STORAGE environment variable, e.g.
+ATM_STORAGE=sqlite:atm.db
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from errors import NoSnapshot, NothingToRestore, StorageLocked
+from ledger import Ledger
+from snapshot import Snapshot, write_snapshot
+
+DEFAULT_ACCOUNT = "default"
+
+# Events logged between automatic snapshots (0 = only on request)
+SNAPSHOT_EVERY = int(os.environ.get("ATM_SNAPSHOT_EVERY", "100000"))
+
+
+class Storage:
+    """Interface shared by every storage backend"""
+
+    snapshot = None
+
+    def get_account(self, account_id):
+        """Return (pin, balance) for an account, or None if it does not exist"""
+        raise NotImplementedError
+
+    def account_ids(self):
+        """Return the IDs of every stored account"""
+        raise NotImplementedError
+
+    def record(self, account_id, pin, balance, kind, amount, timestamp):
+        """Persist an account's new state together with the event that caused it"""
+        raise NotImplementedError
+
+    def record_group(self, events):
+        """Persist several (account_id, pin, balance, kind, amount, timestamp)
+        events as one unit: after a crash either all of them are stored or none"""
+        for event in events:
+            self.record(*event)
+
+    def iter_events(self, account_id):
+        """Yield (timestamp, kind, amount, balance) for an account, oldest
+        first, from after the latest snapshot"""
+        raise NotImplementedError
+
+    def iter_history(self, account_id):
+        """Yield the rows the latest snapshot already counts, oldest first"""
+        return iter(())
+
+    def delete_account(self, account_id):
+        """Remove an account and its event log"""
+        raise NotImplementedError
+
+    def load_result(self, account_id, key):
+        """(result values, expires_at, request) saved for an idempotency key, or None"""
+        return None
+
+    def save_result(self, account_id, key, values, expires_at, request=None):
+        """Remember an operation's result, and the request that produced it,
+        under its idempotency key"""
+
+    def load_limits(self, account_id):
+        """Withdrawal-limit counter state saved for an account, or None"""
+        return None
+
+    def save_limits(self, account_id, state):
+        """Remember an account's withdrawal-limit counters"""
+
+    def flush(self):
+        """Make every pending write durable"""
+
+    def close(self):
+        """Flush and release resources"""
+        self.flush()
+
+    def snapshot_state(self, account_id):
+        """(pin, balance, aggregates, rollups) saved by the latest snapshot, or None"""
+        return None
+
+    def checkpoint(self):
+        """Snapshot every account; returns the Snapshot"""
+        return None
+
+    def restore(self, account_id=None):
+        """Atomically undo an account's reset, or roll one account (or all)
+        back to the latest snapshot"""
+        raise NoSnapshot()
+
+    def undo_reset(self, account_id):
+        """Bring back an account reset since the latest snapshot, as long
+        as its ID has not been taken again"""
+        raise NothingToRestore()
+
+    def restorable(self, account_id):
+        """(pin, balance) that undo_reset(account_id) would bring back, or None"""
+        return None
+
+    def load_ledger(self, account_id, history=True):
+        """Rebuild an account's ledger: aggregates from the latest snapshot
+        plus the events logged after it, and the history before it as
+        records only. With history=False those records are not read."""
+        ledger = Ledger()
+        state = self.snapshot_state(account_id)
+        if state is not None:
+            ledger.stats.load(state[2])
+            ledger.rollups.load(state[3])
+            if history:
+                ledger.extend(self.iter_history(account_id), aggregate=False)
+        return ledger.extend(self.iter_events(account_id))
+
+
+class MemoryStorage(Storage):
+    """In-process storage; nothing survives a restart.
+
+    Events are not copied: the account's ledger, which the AccountManager
+    keeps for the life of the process, is the only copy of its history.
+    """
+
+    def __init__(self):
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def get_account(self, account_id):
+        return self._accounts.get(account_id)
+
+    def account_ids(self):
+        return list(self._accounts)
+
+    def record(self, account_id, pin, balance, kind, amount, timestamp):
+        with self._lock:
+            self._accounts[account_id] = (pin, balance)
+
+    def record_group(self, events):
+        with self._lock:
+            for account_id, pin, balance, kind, amount, timestamp in events:
+                self._accounts[account_id] = (pin, balance)
+
+    def iter_events(self, account_id):
+        return iter(())
+
+    def delete_account(self, account_id):
+        with self._lock:
+            self._accounts.pop(account_id, None)
+
+
+class SQLiteStorage(Storage):
+    """SQLite storage in WAL mode with batched, grouped commits.
+
+    Writes are buffered and committed together once `batch_size` writes are
+    pending or `flush_interval` seconds have passed, so a burst of deposits
+    costs one fsync instead of one per transaction. Data written within the
+    last interval can be lost on a crash; call flush() where that matters.
+
+    Every `snapshot_every` events the state of all accounts is written to
+    <path>.snap, so loading an account replays only the events logged
+    since; the events it covers stay in the log as history. A reset account's rows
+    are kept aside until then, so undo_reset() can bring it back without
+    snapshotting every other account.
+
+    Only one process may use a database at a time: the AccountManager
+    caches balances and ledgers, which another writer would make stale.
+    The connection holds an exclusive lock until close(); opening a
+    database that is in use raises StorageLocked. Spread load over several
+    processes with sharding.py, which gives each shard its own database.
+    """
+
+    def __init__(self, path="atm.db", batch_size=256, flush_interval=0.05, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = path + ".snap"
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        try:
+            self._conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Take the lock now rather than on the first write
+            self._conn.execute("BEGIN EXCLUSIVE")
+            self._conn.execute("COMMIT")
+        except sqlite3.OperationalError as exc:
+            self._conn.close()
+            raise StorageLocked(path) from exc
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.snapshot = Snapshot.open(self.snapshot_path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id TEXT PRIMARY KEY,
+                pin TEXT NOT NULL,
+                balance INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id TEXT NOT NULL,
+                ts REAL NOT NULL,
+                kind INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                balance INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_by_account ON events (account_id, seq);
+            CREATE TABLE IF NOT EXISTS dropped (
+                account_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS requests (
+                account_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                kind INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                request TEXT,
+                PRIMARY KEY (account_id, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS limits (
+                account_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS retired_accounts (
+                account_id TEXT PRIMARY KEY,
+                pin TEXT NOT NULL,
+                balance INTEGER NOT NULL,
+                dropped INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS retired_events (
+                seq INTEGER PRIMARY KEY,
+                account_id TEXT NOT NULL,
+                ts REAL NOT NULL,
+                kind INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                balance INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS retired_events_by_account ON retired_events (account_id, seq);
+        """)
+        # Databases written before keys were bound to their request
+        if "request" not in [row[1] for row in self._conn.execute("PRAGMA table_info(requests)")]:
+            self._conn.execute("ALTER TABLE requests ADD COLUMN request TEXT")
+        self._lock = threading.RLock()
+        self._pending_accounts = {}
+        self._pending_events = []
+        self._pending_results = []
+        self._pending_limits = {}
+        self._closed = False
+        self._since_snapshot = self._conn.execute(
+            "SELECT COUNT(*) FROM events WHERE seq > ?", (self._watermark(),)).fetchone()[0]
+        self._recover()
+        self._flusher = threading.Thread(target=self._flush_loop, name="atm-storage-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _recover(self):
+        """Bring the accounts table in line with the event log after a crash"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("""
+                UPDATE accounts SET balance = (
+                    SELECT balance FROM events
+                    WHERE events.account_id = accounts.account_id
+                    ORDER BY seq DESC LIMIT 1
+                )
+                WHERE EXISTS (SELECT 1 FROM events WHERE events.account_id = accounts.account_id)
+            """)
+            self._conn.execute("COMMIT")
+
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(self.flush_interval)
+            try:
+                if self._pending_events or self._pending_accounts or self._pending_results or self._pending_limits:
+                    self.flush()
+                if self.snapshot_every and self._since_snapshot >= self.snapshot_every:
+                    self.checkpoint()
+            except sqlite3.Error:
+                # Pending writes stay queued; the next tick tries again
+                continue
+
+    def _watermark(self):
+        return self.snapshot.watermark if self.snapshot is not None else 0
+
+    def _generation(self):
+        return self.snapshot.generation if self.snapshot is not None else 0
+
+    def get_account(self, account_id):
+        with self._lock:
+            if account_id in self._pending_accounts:
+                return self._pending_accounts[account_id]
+            row = self._conn.execute(
+                "SELECT pin, balance FROM accounts WHERE account_id = ?", (account_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def account_ids(self):
+        with self._lock:
+            self.flush()
+            return [row[0] for row in self._conn.execute("SELECT account_id FROM accounts")]
+
+    def record(self, account_id, pin, balance, kind, amount, timestamp):
+        with self._lock:
+            self._pending_accounts[account_id] = (pin, balance)
+            self._pending_events.append((account_id, timestamp, kind, amount, balance))
+            self._since_snapshot += 1
+            if len(self._pending_events) >= self.batch_size:
+                self.flush()
+
+    def record_group(self, events):
+        # Queued under one lock hold, so a single flush commits the whole group
+        with self._lock:
+            for account_id, pin, balance, kind, amount, timestamp in events:
+                self._pending_accounts[account_id] = (pin, balance)
+                self._pending_events.append((account_id, timestamp, kind, amount, balance))
+            self._since_snapshot += len(events)
+            if len(self._pending_events) >= self.batch_size:
+                self.flush()
+
+    def load_result(self, account_id, key):
+        # No flush: this process's pending results are still in its own cache
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, amount, balance, expires, request FROM requests WHERE account_id = ? AND key = ?",
+                (account_id, key)).fetchone()
+        if row is None:
+            return None
+        request = tuple(json.loads(row[4])) if row[4] is not None else None
+        return (account_id, row[0], row[1], row[2]), row[3], request
+
+    def save_result(self, account_id, key, values, expires_at, request=None):
+        # Committed by the same flush as the event the operation queued
+        with self._lock:
+            self._pending_results.append((account_id, key, values[1], values[2], values[3], expires_at,
+                                          json.dumps(request) if request is not None else None))
+
+    def load_limits(self, account_id):
+        with self._lock:
+            if account_id in self._pending_limits:
+                return self._pending_limits[account_id]
+            row = self._conn.execute("SELECT state FROM limits WHERE account_id = ?", (account_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_limits(self, account_id, state):
+        with self._lock:
+            self._pending_limits[account_id] = state
+
+    def iter_events(self, account_id):
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT ts, kind, amount, balance FROM events WHERE account_id = ? AND seq > ? ORDER BY seq",
+                (account_id, self._watermark()))
+            return iter(rows.fetchall())
+
+    def iter_history(self, account_id):
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT ts, kind, amount, balance FROM events WHERE account_id = ? AND seq <= ? ORDER BY seq",
+                (account_id, self._watermark()))
+            return iter(rows.fetchall())
+
+    def delete_account(self, account_id):
+        with self._lock:
+            self.flush()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT pin, balance FROM accounts WHERE account_id = ?", (account_id,)).fetchone()
+                if row is not None:
+                    # Set aside until the next snapshot, so restore() can undo the reset
+                    dropped = self._conn.execute(
+                        "SELECT generation FROM dropped WHERE account_id = ?", (account_id,)).fetchone()
+                    self._conn.execute("DELETE FROM retired_events WHERE account_id = ?", (account_id,))
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO retired_accounts (account_id, pin, balance, dropped) "
+                        "VALUES (?, ?, ?, ?)", (account_id, row[0], row[1], dropped[0] if dropped else None))
+                    self._conn.execute(
+                        "INSERT INTO retired_events SELECT seq, account_id, ts, kind, amount, balance "
+                        "FROM events WHERE account_id = ?", (account_id,))
+                self._conn.execute("DELETE FROM events WHERE account_id = ?", (account_id,))
+                self._conn.execute("DELETE FROM accounts WHERE account_id = ?", (account_id,))
+                self._conn.execute("DELETE FROM requests WHERE account_id = ?", (account_id,))
+                # Withdrawal limits stay: a reset must not clear them
+                # The current snapshot no longer describes this account
+                self._conn.execute("INSERT OR REPLACE INTO dropped (account_id, generation) VALUES (?, ?)",
+                                   (account_id, self._generation()))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def snapshot_state(self, account_id):
+        with self._lock:
+            if self.snapshot is None:
+                return None
+            row = self._conn.execute(
+                "SELECT generation FROM dropped WHERE account_id = ?", (account_id,)).fetchone()
+            if row is not None and row[0] >= self.snapshot.generation:
+                return None
+            return self.snapshot.get(account_id)
+
+    def checkpoint(self):
+        with self._lock:
+            if self._closed:
+                return None
+            self.flush()
+            generation = self._generation() + 1
+            row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+            watermark = row[0] if row else 0
+            accounts = self._conn.execute(
+                "SELECT account_id, pin, balance FROM accounts ORDER BY account_id").fetchall()
+            write_snapshot(self.snapshot_path, generation, watermark,
+                           ((account_id, pin, balance, self.load_ledger(account_id, history=False))
+                            for account_id, pin, balance in accounts))
+            previous, self.snapshot = self.snapshot, Snapshot(self.snapshot_path)
+            if previous is not None:
+                previous.close()
+
+            # The snapshot is durable. The events it covers are kept for
+            # the history; only their replay is skipped from now on
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM dropped WHERE generation < ?", (generation,))
+            self._conn.execute("DELETE FROM requests WHERE expires < ?", (time.time(),))
+            # Reset accounts are not in the new snapshot: their resets are final now
+            self._conn.execute("DELETE FROM retired_accounts")
+            self._conn.execute("DELETE FROM retired_events")
+            self._conn.execute("COMMIT")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._since_snapshot = 0
+            return self.snapshot
+
+    def restorable(self, account_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pin, balance FROM retired_accounts WHERE account_id = ?", (account_id,)).fetchone()
+            return tuple(row) if row is not None else None
+
+    def undo_reset(self, account_id):
+        with self._lock:
+            self.flush()
+            if self._conn.execute("SELECT 1 FROM accounts WHERE account_id = ?", (account_id,)).fetchone():
+                raise NothingToRestore("This account is in use again, so its reset cannot be undone.")
+            if not self._unretire(account_id):
+                raise NothingToRestore()
+
+    def _unretire(self, account_id):
+        """Undo the account's reset if it was reset since the latest snapshot"""
+        retired = self._conn.execute(
+            "SELECT pin, balance, dropped FROM retired_accounts WHERE account_id = ?", (account_id,)).fetchone()
+        if retired is None:
+            return False
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Anything logged since the reset belongs to the account that replaced it
+            self._conn.execute("DELETE FROM events WHERE account_id = ?", (account_id,))
+            self._conn.execute("DELETE FROM requests WHERE account_id = ?", (account_id,))
+            self._conn.execute(
+                "INSERT INTO events SELECT seq, account_id, ts, kind, amount, balance "
+                "FROM retired_events WHERE account_id = ?", (account_id,))
+            self._conn.execute(
+                "INSERT INTO accounts (account_id, pin, balance) VALUES (?, ?, ?) "
+                "ON CONFLICT(account_id) DO UPDATE SET pin = excluded.pin, balance = excluded.balance",
+                (account_id, retired[0], retired[1]))
+            if retired[2] is None:
+                self._conn.execute("DELETE FROM dropped WHERE account_id = ?", (account_id,))
+            else:
+                self._conn.execute("INSERT OR REPLACE INTO dropped (account_id, generation) VALUES (?, ?)",
+                                   (account_id, retired[2]))
+            self._conn.execute("DELETE FROM retired_events WHERE account_id = ?", (account_id,))
+            self._conn.execute("DELETE FROM retired_accounts WHERE account_id = ?", (account_id,))
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return True
+
+    def restore(self, account_id=None):
+        with self._lock:
+            self.flush()
+            if account_id is not None and self._unretire(account_id):
+                return
+            if self.snapshot is None:
+                raise NoSnapshot()
+            watermark = self.snapshot.watermark
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if account_id is None:
+                    self._conn.execute("DELETE FROM events WHERE seq > ?", (watermark,))
+                    self._conn.execute("DELETE FROM accounts")
+                    self._conn.execute("DELETE FROM dropped")
+                    self._conn.execute("DELETE FROM requests")
+                    self._conn.execute("DELETE FROM retired_accounts")
+                    self._conn.execute("DELETE FROM retired_events")
+                    self._conn.executemany(
+                        "INSERT INTO accounts (account_id, pin, balance) VALUES (?, ?, ?)",
+                        ((saved[0], saved[1], saved[2]) for saved in self.snapshot))
+                else:
+                    state = self.snapshot.get(account_id)
+                    self._conn.execute("DELETE FROM events WHERE account_id = ? AND seq > ?",
+                                       (account_id, watermark))
+                    self._conn.execute("DELETE FROM dropped WHERE account_id = ?", (account_id,))
+                    self._conn.execute("DELETE FROM requests WHERE account_id = ?", (account_id,))
+                    if state is None:
+                        self._conn.execute("DELETE FROM accounts WHERE account_id = ?", (account_id,))
+                    else:
+                        self._conn.execute(
+                            "INSERT INTO accounts (account_id, pin, balance) VALUES (?, ?, ?) "
+                            "ON CONFLICT(account_id) DO UPDATE SET pin = excluded.pin, balance = excluded.balance",
+                            (account_id, state[0], state[1]))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def flush(self):
+        with self._lock:
+            if self._closed or not (self._pending_events or self._pending_accounts
+                                    or self._pending_results or self._pending_limits):
+                return
+            # The buffers are only cleared once the commit succeeds, so a
+            # failed flush leaves everything queued for the next attempt
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT INTO events (account_id, ts, kind, amount, balance) VALUES (?, ?, ?, ?, ?)",
+                    self._pending_events)
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO requests (account_id, key, kind, amount, balance, expires, request) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_results)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO limits (account_id, state) VALUES (?, ?)",
+                    [(account_id, json.dumps(state)) for account_id, state in self._pending_limits.items()])
+                self._conn.executemany(
+                    "INSERT INTO accounts (account_id, pin, balance) VALUES (?, ?, ?) "
+                    "ON CONFLICT(account_id) DO UPDATE SET pin = excluded.pin, balance = excluded.balance",
+                    [(account_id, pin, balance) for account_id, (pin, balance) in self._pending_accounts.items()])
+                self._conn.execute("COMMIT")
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._pending_accounts = {}
+            self._pending_events = []
+            self._pending_results = []
+            self._pending_limits = {}
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self.flush()
+            self._closed = True
+            self._conn.close()
+            if self.snapshot is not None:
+                self.snapshot.close()
+
+
+def open_storage(spec=None):
+    """Open a backend from a spec such as "memory" or "sqlite:atm.db"."""
+    if spec is None:
+        spec = os.environ.get("ATM_STORAGE", "memory")
+    if spec == "memory":
+        return MemoryStorage()
+    if spec.startswith("sqlite:"):
+        return SQLiteStorage(spec[len("sqlite:"):] or "atm.db")
+    raise ValueError(f"Unknown storage backend: {spec}")
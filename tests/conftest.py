@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from accounts import AccountManager  # noqa: E402
+from core import ATMCore  # noqa: E402
+from limits import WithdrawalLimits  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+PIN = "1234"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "atm.db"), snapshot_every=0)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def core(storage):
+    """Core over SQLite with a cheap PIN hash and a 500/day limit"""
+    return ATMCore(AccountManager(storage), pin_iterations=1000,
+                   limits=WithdrawalLimits(storage, daily_limit=500, daily_count=0, window_limit=0, window_count=0))
+
+
+@pytest.fixture
+def account(core):
+    core.create_pin("alice", PIN)
+    core.deposit("alice", PIN, 1000)
+    return "alice"
@@ -0,0 +1,50 @@
+import pytest
+
+from core import ATMCore, validate_amount
+from errors import InvalidAmount
+from events import DEPOSIT, MAX_AMOUNT
+from ledger import Ledger
+
+from conftest import PIN
+
+
+@pytest.mark.parametrize("amount", [0, -5, 1.5, True, "abc", None, MAX_AMOUNT + 1, "100000000000000000000"])
+def test_validate_amount_rejects(amount):
+    with pytest.raises(InvalidAmount):
+        validate_amount(amount)
+
+
+@pytest.mark.parametrize("amount, expected", [(1, 1), ("42", 42), (7.0, 7), (MAX_AMOUNT, MAX_AMOUNT)])
+def test_validate_amount_accepts(amount, expected):
+    assert validate_amount(amount) == expected
+
+
+def test_oversized_deposit_leaves_account_usable():
+    core = ATMCore(pin_iterations=1000)
+    core.create_pin("z", PIN)
+    with pytest.raises(InvalidAmount):
+        core.deposit("z", PIN, "100000000000000000000")
+    assert core.deposit("z", PIN, 5).balance == 5
+    assert core.check_balance("z", PIN).balance == 5
+
+
+def test_balance_cannot_pass_int64():
+    core = ATMCore(pin_iterations=1000)
+    core.create_pin("z", PIN)
+    core.deposit("z", PIN, MAX_AMOUNT)
+    with pytest.raises(InvalidAmount):
+        core.deposit("z", PIN, 1)
+    ledger = core.ledger("z")
+    assert core.balance("z") == MAX_AMOUNT
+    assert len(ledger.timestamps) == len(ledger.amounts) == len(ledger.balances)
+
+
+def test_ledger_append_is_all_or_nothing():
+    ledger = Ledger()
+    ledger.append(DEPOSIT, 5, 5, 1.0)
+    with pytest.raises(OverflowError):
+        ledger.append(DEPOSIT, 2 ** 64, 5, 2.0)
+    assert len(ledger) == 1
+    assert [len(column) for column in (ledger.timestamps, ledger.kinds, ledger.amounts, ledger.balances)] == [1] * 4
+    ledger.append(DEPOSIT, 1, 6, 3.0)
+    assert ledger.stats.deposit_count == 2
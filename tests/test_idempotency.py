@@ -0,0 +1,54 @@
+import pytest
+
+from accounts import AccountManager
+from core import ATMCore
+from errors import IdempotencyConflict
+from storage import SQLiteStorage
+
+from conftest import PIN
+
+
+def test_replay_returns_first_result(core, account):
+    first = core.deposit(account, PIN, 50, idempotency_key="k")
+    again = core.deposit(account, PIN, 50, idempotency_key="k")
+    assert again.values() == first.values()
+    assert core.balance(account) == 1050
+
+
+@pytest.mark.parametrize("call", [
+    lambda core, a: core.deposit(a, PIN, 51, idempotency_key="k"),
+    lambda core, a: core.withdraw(a, PIN, 50, idempotency_key="k"),
+])
+def test_key_reused_for_another_request_conflicts(core, account, call):
+    core.deposit(account, PIN, 50, idempotency_key="k")
+    with pytest.raises(IdempotencyConflict):
+        call(core, account)
+    assert core.balance(account) == 1050
+
+
+def test_transfer_key_is_bound_to_recipient(core, account):
+    core.create_pin("bob", PIN)
+    core.create_pin("carol", PIN)
+    core.transfer(account, PIN, "bob", 10, idempotency_key="t")
+    with pytest.raises(IdempotencyConflict):
+        core.transfer(account, PIN, "carol", 10, idempotency_key="t")
+    assert core.balance("carol") == 0
+
+
+def test_replay_after_restart(tmp_path):
+    path = str(tmp_path / "atm.db")
+    storage = SQLiteStorage(path, snapshot_every=0)
+    core = ATMCore(AccountManager(storage), pin_iterations=1000)
+    core.create_pin("a", PIN)
+    core.deposit("a", PIN, 100, idempotency_key="k")
+    storage.close()
+
+    storage = SQLiteStorage(path, snapshot_every=0)
+    try:
+        core = ATMCore(AccountManager(storage), pin_iterations=1000)
+        assert core.deposit("a", PIN, 100, idempotency_key="k").balance == 100
+        with pytest.raises(IdempotencyConflict):
+            core.deposit("a", PIN, 5, idempotency_key="k")
+        assert core.balance("a") == 100
+    finally:
+        storage.close()
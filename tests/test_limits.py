@@ -0,0 +1,34 @@
+from limits import WithdrawalLimits
+from rollups import DAY, period_bounds
+
+NOON = period_bounds(1_700_000_000, DAY)[0] + 12 * 3600
+
+
+def limits():
+    return WithdrawalLimits(daily_limit=1000, daily_count=0, window_limit=300, window_count=0, window_seconds=3600)
+
+
+def test_release_undoes_the_reservation():
+    limiter = limits()
+    reserved = limiter.reserve("a", 200, now=NOON)
+    assert limiter.remaining("a", now=NOON) == 100
+    limiter.release("a", 200, reserved, now=NOON)
+    assert limiter.remaining("a", now=NOON) == 300
+
+
+def test_release_after_the_bucket_expired_leaves_the_window_alone():
+    limiter = limits()
+    early = limiter.reserve("a", 200, now=NOON)
+    later = NOON + 3600
+    limiter.reserve("a", 250, now=later)
+    limiter.release("a", 200, early, now=later)
+    assert limiter.remaining("a", now=later) == 50
+
+
+def test_release_across_midnight_does_not_credit_the_new_day():
+    limiter = WithdrawalLimits(daily_limit=500, daily_count=0, window_limit=0, window_count=0)
+    midnight = period_bounds(NOON, DAY)[1]
+    reserved = limiter.reserve("a", 400, now=midnight - 1)
+    limiter.reserve("a", 450, now=midnight + 1)
+    limiter.release("a", 400, reserved, now=midnight + 1)
+    assert limiter.remaining("a", now=midnight + 1) == 50
@@ -0,0 +1,96 @@
+import pytest
+
+from accounts import AccountManager
+from core import ATMCore
+from errors import InvalidPin, NothingToRestore, WithdrawalLimitExceeded
+from limits import WithdrawalLimits
+from storage import SQLiteStorage
+
+from conftest import PIN
+
+
+def test_undo_reset_brings_back_balance_and_history(core, account):
+    core.withdraw(account, PIN, 100)
+    history = len(core.ledger(account))
+    core.reset(account)
+    assert not core.has_pin(account)
+    with pytest.raises(InvalidPin):
+        core.verify_restore_pin(account, "9999")
+    core.verify_restore_pin(account, PIN)
+    core.restore(account)
+    assert core.balance(account) == 900
+    assert len(core.ledger(account)) == history
+
+
+def test_restore_cannot_roll_back_a_live_account(core, storage, account):
+    storage.checkpoint()
+    core.withdraw(account, PIN, 500)
+    with pytest.raises(NothingToRestore):
+        core.restore(account)
+    assert core.balance(account) == 500
+
+
+def test_undo_reset_refused_once_id_is_taken_again(core, account):
+    core.reset(account)
+    core.create_pin(account, "5555")
+    with pytest.raises(NothingToRestore):
+        core.restore(account)
+
+
+def test_reset_does_not_clear_withdrawal_limits(core, account):
+    core.withdraw(account, PIN, 300)
+    core.withdraw(account, PIN, 200)
+    core.reset(account)
+    core.verify_restore_pin(account, PIN)
+    core.restore(account)
+    assert core.limits.remaining(account) == 0
+    with pytest.raises(WithdrawalLimitExceeded):
+        core.withdraw(account, PIN, 400)
+
+
+def test_reset_keeps_other_accounts_history(core, storage, account):
+    core.create_pin("bob", PIN)
+    core.deposit("bob", PIN, 10)
+    storage.checkpoint()
+    core.deposit("bob", PIN, 20)
+    core.reset(account)
+    assert len(core.ledger("bob")) == 3
+
+
+def test_history_survives_checkpoint_and_restart(tmp_path):
+    path = str(tmp_path / "atm.db")
+    storage = SQLiteStorage(path, snapshot_every=0)
+    core = ATMCore(AccountManager(storage), pin_iterations=1000)
+    core.create_pin("a", PIN)
+    core.deposit("a", PIN, 10)
+    core.deposit("a", PIN, 20)
+    storage.checkpoint()
+    core.withdraw("a", PIN, 5)
+    before = core.ledger("a")
+    expected = (len(before), before.stats.state(), before.rollups.state())
+    storage.close()
+
+    storage = SQLiteStorage(path, snapshot_every=0)
+    try:
+        ledger = ATMCore(AccountManager(storage), pin_iterations=1000).ledger("a")
+        assert (len(ledger), ledger.stats.state(), ledger.rollups.state()) == expected
+        assert ledger.stats.deposit_count == 2
+    finally:
+        storage.close()
+
+
+def test_limits_survive_restart(tmp_path):
+    path = str(tmp_path / "atm.db")
+    for attempt in range(2):
+        storage = SQLiteStorage(path, snapshot_every=0)
+        core = ATMCore(AccountManager(storage), pin_iterations=1000,
+                       limits=WithdrawalLimits(storage, daily_limit=500, daily_count=0, window_limit=0))
+        try:
+            if attempt == 0:
+                core.create_pin("a", PIN)
+                core.deposit("a", PIN, 1000)
+                core.withdraw("a", PIN, 450)
+            else:
+                assert core.limits.remaining("a") == 50
+        finally:
+            storage.close()
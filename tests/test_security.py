@@ -0,0 +1,47 @@
+import pytest
+
+from core import ATMCore
+from errors import InvalidPin, TooManyAttempts
+from security import AttemptLimiter
+
+from conftest import PIN
+
+SOURCE = "10.0.0.1"
+
+
+def test_source_is_locked_after_capacity_failures():
+    limiter = AttemptLimiter(capacity=3)
+    keys = (("account", "a"), ("source", SOURCE))
+    for _ in range(3):
+        limiter.check(keys)
+        limiter.failure(keys)
+    with pytest.raises(TooManyAttempts):
+        limiter.check((("source", SOURCE),))
+
+
+def test_own_account_success_does_not_refill_source():
+    core = ATMCore(pin_iterations=1000, limiter=AttemptLimiter(capacity=5))
+    for name in [f"victim{i}" for i in range(10)] + ["attacker"]:
+        core.create_pin(name, PIN)
+    guesses = 0
+    with pytest.raises(TooManyAttempts):
+        for i in range(10):
+            for _ in range(4):
+                with pytest.raises(InvalidPin):
+                    core.verify_pin(f"victim{i}", "0000", SOURCE)
+                guesses += 1
+            core.verify_pin("attacker", PIN, SOURCE)
+    assert guesses == 5
+
+
+def test_success_clears_the_account_key():
+    core = ATMCore(pin_iterations=1000, limiter=AttemptLimiter(capacity=5))
+    core.create_pin("a", PIN)
+    for _ in range(4):
+        with pytest.raises(InvalidPin):
+            core.verify_pin("a", "0000")
+    core.verify_pin("a", PIN)
+    for _ in range(4):
+        with pytest.raises(InvalidPin):
+            core.verify_pin("a", "0000")
+
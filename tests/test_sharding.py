@@ -0,0 +1,89 @@
+import pytest
+
+from accounts import AccountManager
+from core import ATMCore
+from errors import InsufficientFunds, InvalidPin, UnknownAccount
+from sharding import Shard, ShardedCore, shard_of
+
+from conftest import PIN
+
+
+@pytest.fixture
+def shards():
+    """Two in-process shards holding a funded payer and a payee"""
+    payer, payee = Shard(ATMCore(AccountManager(), pin_iterations=1000)), Shard(ATMCore(AccountManager(), pin_iterations=1000))
+    payer.core.create_pin("a", PIN)
+    payer.core.deposit("a", PIN, 100)
+    payee.core.create_pin("b", PIN)
+    return payer, payee
+
+
+def test_commit_moves_funds(shards):
+    payer, payee = shards
+    payer.prepare_debit("t:debit", "a", PIN, 30)
+    payee.prepare_credit("t:credit", "b", 30)
+    assert payer.commit("t:debit") == 70
+    assert payee.commit("t:credit") == 30
+    assert not payer.held and not payer.prepared
+
+
+def test_abort_releases_the_hold(shards):
+    payer, payee = shards
+    payer.prepare_debit("t:debit", "a", PIN, 80)
+    with pytest.raises(InsufficientFunds):
+        payer.handle("withdraw", ("a", PIN, 50, None, None))
+    payer.abort("t:debit")
+    payee.abort("t:credit")
+    assert payer.core.balance("a") == 100
+    assert not payer.held
+
+
+def test_hold_is_not_revealed_to_a_wrong_pin(shards):
+    payer, _ = shards
+    payer.prepare_debit("t:debit", "a", PIN, 80)
+    with pytest.raises(InvalidPin):
+        payer.handle("withdraw", ("a", "0000", 50, None, None))
+
+
+def test_credit_refused_after_payee_reset(shards):
+    payer, payee = shards
+    payer.prepare_debit("t:debit", "a", PIN, 30)
+    payee.prepare_credit("t:credit", "b", 30)
+    payee.core.reset("b")
+    payer.commit("t:debit")
+    with pytest.raises(UnknownAccount):
+        payee.commit("t:credit")
+    payer.refund("a", 30)
+    assert payer.core.balance("a") == 100
+
+
+def test_prepare_debit_replays_a_committed_key(shards):
+    payer, _ = shards
+    assert payer.prepare_debit("t1:debit", "a", PIN, 30, None, "k", "b") is None
+    payer.commit("t1:debit")
+    assert payer.prepare_debit("t2:debit", "a", PIN, 30, None, "k", "b")[3] == 70
+    assert not payer.prepared
+
+
+def _pair(shard_count):
+    ids = [f"user{i}" for i in range(50)]
+    return (next(i for i in ids if shard_of(i, shard_count) == 0),
+            next(i for i in ids if shard_of(i, shard_count) == 1))
+
+
+def test_cross_shard_transfer_commit_and_abort():
+    core = ShardedCore(shards=2, storage="memory", pin_iterations=1000)
+    try:
+        a, b = _pair(2)
+        for account_id in (a, b):
+            core.create_pin(account_id, PIN)
+        core.deposit(a, PIN, 100)
+        assert core.transfer(a, PIN, b, 40, idempotency_key="k").balance == 60
+        assert core.transfer(a, PIN, b, 40, idempotency_key="k").balance == 60
+        with pytest.raises(InsufficientFunds):
+            core.transfer(a, PIN, b, 500)
+        with pytest.raises(UnknownAccount):
+            core.transfer(a, PIN, "nobody-" + b, 5)
+        assert (core.balance(a), core.balance(b)) == (60, 40)
+    finally:
+        core.close()